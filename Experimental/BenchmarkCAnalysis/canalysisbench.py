@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Compare the libclang and scanner C analysis engines on the C system test projects,
+both on preprocessed source with Fab's include pragmas, and in single pass mode on the original source.
+
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import shutil
+import time
+
+from fab.artefacts import ArtefactSet
+from fab.build_config import BuildConfig, FlagsConfig
+from fab.parse.c import CAnalyser
+from fab.steps.c_pragma_injector import c_pragma_injector
+from fab.steps.find_source_files import find_source_files
+from fab.steps.grab.folder import grab_folder
+from fab.steps.preprocess import preprocess_c
+from fab.tools import ToolBox
+
+_ITERATIONS = 20
+
+_SYSTEM_TESTS = Path(__file__).parents[2] / 'tests' / 'system_tests'
+_PROJECTS = ['CFortranInterop', 'CUserHeader']
+
+
+def preprocessed_files(workspace, project):
+    with BuildConfig(fab_workspace=workspace, tool_box=ToolBox(), project_label=project,
+                     multiprocessing=False) as config:
+        grab_folder(config, _SYSTEM_TESTS / project / 'project-source')
+        find_source_files(config)
+        c_pragma_injector(config)
+        preprocess_c(config)
+    return sorted(config.artefact_store[ArtefactSet.PREPROCESSED_C])
+
+
+def bench(config, files, single_pass, engine):
+    analyser = CAnalyser(single_pass=single_pass, engine=engine,
+                         flags=FlagsConfig(common_flags=['-I', str(config.source_root)]))
+    analyser._config = config
+
+    elapsed = 0.0
+    for iteration in range(_ITERATIONS):
+        # no prebuilds
+        shutil.rmtree(config.prebuild_folder, ignore_errors=True)
+        config.prebuild_folder.mkdir(parents=True)
+        start_time = time.perf_counter()
+        results = [analyser.run(fpath)[0] for fpath in files]
+        elapsed += time.perf_counter() - start_time
+
+    return elapsed / _ITERATIONS, results
+
+
+def main():
+    with TemporaryDirectory() as workspace:
+        for project in _PROJECTS:
+            preprocessed = preprocessed_files(Path(workspace) / 'pre', project)
+            config = BuildConfig(fab_workspace=Path(workspace) / 'bench', tool_box=ToolBox(), project_label=project)
+            original = sorted((_SYSTEM_TESTS / project / 'project-source').glob('*.c'))
+
+            for mode, files, single_pass in [('pragmas', preprocessed, False), ('single pass', original, True)]:
+                clang_time, clang_results = bench(config, files, single_pass, 'libclang')
+                scanner_time, scanner_results = bench(config, files, single_pass, 'scanner')
+                agree = [
+                    (a.symbol_defs, a.symbol_deps) == (b.symbol_defs, b.symbol_deps)
+                    for a, b in zip(clang_results, scanner_results)]
+                print(f"{project.ljust(16)} {mode.ljust(12)} "
+                      f"libclang {clang_time * 1000:7.2f}ms  scanner {scanner_time * 1000:7.2f}ms  "
+                      f"speedup {clang_time / scanner_time:5.1f}x  agree {all(agree)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Time the set operations compile_fortran does with its uncompiled files, for an LFRic sized build,
+using the cached AnalysedFile hash and the previous hash of every sorted field.
+
+"""
+from pathlib import Path
+import time
+
+from fab.parse.fortran import AnalysedFortran
+
+_NUM_FILES = 20000
+_NUM_SYMBOLS = 20
+_NUM_PASSES = 30
+
+
+def field_hash(analysed_file):
+    # the previous AnalysedFile.__hash__
+    things = set()
+    for field_name in analysed_file.field_names():
+        thing = getattr(analysed_file, field_name)
+        if isinstance(thing, dict):
+            things.add(tuple(sorted(thing.items())))
+        elif isinstance(thing, set):
+            things.add(tuple(sorted(thing)))
+        else:
+            things.add(thing)
+    return hash(tuple(things))
+
+
+class FieldHashedFortran(AnalysedFortran):
+    __slots__ = ()
+
+    def __hash__(self):
+        return field_hash(self)
+
+
+def make_files(cls):
+    files = []
+    for i in range(_NUM_FILES):
+        files.append(cls(
+            fpath=Path(f'/lfric/build_output/src/file_{i}.f90'), file_hash=i,
+            module_defs=[f'mod_{i}'], symbol_defs=[f'mod_{i}'] + [f'sym_{i}_{j}' for j in range(_NUM_SYMBOLS)],
+            module_deps=[f'mod_{(i * 7 + j) % _NUM_FILES}' for j in range(_NUM_SYMBOLS)],
+            symbol_deps=[f'mod_{(i * 7 + j) % _NUM_FILES}' for j in range(_NUM_SYMBOLS)] +
+                        [f'sym_{(i * 7 + j) % _NUM_FILES}_{j}' for j in range(_NUM_SYMBOLS)],
+            file_deps=[Path(f'/lfric/build_output/src/file_{(i * 7 + j) % _NUM_FILES}.f90')
+                       for j in range(_NUM_SYMBOLS)],
+        ))
+    return files
+
+
+def compile_passes(files):
+    # like compile_fortran, remove a batch of compiled files from the uncompiled set on every pass
+    uncompiled = set(files)
+    batch = len(files) // _NUM_PASSES + 1
+    while uncompiled:
+        compiled = set(list(uncompiled)[:batch])
+        uncompiled = set(filter(lambda af: af not in compiled, uncompiled))
+
+
+def main():
+    for name, cls in [('field hash', FieldHashedFortran), ('cached hash', AnalysedFortran)]:
+        files = make_files(cls)
+        start_time = time.perf_counter()
+        compile_passes(files)
+        print(f"{name.rjust(12)} - {time.perf_counter() - start_time:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -82,7 +82,7 @@ class ArtefactStore(dict):
         self[collection].update(files)
 
     def update_dict(self, collection: Union[str, ArtefactSet],
-                    key: str, values: Union[str, Iterable]):
+                    key: Optional[str], values: Union[str, Iterable]):
         '''For ArtefactSets that are a dictionary of sets: update
         the set with the specified values.
         :param collection: the name of the collection to add this to.
@@ -275,3 +275,88 @@ class FilterBuildTrees(ArtefactsGetter):
                                                    suffixes=self.suffixes)
 
         return build_lists
+
+
+class BuildPlan():
+    """
+    The files to compile for all build targets, with each file held once.
+
+    Files which are in several targets' build lists, such as a shared library of modules, only appear once
+    in :attr:`units`. A membership bitmap for each target records which units it needs.
+
+    Example::
+
+        build_plan = BuildPlan(FilterBuildTrees(suffix='.c')(artefact_store))
+        compiled = [compile(unit) for unit in build_plan.units]
+
+    """
+    def __init__(self, build_lists: Optional[Dict[Optional[str], Iterable[AnalysedDependent]]] = None):
+        """
+        :param build_lists:
+            The files to compile for each target, as returned by :class:`FilterBuildTrees`.
+
+        """
+        self.units: List[AnalysedDependent] = []
+        self._unit_ids: Dict[Path, int] = {}
+        self._membership: Dict[Optional[str], bytearray] = {}
+
+        for target, files in (build_lists or {}).items():
+            self.add_target(target, files)
+
+    @classmethod
+    def from_build_lists(cls, build_lists) -> 'BuildPlan':
+        """Make a build plan from per-target build lists, unless we've already been given one."""
+        if isinstance(build_lists, BuildPlan):
+            return build_lists
+        return cls(build_lists)
+
+    def add_target(self, target: Optional[str], files: Iterable[AnalysedDependent]):
+        """
+        Add the files needed by a target. Files already in the plan are not added again.
+
+        """
+        membership = self._membership.setdefault(target, bytearray())
+        for analysed_file in files:
+            unit_id = self._unit_ids.get(analysed_file.fpath)
+            if unit_id is None:
+                unit_id = len(self.units)
+                self._unit_ids[analysed_file.fpath] = unit_id
+                self.units.append(analysed_file)
+            if unit_id >= len(membership):
+                membership.extend(bytes(unit_id + 1 - len(membership)))
+            membership[unit_id] = 1
+
+    @property
+    def targets(self) -> List[Optional[str]]:
+        return list(self._membership)
+
+    def __len__(self):
+        return len(self.units)
+
+    def __iter__(self):
+        return iter(self.units)
+
+    def target_units(self, target: Optional[str]) -> List[AnalysedDependent]:
+        """The files needed by the given target."""
+        membership = self._membership[target]
+        return [self.units[unit_id] for unit_id, member in enumerate(membership) if member]
+
+    def unit_targets(self, fpath: Path) -> List[Optional[str]]:
+        """The targets which need the given file."""
+        unit_id = self._unit_ids[fpath]
+        return [target for target, membership in self._membership.items()
+                if unit_id < len(membership) and membership[unit_id]]
+
+    def target_outputs(self, outputs: Dict[Path, Path]) -> Dict[Optional[str], List[Path]]:
+        """
+        Distribute the outputs of compiling each file, such as object files, to the targets which need them.
+
+        :param outputs:
+            The output file for each compiled file.
+
+        """
+        unit_outputs = [outputs[unit.fpath] for unit in self.units]
+        return {
+            target: [unit_outputs[unit_id] for unit_id, member in enumerate(membership) if member]
+            for target, membership in self._membership.items()
+        }
@@ -10,18 +10,22 @@ Contains the :class:`~fab.build_config.BuildConfig` and helper classes.
 import getpass
 import logging
 import os
+import re
 import sys
 import warnings
 from datetime import datetime
 from fnmatch import fnmatch
+from fnmatch import translate as fnmatch_translate
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
 from multiprocessing import cpu_count
 from pathlib import Path
 from string import Template
-from typing import List, Optional, Iterable
+from typing import Dict, List, Optional, Iterable, Pattern, Tuple, Union
 
 from fab.artefacts import ArtefactSet, ArtefactStore
-from fab.constants import BUILD_OUTPUT, SOURCE_ROOT, PREBUILD
+from fab.compile_prediction import update_compile_history
+from fab.constants import BUILD_OUTPUT, SOURCE_ROOT, PREBUILD, TWO_STAGE_AUTO
 from fab.metrics import send_metric, init_metrics, stop_metrics, metrics_summary
 from fab.tools.category import Category
 from fab.tools.tool_box import ToolBox
@@ -43,7 +47,7 @@ class BuildConfig():
                  tool_box: ToolBox,
                  multiprocessing: bool = True, n_procs: Optional[int] = None,
                  reuse_artefacts: bool = False,
-                 fab_workspace: Optional[Path] = None, two_stage=False,
+                 fab_workspace: Optional[Path] = None, two_stage: Union[bool, str] = False,
                  verbose=False):
         """
         :param project_label:
@@ -63,17 +67,22 @@ class BuildConfig():
             If not set, and FAB_WORKSPACE is not set, the fab workspace defaults to *~/fab-workspace*.
         :param two_stage:
             Compile .mod files first in a separate pass. Theoretically faster in some projects..
+            Use 'auto' to let the Fortran compile step predict which is faster, from the shape of the
+            module dependency graph and the compile times of the previous build.
         :param verbose:
             DEBUG level logging.
 
         """
+        if isinstance(two_stage, str) and two_stage != TWO_STAGE_AUTO:
+            raise ValueError(f"two_stage must be True, False or '{TWO_STAGE_AUTO}', not '{two_stage}'")
+
         self._tool_box = tool_box
         self.two_stage = two_stage
         self.verbose = verbose
         compiler = tool_box[Category.FORTRAN_COMPILER]
         project_label = Template(project_label).safe_substitute(
             compiler=compiler.name,
-            two_stage=f'{int(two_stage)+1}stage')
+            two_stage=f'{two_stage}stage' if two_stage == TWO_STAGE_AUTO else f'{int(two_stage)+1}stage')
 
         self.project_label: str = project_label.replace(' ', '_')
 
@@ -221,6 +230,7 @@ class BuildConfig():
         send_metric('run', 'machine', os.uname().machine)
         send_metric('run', 'user', getpass.getuser())
         stop_metrics()
+        update_compile_history(metrics_folder=self.metrics_folder)
         metrics_summary(metrics_folder=self.metrics_folder)
 
 
@@ -313,10 +323,109 @@ class FlagsConfig():
         # We COULD make the user pass these template params to the constructor
         # but we have a design requirement to minimise the config burden on the user,
         # so we take care of it for them here instead.
-        params = {'source': config.source_root, 'output': config.build_output}
-        flags = [Template(i).substitute(params) for i in self.common_flags]
+        # Only plain AddFlags are precompiled. Subclasses may override run(), so they're always run.
+        plain = [type(flags_modifier) is AddFlags for flags_modifier in self.path_flags]
+        rules = (
+            tuple(self.common_flags),
+            tuple((flags_modifier.match, tuple(flags_modifier.flags))
+                  for flags_modifier, is_plain in zip(self.path_flags, plain) if is_plain),
+        )
+        matcher = _path_flags_matcher(rules, config.source_root, config.build_output)
+        if all(plain):
+            return matcher.flags_for_path(path)
+
+        # apply the modifiers in order, using the matcher for the plain ones
+        matched = set(matcher.matching_rules(path))
+        flags = matcher.common_flags
+        rule = 0
+        for flags_modifier, is_plain in zip(self.path_flags, plain):
+            if is_plain:
+                if rule in matched:
+                    flags += matcher.rule_flags(rule, path)
+                rule += 1
+            else:
+                flags_modifier.run(path, flags, config=config)
+        return flags
 
-        for flags_modifier in self.path_flags:
-            flags_modifier.run(path, flags, config=config)
 
-        return flags
+@lru_cache(maxsize=16)
+def _path_flags_matcher(rules, source_root: Path, build_output: Path) -> '_PathFlagsMatcher':
+    # Cached so that each process only compiles the rules once, however many files it handles.
+    common_flags, path_flags = rules
+    return _PathFlagsMatcher(common_flags, path_flags, source_root=source_root, build_output=build_output)
+
+
+class _PathFlagsMatcher():
+    """
+    Resolves the flags for each path, as :meth:`FlagsConfig.flags_for_path`, from precompiled rules.
+
+    The match patterns are templated and compiled to regular expressions once, and all the patterns which
+    don't use `$relative` are also combined into a single regular expression, to quickly skip files
+    which match none of them. The flags are memoised for each folder and set of matching rules.
+
+    """
+    def __init__(self, common_flags, path_flags, source_root: Path, build_output: Path):
+        self._params = {'source': source_root, 'output': build_output}
+        self._common_flags = [Template(i).substitute(self._params) for i in common_flags]
+        self._path_flags = path_flags
+
+        # rules without a match pattern apply to every file
+        self._always = []
+        # match patterns which don't depend on the file's folder
+        self._static: List[Tuple[int, Pattern]] = []
+        # match patterns which use $relative, so must be templated for each folder
+        self._dynamic: List[int] = []
+        for i, (match, _) in enumerate(path_flags):
+            if not match:
+                self._always.append(i)
+                continue
+            try:
+                pattern = Template(match).substitute(self._params)
+            except KeyError:
+                self._dynamic.append(i)
+                continue
+            self._static.append((i, re.compile(fnmatch_translate(os.path.normcase(pattern)))))
+
+        self._any_static = re.compile('|'.join(f'(?:{p.pattern})' for _, p in self._static)) if self._static else None
+        self._dynamic_patterns: Dict[Tuple[Path, int], Pattern] = {}
+        self._flags: Dict[Tuple[Path, Tuple[int, ...]], List[str]] = {}
+
+    @property
+    def common_flags(self) -> List[str]:
+        return list(self._common_flags)
+
+    def rule_flags(self, rule: int, path: Path) -> List[str]:
+        # use templating to render any relative paths in the flags
+        params = {'relative': path.parent, **self._params}
+        return [Template(flag).substitute(params) for flag in self._path_flags[rule][1]]
+
+    def matching_rules(self, path: Path) -> Tuple[int, ...]:
+        fpath = os.path.normcase(str(path))
+        matched = list(self._always)
+
+        if self._any_static and self._any_static.match(fpath):
+            matched.extend(i for i, pattern in self._static if pattern.match(fpath))
+
+        for i in self._dynamic:
+            pattern = self._dynamic_patterns.get((path.parent, i))
+            if not pattern:
+                params = {'relative': path.parent, **self._params}
+                match = Template(self._path_flags[i][0]).substitute(params)
+                pattern = re.compile(fnmatch_translate(os.path.normcase(match)))
+                self._dynamic_patterns[(path.parent, i)] = pattern
+            if pattern.match(fpath):
+                matched.append(i)
+
+        # flags are added in the order of the rules
+        return tuple(sorted(matched))
+
+    def flags_for_path(self, path: Path) -> List[str]:
+        key = (path.parent, self.matching_rules(path))
+        flags = self._flags.get(key)
+        if flags is None:
+            flags = self.common_flags
+            for rule in key[1]:
+                flags += self.rule_flags(rule, path)
+            self._flags[key] = flags
+
+        return list(flags)
@@ -8,11 +8,13 @@
 '''
 
 import sys
+from argparse import ArgumentParser
 from pathlib import Path
 from typing import Dict, Optional
 
 from fab.artefacts import ArtefactSet, CollectionGetter
 from fab.build_config import BuildConfig
+from fab.rebuild_impact import impact_report
 from fab.steps.analyse import analyse
 from fab.steps.c_pragma_injector import c_pragma_injector
 from fab.steps.compile_c import compile_c
@@ -91,3 +93,23 @@ def cli_fab(folder: Optional[Path] = None, kwargs: Optional[Dict] = None):
 
     config = _generic_build_config(_folder, kwargs)
     return config
+
+
+def cli_impact(argv=None):
+    """
+    Report the files whose changes cause the most recompilation, from a previous build of a project.
+
+    The report ranks files by the number of files which depend on them, directly or indirectly,
+    and by the last known compile time of those dependents, from previous builds.
+
+    :param argv:
+        Command line arguments (Testing Only)
+
+    """
+    arg_parser = ArgumentParser(description=cli_impact.__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('metrics_folder', type=Path,
+                            help="The build's metrics folder, e.g <fab workspace>/<project>/metrics/<project>")
+    arg_parser.add_argument('--top', type=int, default=20, help='How many files to list')
+    args = arg_parser.parse_args(argv)
+
+    print(impact_report(args.metrics_folder, top=args.top))
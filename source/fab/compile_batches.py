@@ -0,0 +1,106 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Compile several source files in one compiler invocation, to save the compiler's start-up time per file.
+
+Without an output flag, the compiler names each object file after its source file, in its working folder.
+A batch is compiled in the folder of its source files, exactly as a single file is, so that relative paths
+in the flags and the folder recorded in the debug information are the same either way.
+The object files are then moved out of the source folder, to their output paths.
+
+"""
+import logging
+import shutil
+from collections import Counter
+from math import ceil
+from pathlib import Path
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def make_compile_batches(analysed_files, flags_for: Callable, batch_size: int, n_procs: int = 1) -> List[List]:
+    """
+    Group files into batches to compile together, in one compiler invocation each.
+
+    Files are only batched with files in the same folder, which have the same flags.
+    A file is not batched if another file in its folder would create an object file of the same name,
+    because batches in the same folder may be compiled at the same time.
+    Batches are kept small enough to give each process some work to do.
+
+    :param analysed_files:
+        The analysed files to compile.
+    :param flags_for:
+        A function returning the flags for a given analysed file.
+    :param batch_size:
+        The maximum number of files in a batch.
+    :param n_procs:
+        The number of processes which will compile the batches.
+
+    """
+    analysed_files = list(analysed_files)
+    object_names = Counter((af.fpath.parent, af.fpath.stem) for af in analysed_files)
+
+    batches = []
+    groups: Dict[tuple, List] = {}
+    for af in analysed_files:
+        if object_names[(af.fpath.parent, af.fpath.stem)] > 1:
+            batches.append([af])
+        else:
+            groups.setdefault((af.fpath.parent, tuple(flags_for(af))), []).append(af)
+
+    for group in groups.values():
+        size = max(1, min(batch_size, ceil(len(group) / n_procs)))
+        batches.extend(group[i:i + size] for i in range(0, len(group), size))
+
+    return batches
+
+
+def compile_batch(compiler, outputs: Dict[Path, Path], flags: List[str], **kwargs) -> bool:
+    """
+    Compile several source files in one compiler invocation, moving each object file to its output path.
+
+    :param compiler:
+        The :class:`~fab.tools.compiler.Compiler` to use.
+    :param outputs:
+        The object file path for each source file. The source files must be in the same folder,
+        and have different stems.
+    :param flags:
+        The flags for every file in the batch.
+    :param kwargs:
+        Any other arguments for the compiler's *compile_files* method.
+
+    :returns:
+        Whether the compilation succeeded. If not, the caller should compile the files individually,
+        to find which of them failed.
+
+    """
+    folders = {input_fpath.parent for input_fpath in outputs}
+    if len(folders) != 1:
+        raise ValueError(f"batched files must be in one folder, not {len(folders)}")
+    created = {input_fpath: input_fpath.with_suffix('.o') for input_fpath in outputs}
+
+    # don't overwrite anything in the source folder
+    existing = [fpath for fpath in created.values() if fpath.exists()]
+    if existing:
+        logger.info(f"not compiling a batch in {folders.pop()}, which already has object files {existing}")
+        return False
+
+    try:
+        compiler.compile_files(list(outputs), add_flags=flags, **kwargs)
+    except Exception as err:
+        logger.info(f"batch compilation of {len(outputs)} files failed, compiling them individually:\n{err}")
+        for fpath in created.values():
+            if fpath.exists():
+                fpath.unlink()
+        return False
+
+    for input_fpath, output_fpath in outputs.items():
+        if created[input_fpath].exists():
+            output_fpath.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(created[input_fpath]), str(output_fpath))
+
+    return True
@@ -0,0 +1,267 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Predict whether a two-stage Fortran compile will be faster than a single-stage compile.
+
+A single-stage compile works through the module dependency graph in passes, so a deep graph means many passes,
+each waiting for its slowest file. A two-stage compile makes the mod files first with syntax-only compiles,
+which are quicker, and starts each object compile as soon as its mod files exist, at the cost of reading every
+file twice. Which is faster depends on the depth and width of the graph and on how much quicker the syntax-only
+compiles are, so we simulate both on the analysed files.
+
+The compile times come from the history of previous builds, or are estimated from the file sizes.
+At the end of each build, the times of the files it compiled are merged into the history,
+so files which have used a prebuild for many builds keep their last known time.
+The simulations assume every file is compiled, without prebuilds or batching.
+
+"""
+import heapq
+import json
+from collections import defaultdict, namedtuple
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+from fab.metrics import JSON_FILENAME
+from fab.parse.fortran import AnalysedFortran
+from fab.util import write_if_changed
+
+FULL_METRICS_GROUP = 'compile fortran'
+SYNTAX_ONLY_METRICS_GROUP = 'compile fortran syntax-only'
+
+# the compile times of every file compiled by previous builds, in the metrics folder
+HISTORY_FILENAME = 'compile_history.json'
+
+# estimates for when there's no history
+DEFAULT_SECONDS_PER_BYTE = 2e-5
+DEFAULT_SYNTAX_ONLY_RATIO = 0.3
+
+
+# The time, in seconds, to compile each file normally and syntax-only.
+CompileTimes = namedtuple('CompileTimes', ['full', 'syntax_only'])
+
+# The predicted time, in seconds, for each strategy.
+Prediction = namedtuple('Prediction', ['single_stage', 'two_stage'])
+
+
+def load_compile_history(metrics_folder: Path) -> CompileTimes:
+    """
+    Get the time taken to compile each Fortran file, from the history of previous builds.
+
+    The metrics of the latest build are included, in case they haven't been merged into the history yet.
+
+    :param metrics_folder:
+        The project's metrics folder.
+
+    """
+    history = _read_history(metrics_folder)
+    _merge_metrics(history, metrics_folder)
+    return CompileTimes(
+        full={Path(name): value for name, value in history[FULL_METRICS_GROUP].items()},
+        syntax_only={Path(name): value for name, value in history[SYNTAX_ONLY_METRICS_GROUP].items()},
+    )
+
+
+def update_compile_history(metrics_folder: Path):
+    """
+    Merge the compile times from the latest build's metrics into the history of previous builds.
+
+    Files which used a prebuild are ignored, as they weren't compiled, and keep their time from the history.
+
+    :param metrics_folder:
+        The project's metrics folder.
+
+    """
+    history = _read_history(metrics_folder)
+    if _merge_metrics(history, metrics_folder):
+        write_if_changed(metrics_folder / HISTORY_FILENAME, json.dumps(history, indent=2, sort_keys=True))
+
+
+def _read_history(metrics_folder: Path) -> Dict[str, Dict[str, float]]:
+    history: Dict[str, Dict[str, float]] = {FULL_METRICS_GROUP: {}, SYNTAX_ONLY_METRICS_GROUP: {}}
+    try:
+        with open(metrics_folder / HISTORY_FILENAME, 'rt') as infile:
+            saved = json.load(infile)
+        for group, times in history.items():
+            times.update(saved.get(group, {}))
+    except (OSError, ValueError, AttributeError):
+        pass
+    return history
+
+
+def _merge_metrics(history: Dict[str, Dict[str, float]], metrics_folder: Path) -> bool:
+    # add the times of the files compiled by the latest build, returning whether there were any
+    try:
+        with open(metrics_folder / JSON_FILENAME, 'rt') as infile:
+            metrics = json.load(infile)
+    except (OSError, ValueError):
+        return False
+
+    merged = False
+    for group, times in history.items():
+        for name, value in metrics.get(group, {}).items():
+            if not value.get('prebuild'):
+                times[name] = value['time_taken']
+                merged = True
+    return merged
+
+
+def estimate_compile_times(analysed_files: Iterable[AnalysedFortran], history: CompileTimes) -> CompileTimes:
+    """
+    Get the compile times for every file, using the history where we have it.
+
+    Files without a history are estimated from their size, using the average compile rate of the files we do
+    have a history for. The syntax-only times are estimated from the full times, in the same way.
+
+    """
+    sizes = {af.fpath: _file_size(af.fpath) for af in analysed_files}
+
+    known = [fpath for fpath in sizes if fpath in history.full]
+    known_bytes = sum(sizes[fpath] for fpath in known)
+    if known_bytes:
+        seconds_per_byte = sum(history.full[fpath] for fpath in known) / known_bytes
+    else:
+        seconds_per_byte = DEFAULT_SECONDS_PER_BYTE
+
+    both = [fpath for fpath in known if fpath in history.syntax_only]
+    both_full = sum(history.full[fpath] for fpath in both)
+    if both_full:
+        syntax_only_ratio = sum(history.syntax_only[fpath] for fpath in both) / both_full
+    else:
+        syntax_only_ratio = DEFAULT_SYNTAX_ONLY_RATIO
+
+    full = {fpath: history.full.get(fpath, size * seconds_per_byte) for fpath, size in sizes.items()}
+    syntax_only = {fpath: history.syntax_only.get(fpath, full[fpath] * syntax_only_ratio) for fpath in sizes}
+    return CompileTimes(full=full, syntax_only=syntax_only)
+
+
+def simulate_single_stage(analysed_files: Iterable[AnalysedFortran], times: CompileTimes, n_procs: int) -> float:
+    """
+    Simulate compiling the files in passes, with each pass compiling every file whose dependencies are compiled.
+
+    """
+    deps, dependents = _dependency_graph(analysed_files)
+    waiting_for = {fpath: len(fpath_deps) for fpath, fpath_deps in deps.items()}
+    ready = [fpath for fpath, waiting in waiting_for.items() if not waiting]
+    total = 0.0
+    # files with circular dependencies never become ready, and are reported by the compile step
+    while ready:
+        total += _makespan([times.full[fpath] for fpath in ready], n_procs)
+        next_ready = []
+        for fpath in ready:
+            for dependent in dependents[fpath]:
+                waiting_for[dependent] -= 1
+                if not waiting_for[dependent]:
+                    next_ready.append(dependent)
+        ready = next_ready
+    return total
+
+
+def simulate_two_stage(analysed_files: Iterable[AnalysedFortran], times: CompileTimes, n_procs: int) -> float:
+    """
+    Simulate a pipelined two-stage compile, as done by :func:`~fab.steps.compile_fortran.compile_two_stage`.
+
+    A file's syntax-only compile starts when the syntax-only compiles of its dependencies are done,
+    and its object compile can start straight after. Files which define no modules skip the syntax-only compile.
+    Each worker takes the task which has been ready the longest.
+
+    """
+    analysed_files = list(analysed_files)
+    has_mods = {af.fpath for af in analysed_files if af.module_defs}
+    deps, dependents = _dependency_graph(analysed_files)
+    waiting_for = {fpath: len(fpath_deps) for fpath, fpath_deps in deps.items()}
+
+    # tasks are (is syntax-only, file), queued in the order they became ready
+    ready: List[Tuple[float, int, Tuple[bool, Path]]] = []
+    running: List[Tuple[float, int, Tuple[bool, Path]]] = []
+    count = 0
+
+    def push(queue, when, task):
+        nonlocal count
+        heapq.heappush(queue, (when, count, task))
+        count += 1
+
+    def start_stage1(fpath, now):
+        if fpath in has_mods:
+            push(ready, now, (True, fpath))
+        else:
+            stage1_done(fpath, now)
+
+    def stage1_done(fpath, now):
+        push(ready, now, (False, fpath))
+        for dependent in dependents[fpath]:
+            waiting_for[dependent] -= 1
+            if not waiting_for[dependent]:
+                start_stage1(dependent, now)
+
+    for fpath in [fpath for fpath, waiting in waiting_for.items() if not waiting]:
+        start_stage1(fpath, 0.0)
+
+    now = 0.0
+    free = n_procs
+    while ready or running:
+        while free and ready:
+            _, _, task = heapq.heappop(ready)
+            syntax_only, fpath = task
+            duration = times.syntax_only[fpath] if syntax_only else times.full[fpath]
+            push(running, now + duration, task)
+            free -= 1
+
+        now, _, (syntax_only, fpath) = heapq.heappop(running)
+        free += 1
+        if syntax_only:
+            stage1_done(fpath, now)
+
+    return now
+
+
+def predict(analysed_files: Iterable[AnalysedFortran], times: CompileTimes, n_procs: int) -> Prediction:
+    """
+    Predict the time taken by a single-stage and a two-stage compile of the given files.
+
+    :param analysed_files:
+        The files to compile.
+    :param times:
+        The compile times of every file, as given by :func:`estimate_compile_times`.
+    :param n_procs:
+        The number of files compiled at once.
+
+    """
+    analysed_files = list(analysed_files)
+    n_procs = max(1, n_procs)
+    return Prediction(
+        single_stage=simulate_single_stage(analysed_files, times, n_procs),
+        two_stage=simulate_two_stage(analysed_files, times, n_procs),
+    )
+
+
+def _dependency_graph(analysed_files: Iterable[AnalysedFortran]) \
+        -> Tuple[Dict[Path, Set[Path]], Dict[Path, List[Path]]]:
+    # the Fortran files each file depends on, and the reverse, limited to the files being compiled
+    analysed_files = list(analysed_files)
+    fpaths = {af.fpath for af in analysed_files}
+    deps = {af.fpath: {dep for dep in af.file_deps if dep in fpaths} for af in analysed_files}
+    dependents: Dict[Path, List[Path]] = defaultdict(list)
+    for fpath, fpath_deps in deps.items():
+        for dep in fpath_deps:
+            dependents[dep].append(fpath)
+    return deps, dependents
+
+
+def _makespan(durations: List[float], n_procs: int) -> float:
+    # the time for n_procs workers to finish all the tasks, taking the longest tasks first
+    workers = [0.0] * min(n_procs, len(durations))
+    if not workers:
+        return 0.0
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(workers, workers[0] + duration)
+    return max(workers)
+
+
+def _file_size(fpath: Path) -> int:
+    try:
+        return fpath.stat().st_size
+    except OSError:
+        return 0
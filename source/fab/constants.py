@@ -14,3 +14,6 @@ BUILD_OUTPUT = "build_output"
 
 # prebuild folder name
 PREBUILD = '_prebuild'
+
+# let the Fortran compile step choose between single and two-stage compilation
+TWO_STAGE_AUTO = 'auto'
@@ -10,9 +10,12 @@ Classes and helper functions related to the dependency tree, as created by the a
 
 # todo: we've since adopted the term "source tree", so we should probably rename this module to match.
 from abc import ABC
+from array import array
+from collections.abc import MutableMapping
 import logging
 from pathlib import Path
-from typing import Set, Dict, Iterable, List, Union, Optional, Any
+from sys import intern
+from typing import Set, Dict, Iterable, Iterator, List, Union, Optional, Any
 
 from fab.parse import AnalysedFile
 
@@ -29,7 +32,11 @@ class AnalysedDependent(AnalysedFile, ABC):
     During parsing, the symbol definitions and dependencies are filled in.
     During dependency analysis, symbol dependencies are turned into file dependencies.
 
+    Symbol names are interned, as the same names appear in many files.
+
     """
+    __slots__ = ('symbol_defs', 'symbol_deps', 'file_deps')
+
     def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None,
                  symbol_defs: Optional[Iterable[str]] = None, symbol_deps: Optional[Iterable[str]] = None,
                  file_deps: Optional[Iterable[Path]] = None):
@@ -50,8 +57,8 @@ class AnalysedDependent(AnalysedFile, ABC):
         """
         super().__init__(fpath=fpath, file_hash=file_hash)
 
-        self.symbol_defs: Set[str] = set(symbol_defs or {})
-        self.symbol_deps: Set[str] = set(symbol_deps or {})
+        self.symbol_defs: Set[str] = set(map(intern, symbol_defs or {}))
+        self.symbol_deps: Set[str] = set(map(intern, symbol_deps or {}))
         self.file_deps: Set[Path] = set(file_deps or [])
 
         assert all([d and len(d) for d in self.symbol_defs]), "bad symbol definitions"
@@ -59,11 +66,11 @@ class AnalysedDependent(AnalysedFile, ABC):
 
     def add_symbol_def(self, name):
         assert name and len(name)
-        self.symbol_defs.add(name.lower())
+        self.symbol_defs.add(intern(name.lower()))
 
     def add_symbol_dep(self, name):
         assert name and len(name)
-        self.symbol_deps.add(name.lower())
+        self.symbol_deps.add(intern(name.lower()))
 
     def add_file_dep(self, name):
         self.file_deps.add(Path(name))
@@ -103,6 +110,8 @@ def extract_sub_tree(source_tree: Dict[Path, AnalysedDependent], root: Path, ver
     """
     Extract the subtree required to build the target, from the full source tree of all analysed source files.
 
+    To extract the trees for several targets, :meth:`SourceGraph.sub_trees` is much faster.
+
     :param source_tree:
         The source tree of analysed files.
     :param root:
@@ -124,31 +133,395 @@ def extract_sub_tree(source_tree: Dict[Path, AnalysedDependent], root: Path, ver
 
 def _extract_sub_tree(src_tree: Dict[Path, AnalysedDependent], key: Path,
                       dst_tree: Dict[Path, AnalysedDependent], missing: Set[Path], verbose: bool, indent: int = 0):
-    # is this node already in the sub tree?
-    if key in dst_tree:
-        return
-
-    if verbose:
-        logger.debug("----" * indent + str(key))
-
-    # add it to the output tree
-    node = src_tree[key]
-    assert node.fpath == key, "tree corrupted"
-    dst_tree[key] = node
-
-    # add its child deps
-    for file_dep in node.file_deps:
-
-        # one of its deps is missing!
-        if not src_tree.get(file_dep):
-            if logger and verbose:
-                logger.debug("----" * indent + " !!MISSING!! " + str(file_dep))
-            missing.add(file_dep)
+    # Depth first, without recursion, so deep dependency chains can't exhaust the call stack.
+    todo = [(key, indent)]
+    while todo:
+        key, indent = todo.pop()
+
+        # is this node already in the sub tree?
+        if key in dst_tree:
             continue
 
-        # add this child dep
-        _extract_sub_tree(
-            src_tree=src_tree, key=file_dep, dst_tree=dst_tree, missing=missing, verbose=verbose, indent=indent + 1)
+        if verbose:
+            logger.debug("----" * indent + str(key))
+
+        # add it to the output tree
+        node = src_tree[key]
+        assert node.fpath == key, "tree corrupted"
+        dst_tree[key] = node
+
+        # add its child deps
+        for file_dep in node.file_deps:
+
+            # one of its deps is missing!
+            if not src_tree.get(file_dep):
+                if logger and verbose:
+                    logger.debug("----" * indent + " !!MISSING!! " + str(file_dep))
+                missing.add(file_dep)
+                continue
+
+            # add this child dep
+            todo.append((file_dep, indent + 1))
+
+
+class SourceGraph(object):
+    """
+    A compact form of the file dependencies in a source tree, shared by all the build trees extracted from it.
+
+    Files are identified by integer ids, in the order of the source tree.
+    The dependencies are held in compressed sparse row form,
+    i.e the ids of the files on which file *i* depends are ``indices[indptr[i]:indptr[i + 1]]``.
+    The reverse index, of the files which depend on each file, is built in the same form when first needed.
+
+    """
+    __slots__ = ('paths', 'nodes', 'ids', 'indptr', 'indices', 'missing', '_rindptr', '_rindices')
+
+    def __init__(self, source_tree: Dict[Path, AnalysedDependent]):
+        """
+        :param source_tree:
+            The source tree of analysed files, with file dependencies filled in.
+
+        """
+        self.paths: List[Path] = list(source_tree)
+        self.nodes: List[AnalysedDependent] = list(source_tree.values())
+        self.ids: Dict[Path, int] = {fpath: i for i, fpath in enumerate(self.paths)}
+
+        self.indptr = array('l', [0])
+        self.indices = array('l')
+        # file dependencies which are not in the source tree, by file id
+        self.missing: Dict[int, Set[Path]] = {}
+
+        for i, node in enumerate(self.nodes):
+            assert node.fpath == self.paths[i], "tree corrupted"
+            dep_ids = []
+            for file_dep in node.file_deps:
+                dep_id = self.ids.get(file_dep)
+                if dep_id is None:
+                    self.missing.setdefault(i, set()).add(file_dep)
+                else:
+                    dep_ids.append(dep_id)
+            self.indices.extend(sorted(dep_ids))
+            self.indptr.append(len(self.indices))
+
+        self._rindptr: Optional[array] = None
+        self._rindices: Optional[array] = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def deps(self, file_id: int) -> array:
+        """The ids of the files on which the given file depends."""
+        return self.indices[self.indptr[file_id]:self.indptr[file_id + 1]]
+
+    def _reverse_index(self):
+        if self._rindptr is None:
+            # count the dependents of each file, then fill them in
+            counts = [0] * (len(self) + 1)
+            for dep_id in self.indices:
+                counts[dep_id + 1] += 1
+            for file_id in range(len(self)):
+                counts[file_id + 1] += counts[file_id]
+            rindptr = array('l', counts)
+
+            rindices = array('l', bytes(rindptr.itemsize * len(self.indices)))
+            fill = list(counts[:-1])
+            for file_id in range(len(self)):
+                for dep_id in self.deps(file_id):
+                    rindices[fill[dep_id]] = file_id
+                    fill[dep_id] += 1
+
+            self._rindptr, self._rindices = rindptr, rindices
+        return self._rindptr, self._rindices
+
+    def dependents(self, file_id: int) -> array:
+        """The ids of the files which depend directly on the given file."""
+        rindptr, rindices = self._reverse_index()
+        return rindices[rindptr[file_id]:rindptr[file_id + 1]]
+
+    def transitive_dependents(self, fpath: Path) -> Set[Path]:
+        """
+        All the files which depend on the given file, directly or indirectly.
+
+        These are the files which may need recompiling when the given file changes.
+
+        """
+        rindptr, rindices = self._reverse_index()
+        root_id = self.ids[fpath]
+        seen = {root_id}
+        todo = [root_id]
+        while todo:
+            file_id = todo.pop()
+            for dependent_id in rindices[rindptr[file_id]:rindptr[file_id + 1]]:
+                if dependent_id not in seen:
+                    seen.add(dependent_id)
+                    todo.append(dependent_id)
+        seen.discard(root_id)
+        return {self.paths[file_id] for file_id in seen}
+
+    def dependents_index(self) -> Dict[Path, List[Path]]:
+        """The files which depend directly on each file, for files with any dependents."""
+        rindptr, rindices = self._reverse_index()
+        return {
+            self.paths[file_id]: [self.paths[i] for i in rindices[rindptr[file_id]:rindptr[file_id + 1]]]
+            for file_id in range(len(self)) if rindptr[file_id + 1] > rindptr[file_id]
+        }
+
+    def sub_tree(self, root: Path) -> 'BuildTree':
+        """
+        Extract the build tree for the given root file, which includes all of its dependencies.
+
+        :param root:
+            The root of the dependency tree, this is the filename containing the Fortran program.
+
+        """
+        result = self.reachable([root])
+
+        missing: Set[Path] = set()
+        for file_id in self.missing:
+            if result._members[file_id]:
+                missing.update(self.missing[file_id])
+        if missing:
+            logger.warning(f"{root} has missing deps: {missing}")
+
+        return result
+
+    def reachable(self, roots: Iterable[Path]) -> 'BuildTree':
+        """
+        A build tree of all the given files and all their dependencies, found in a single traversal.
+
+        :param roots:
+            The files to start from.
+
+        """
+        result = BuildTree(self)
+        members = result._members
+        indptr, indices = self.indptr, self.indices
+
+        todo = [self.ids[root] for root in roots]
+        while todo:
+            file_id = todo.pop()
+            if members[file_id]:
+                continue
+            members[file_id] = 1
+            todo.extend(indices[indptr[file_id]:indptr[file_id + 1]])
+
+        result._len = members.count(1)
+        return result
+
+    def sub_trees(self, roots: Dict[Any, Path]) -> Dict[Any, 'BuildTree']:
+        """
+        Extract the build trees for many root files at once.
+
+        Rather than traversing the graph once per root, we label every file with the set of roots which need it,
+        as a bitmask. The labels are pushed through the strongly connected components of the graph
+        in topological order, so each file and dependency is visited once, however many roots share it.
+
+        :param roots:
+            The root file of each build tree, by name.
+
+        """
+        names = list(roots)
+        root_ids = [self.ids[roots[name]] for name in names]
+
+        labels = [0] * len(self)
+        for bit, root_id in enumerate(root_ids):
+            labels[root_id] |= 1 << bit
+
+        indptr, indices = self.indptr, self.indices
+        components = self._strongly_connected_components(root_ids)
+
+        # components come out with dependencies first, so we go backwards to push labels towards dependencies
+        for component in reversed(components):
+            label = 0
+            for file_id in component:
+                label |= labels[file_id]
+            for file_id in component:
+                labels[file_id] = label
+                for dep_id in indices[indptr[file_id]:indptr[file_id + 1]]:
+                    labels[dep_id] |= label
+
+        # distribute the labelled files to their trees
+        trees = [BuildTree(self) for _ in names]
+        tree_members = [tree._members for tree in trees]
+        for component in components:
+            for file_id in component:
+                label = labels[file_id]
+                while label:
+                    lowest = label & -label
+                    tree_members[lowest.bit_length() - 1][file_id] = 1
+                    label ^= lowest
+        for tree in trees:
+            tree._len = tree._members.count(1)
+
+        missing: List[Set[Path]] = [set() for _ in names]
+        for file_id, file_missing in self.missing.items():
+            label = labels[file_id]
+            while label:
+                lowest = label & -label
+                missing[lowest.bit_length() - 1].update(file_missing)
+                label ^= lowest
+
+        for name, tree_missing in zip(names, missing):
+            if tree_missing:
+                logger.warning(f"{roots[name]} has missing deps: {tree_missing}")
+
+        return dict(zip(names, trees))
+
+    def _strongly_connected_components(self, root_ids: Iterable[int]) -> List[List[int]]:
+        """
+        Find the strongly connected components of the files reachable from the given roots.
+
+        This is an iterative form of Tarjan's algorithm, so deep dependency chains can't exhaust the call stack.
+        Components are returned in reverse topological order, i.e a component comes after all its dependencies.
+
+        """
+        indptr, indices = self.indptr, self.indices
+        index = [-1] * len(self)
+        lowlink = [0] * len(self)
+        on_stack = bytearray(len(self))
+        stack: List[int] = []
+        components: List[List[int]] = []
+        counter = 0
+
+        for root_id in root_ids:
+            if index[root_id] != -1:
+                continue
+
+            # each entry is a file, and the position of the next dependency to look at
+            work = [(root_id, indptr[root_id])]
+            index[root_id] = lowlink[root_id] = counter
+            counter += 1
+            stack.append(root_id)
+            on_stack[root_id] = 1
+
+            while work:
+                file_id, pos = work[-1]
+                end = indptr[file_id + 1]
+                while pos < end:
+                    dep_id = indices[pos]
+                    pos += 1
+                    if index[dep_id] == -1:
+                        # visit this dependency next, then resume here
+                        work[-1] = (file_id, pos)
+                        work.append((dep_id, indptr[dep_id]))
+                        index[dep_id] = lowlink[dep_id] = counter
+                        counter += 1
+                        stack.append(dep_id)
+                        on_stack[dep_id] = 1
+                        break
+                    elif on_stack[dep_id]:
+                        lowlink[file_id] = min(lowlink[file_id], index[dep_id])
+                else:
+                    # finished with this file's dependencies
+                    work.pop()
+                    if work:
+                        parent_id = work[-1][0]
+                        lowlink[parent_id] = min(lowlink[parent_id], lowlink[file_id])
+
+                    if lowlink[file_id] == index[file_id]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = 0
+                            component.append(member)
+                            if member == file_id:
+                                break
+                        components.append(component)
+
+        return components
+
+    def full_tree(self) -> 'BuildTree':
+        """A build tree containing every file in the source tree."""
+        result = BuildTree(self)
+        for file_id in range(len(self)):
+            result._add(file_id)
+        return result
+
+
+class BuildTree(MutableMapping):
+    """
+    The analysed files needed to build one target, as a view of a shared :class:`SourceGraph`.
+
+    This behaves like the ``Dict[Path, AnalysedDependent]`` build trees it replaces, but only stores
+    a membership flag for each file in the graph.
+    Files can only be added if they're in the graph.
+
+    """
+    __slots__ = ('graph', '_members', '_len')
+
+    def __init__(self, graph: SourceGraph):
+        """
+        :param graph:
+            The source graph this tree is part of.
+
+        """
+        self.graph = graph
+        self._members = bytearray(len(graph))
+        self._len = 0
+
+    def _add(self, file_id: int):
+        if not self._members[file_id]:
+            self._members[file_id] = 1
+            self._len += 1
+
+    def _file_id(self, fpath) -> Optional[int]:
+        file_id = self.graph.ids.get(fpath)
+        if file_id is None or not self._members[file_id]:
+            return None
+        return file_id
+
+    def file_ids(self) -> Iterator[int]:
+        """The ids of the files in this tree, in graph order."""
+        return (file_id for file_id, member in enumerate(self._members) if member)
+
+    def __getitem__(self, fpath: Path) -> AnalysedDependent:
+        file_id = self._file_id(fpath)
+        if file_id is None:
+            raise KeyError(fpath)
+        return self.graph.nodes[file_id]
+
+    def __setitem__(self, fpath: Path, node: AnalysedDependent):
+        file_id = self.graph.ids.get(fpath)
+        if file_id is None or self.graph.nodes[file_id] is not node:
+            raise ValueError(f"cannot add {fpath} to a build tree, it's not in the source graph")
+        self._add(file_id)
+
+    def __delitem__(self, fpath: Path):
+        file_id = self._file_id(fpath)
+        if file_id is None:
+            raise KeyError(fpath)
+        self._members[file_id] = 0
+        self._len -= 1
+
+    def __contains__(self, fpath) -> bool:
+        return self._file_id(fpath) is not None
+
+    def __iter__(self) -> Iterator[Path]:
+        paths = self.graph.paths
+        return (paths[file_id] for file_id in self.file_ids())
+
+    def __len__(self) -> int:
+        return self._len
+
+    # faster than looking up every path
+    def values(self) -> List[AnalysedDependent]:  # type: ignore
+        nodes = self.graph.nodes
+        return [nodes[file_id] for file_id in self.file_ids()]
+
+    def items(self) -> List:  # type: ignore
+        paths, nodes = self.graph.paths, self.graph.nodes
+        return [(paths[file_id], nodes[file_id]) for file_id in self.file_ids()]
+
+    def update(self, other=(), **kwargs):
+        # merge trees from the same graph without going through the nodes
+        if isinstance(other, BuildTree) and other.graph is self.graph and not kwargs:
+            for file_id in other.file_ids():
+                self._add(file_id)
+        else:
+            super().update(other, **kwargs)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)})'
 
 
 def filter_source_tree(source_tree: Dict[Path, AnalysedDependent], suffixes: Iterable[str]) -> List[AnalysedDependent]:
@@ -7,7 +7,7 @@ import json
 import logging
 from abc import ABC
 from pathlib import Path
-from typing import Union, Optional, Dict, Any, Set
+from typing import Union, Optional, Dict, Any, List
 
 from fab.util import file_checksum
 
@@ -23,7 +23,12 @@ class AnalysedFile(ABC):
     """
     Analysis results for a single file. Abstract base class.
 
+    Analysis results are held in their thousands for large projects, so subclasses declare their
+    attributes with ``__slots__`` to keep them small.
+
     """
+    __slots__ = ('_fpath', '_file_hash', '_hash')
+
     def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None):
         """
         :param fpath:
@@ -35,9 +40,19 @@ class AnalysedFile(ABC):
         If not provided, the `self.file_hash` property is lazily evaluated in case the file does not yet exist.
 
         """
+        self._hash: Optional[int] = None
         self.fpath = Path(fpath)
         self._file_hash = file_hash
 
+    @property
+    def fpath(self) -> Path:
+        return self._fpath
+
+    @fpath.setter
+    def fpath(self, fpath: Path):
+        self._fpath = fpath
+        self._hash = None
+
     @property
     def file_hash(self) -> int:
         if self._file_hash is None:
@@ -46,9 +61,39 @@ class AnalysedFile(ABC):
             self._file_hash = file_checksum(self.fpath).file_hash
         return self._file_hash
 
+    @file_hash.setter
+    def file_hash(self, file_hash: int):
+        self._file_hash = file_hash
+        self._hash = None
+
+    @classmethod
+    def _slot_names(cls) -> List[str]:
+        """All the attributes of this class, from the ``__slots__`` of every class in the hierarchy."""
+        names: List[str] = []
+        for klass in reversed(cls.__mro__):
+            names.extend(klass.__dict__.get('__slots__', ()))
+        return names
+
     def __eq__(self, other):
-        # todo: better to use self.field_names() instead of vars(self) in order to evaluate any lazy attributes?
-        return vars(self) == vars(other)
+        # todo: better to use self.field_names() instead of the slots in order to evaluate any lazy attributes?
+        if not isinstance(other, AnalysedFile):
+            return NotImplemented
+        # subclasses outside fab might not declare __slots__, so also compare any instance dict
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self._slot_names() if name != '_hash') \
+            and getattr(self, '__dict__', {}) == getattr(other, '__dict__', {})
+
+    # The cached hash is not pickled, because str and Path hashes differ between processes.
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self._slot_names()
+                 if name != '_hash' and hasattr(self, name)}
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._hash = None
 
     # persistence
     def to_dict(self) -> Dict[str, Any]:
@@ -105,24 +150,13 @@ class AnalysedFile(ABC):
         return f'{self.__class__.__name__}({params})'
 
     # We need to be hashable before we can go into a set, which is useful for our subclasses.
+    # An analysis is identified by the file's path and checksum, so equal objects always have equal hashes.
+    # We don't hash the analysis results, which are large, so the hash is cheap and can be kept.
     # Note, the numerical result will change with each Python invocation.
     def __hash__(self):
-        # Build up a list of things to hash, from our attributes.
-        # We use self.field_names() rather than vars(self) because we want to evaluate any lazy attributes.
-        # We turn dicts and sets into sorted tuples for hashing.
-        # todo: There's a good reason dicts and sets aren't supposed to be hashable.
-        #       Please see https://github.com/metomi/fab/issues/229
-        things = set()
-        for field_name in self.field_names():
-            thing = getattr(self, field_name)
-            if isinstance(thing, Dict):
-                things.add(tuple(sorted(thing.items())))
-            elif isinstance(thing, Set):
-                things.add(tuple(sorted(thing)))
-            else:
-                things.add(thing)
-
-        return hash(tuple(things))
+        if self._hash is None:
+            self._hash = hash((self.fpath, self.file_hash))
+        return self._hash
 
 
 # todo: There's a design weakness relating to this class:
@@ -133,6 +167,8 @@ class EmptySourceFile(AnalysedFile):
     An analysis result for a file which resulted in an empty parse tree.
 
     """
+    __slots__ = ()
+
     def __init__(self, fpath: Union[str, Path]):
         """
         :param fpath:
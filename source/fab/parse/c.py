@@ -9,9 +9,13 @@ import logging
 import warnings
 from collections import deque
 from pathlib import Path
-from typing import List, Optional, Union, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Union, Tuple
 
+from fab.build_config import FlagsConfig
 from fab.dep_tree import AnalysedDependent
+from fab.parse.c_scanner import CSymbolScanner
+from fab.parse.includes import include_paths_from_flags
+from fab.tools import Flags
 
 try:
     import clang  # type: ignore
@@ -19,10 +23,22 @@ try:
 except ImportError:
     clang = None
 
-from fab.util import log_or_dot, file_checksum
+from fab.util import log_or_dot, file_checksum, string_checksum
 
 logger = logging.getLogger(__name__)
 
+C_ANALYSIS_ENGINES = ('libclang', 'scanner')
+
+# The libclang index is created once per process and reused for every file analysed by that process.
+_index = None
+
+
+def _get_index():
+    global _index
+    if _index is None:
+        _index = clang.cindex.Index.create()
+    return _index
+
 
 class AnalysedC(AnalysedDependent):
     """
@@ -33,22 +49,103 @@ class AnalysedC(AnalysedDependent):
           is compiled before another, so this class must be part of the dependency tree analysis.
 
     """
-    # Note: This subclass adds nothing to it's parent, which provides everything it needs.
-    #       We'd normally remove an irrelevant class like this but we want to keep the door open
-    #       for filtering analysis results by type, rather than suffix.
-    pass
+    __slots__ = ('header_deps',)
+
+    def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None,
+                 symbol_defs: Optional[Iterable[str]] = None, symbol_deps: Optional[Iterable[str]] = None,
+                 file_deps: Optional[Iterable[Path]] = None, header_deps: Optional[Dict[Path, int]] = None):
+        """
+        :param fpath:
+            The source file that was analysed.
+        :param file_hash:
+            The hash of the source. If omitted, Fab will evaluate lazily.
+        :param symbol_defs:
+            Set of symbol names defined by this source file.
+        :param symbol_deps:
+            Set of symbol names used by this source file.
+        :param file_deps:
+            Other files on which this source depends.
+        :param header_deps:
+            The user header files included by this source file, mapped to their checksums.
+            Only recorded by single pass analysis, which parses the unpreprocessed source.
+
+        """
+        super().__init__(fpath=fpath, file_hash=file_hash,
+                         symbol_defs=symbol_defs, symbol_deps=symbol_deps, file_deps=file_deps)
+        self.header_deps: Dict[Path, int] = dict(header_deps or {})
+
+    def headers_changed(self) -> bool:
+        """
+        Check whether any of the recorded user headers have been changed or removed since analysis.
+
+        """
+        for header, header_hash in self.header_deps.items():
+            if not header.exists() or file_checksum(header).file_hash != header_hash:
+                return True
+        return False
+
+    @classmethod
+    def field_names(cls):
+        return super().field_names() + ['header_deps']
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = super().to_dict()
+        result["header_deps"] = {str(k): v for k, v in sorted(self.header_deps.items())}
+        return result
+
+    @classmethod
+    def from_dict(cls, d):
+        result = cls(
+            fpath=Path(d["fpath"]),
+            file_hash=d["file_hash"],
+            symbol_defs=set(d["symbol_defs"]),
+            symbol_deps=set(d["symbol_deps"]),
+            file_deps=set(map(Path, d["file_deps"])),
+            header_deps={Path(k): v for k, v in d.get("header_deps", {}).items()},
+        )
+        assert result.file_hash is not None
+        return result
 
 
 class CAnalyser(object):
     """
     Identify symbol definitions and dependencies in a C file.
 
+    By default, the analyser expects C which has been through the
+    :func:`~fab.steps.c_pragma_injector.c_pragma_injector` and the C preprocessor,
+    and uses the Fab pragmas to find the user and system include regions.
+
+    In *single pass* mode, the analyser parses the original C source, passing the given preprocessor flags
+    to libclang, and uses each symbol's source location to decide whether it came from
+    the file itself, a user header or a system header. The pragma injection and preprocessing steps
+    are not needed in this mode.
+
+    The *libclang* engine gives a precise analysis. The *scanner* engine uses the much faster
+    :class:`~fab.parse.c_scanner.CSymbolScanner`, which approximates it without a full parse,
+    and is used automatically when libclang is not available.
+
     """
 
-    def __init__(self):
+    def __init__(self, single_pass: bool = False, flags: Optional[FlagsConfig] = None, engine: str = 'libclang'):
+        """
+        :param single_pass:
+            Parse the unpreprocessed source, classifying symbols by their source location.
+        :param flags:
+            Preprocessor flags, such as include paths and macro definitions, used in single pass mode.
+        :param engine:
+            The analysis engine, one of 'libclang' or 'scanner'.
+
+        """
+        if engine not in C_ANALYSIS_ENGINES:
+            raise ValueError(f"unknown C analysis engine '{engine}', must be one of {C_ANALYSIS_ENGINES}")
+
+        self.single_pass = single_pass
+        self.flags = flags or FlagsConfig()
+        self.engine = engine
 
         # runtime
-        self._config = None
+        self._config: Any = None
+        self._main_file: Optional[str] = None
 
     # todo: simplifiy by passing in the file path instead of the analysed tokens?
     def _locate_include_regions(self, trans_unit) -> None:
@@ -103,40 +200,92 @@ class CAnalyser(object):
         else:
             return None
 
+    def _check_location(self, node) -> Optional[str]:
+        """Classify a node by the file it came from: a system include, a user include, or neither."""
+        source_file = node.location.file
+        if source_file is None or source_file.name == self._main_file:
+            return None
+        if clang.cindex.conf.lib.clang_Location_isInSystemHeader(node.location):
+            return "sys_include"
+        return "usr_include"
+
+    def _include_type(self, node) -> Optional[str]:
+        """Check whether a node came from a system include, a user include, or neither."""
+        if self.single_pass:
+            return self._check_location(node)
+        return self._check_for_include(node.location.line)
+
+    def _find_user_headers(self, trans_unit) -> Dict[Path, int]:
+        """Get the checksums of all the user headers included by a translation unit, directly or indirectly."""
+        headers = {}
+        for inclusion in trans_unit.get_includes():
+            header = inclusion.include
+            location = clang.cindex.SourceLocation.from_position(trans_unit, header, 1, 1)
+            if clang.cindex.conf.lib.clang_Location_isInSystemHeader(location):
+                continue
+            header_path = Path(header.name)
+            headers[header_path] = file_checksum(header_path).file_hash
+        return headers
+
     def run(self, fpath: Path) \
             -> Union[Tuple[AnalysedC, Path], Tuple[Exception, None]]:
 
-        if not clang:
-            msg = 'clang not available, C analysis disabled'
+        engine = self.engine
+        if engine == 'libclang' and not clang:
+            msg = 'clang not available, falling back to the C symbol scanner'
             warnings.warn(msg, ImportWarning)
-            return ImportWarning(msg), None
+            engine = 'scanner'
 
         # do we already have analysis results for this file?
         # todo: dupe - probably best in a parser base class
         file_hash = file_checksum(fpath).file_hash
-        analysis_fpath = Path(self._config.prebuild_folder / f'{fpath.stem}.{file_hash}.an')
+        flags = Flags()
+        analysis_hash = file_hash
+        if self.single_pass:
+            # The analysis of unpreprocessed source also depends on the preprocessor flags
+            # and on any user headers, which are checked when the prebuild is loaded.
+            flags = Flags(self.flags.flags_for_path(path=fpath, config=self._config))
+            analysis_hash += flags.checksum()
+        if engine == 'scanner':
+            # the engines can give different results, so don't share prebuilds
+            analysis_hash += string_checksum(engine)
+        analysis_fpath = Path(self._config.prebuild_folder / f'{fpath.stem}.{analysis_hash}.an')
         if analysis_fpath.exists():
-            log_or_dot(logger, f"found analysis prebuild for {fpath}")
-            return AnalysedC.load(analysis_fpath), analysis_fpath
+            prebuild = AnalysedC.load(analysis_fpath)
+            if not prebuild.headers_changed():
+                log_or_dot(logger, f"found analysis prebuild for {fpath}")
+                return prebuild, analysis_fpath
+            logger.debug(f"user headers changed since analysis prebuild for {fpath}")
 
         log_or_dot(logger, f"analysing {fpath}")
 
         analysed_file = AnalysedC(fpath=fpath, file_hash=file_hash)
 
+        if engine == 'scanner':
+            return self._scan(analysed_file, flags, analysis_fpath)
+
         # parse the file
         try:
-            index = clang.cindex.Index.create()
-            translation_unit = index.parse(fpath, args=["-xc"])
+            translation_unit = _get_index().parse(fpath, args=["-xc"] + flags)
         except Exception as err:
             logger.exception(f'error parsing {fpath}')
             return err, None
 
-        # Create include region line mappings
-        try:
-            self._locate_include_regions(translation_unit)
-        except Exception as err:
-            logger.exception(f'error locating include regions {fpath}')
-            return err, None
+        if self.single_pass:
+            # Symbols are classified by their source location, so we only need to know which file is ours.
+            self._main_file = translation_unit.spelling
+            try:
+                analysed_file.header_deps = self._find_user_headers(translation_unit)
+            except Exception as err:
+                logger.exception(f'error finding user headers {fpath}')
+                return err, None
+        else:
+            # Create include region line mappings
+            try:
+                self._locate_include_regions(translation_unit)
+            except Exception as err:
+                logger.exception(f'error locating include regions {fpath}')
+                return err, None
 
         # Now walk the actual nodes and find all relevant external symbols
         try:
@@ -145,7 +294,7 @@ class CAnalyser(object):
                 if not node.spelling:
                     continue
                 # ignore sys include stuff
-                if self._check_for_include(node.location.line) == "sys_include":
+                if self._include_type(node) == "sys_include":
                     continue
                 logger.debug('Considering node: %s', node.spelling)
 
@@ -160,6 +309,24 @@ class CAnalyser(object):
         analysed_file.save(analysis_fpath)
         return analysed_file, analysis_fpath
 
+    def _scan(self, analysed_file: AnalysedC, flags: Flags, analysis_fpath: Path) \
+            -> Union[Tuple[AnalysedC, Path], Tuple[Exception, None]]:
+        """Analyse the file with the lightweight symbol scanner instead of libclang."""
+        try:
+            scanner = CSymbolScanner(include_paths=include_paths_from_flags(flags)).scan(analysed_file.fpath)
+        except Exception as err:
+            logger.exception(f'error scanning {analysed_file.fpath}')
+            return err, None
+
+        for symbol in sorted(scanner.symbol_defs):
+            analysed_file.add_symbol_def(symbol)
+        for symbol in sorted(scanner.symbol_deps):
+            analysed_file.add_symbol_dep(symbol)
+        analysed_file.header_deps = scanner.header_deps
+
+        analysed_file.save(analysis_fpath)
+        return analysed_file, analysis_fpath
+
     def _process_symbol_declaration(self, analysed_file, node, usr_symbols):
         # Identify symbol declarations which are definitions or user includes
         logger.debug('  * Is a declaration')
@@ -172,7 +339,7 @@ class CAnalyser(object):
                 analysed_file.add_symbol_def(node.spelling)
         else:
             # Record any user included symbols in case they're referenced later in the code
-            if self._check_for_include(node.location.line) == "usr_include":
+            if self._include_type(node) == "usr_include":
                 logger.debug('  * Is not defined in this file')
                 usr_symbols.append(node.spelling)
 
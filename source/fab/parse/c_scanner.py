@@ -0,0 +1,386 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+"""
+A lightweight C symbol scanner, used when libclang is unavailable or too slow.
+
+The scanner tokenises the source and looks at its top level declarations, finding the symbol definitions and
+dependencies which :class:`~fab.parse.c.AnalysedC` needs:
+
+- external function and global variable definitions,
+- uses of functions and variables which were declared in user headers.
+
+It understands Fab's include region pragmas and the line markers written by the C preprocessor.
+When given unpreprocessed source, it follows user `#include "..."` directives using the given include paths,
+and skips system `#include <...>` directives.
+
+It is an approximation of the libclang analysis. Macros are not expanded and conditional compilation
+is not evaluated, so unpreprocessed source which relies on either may give different results.
+
+"""
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fab.util import file_checksum
+
+SYS_INCLUDE = "sys_include"
+USR_INCLUDE = "usr_include"
+
+_TOKEN_PATTERN = re.compile(r'''
+      (?P<comment>/\*.*?\*/|//[^\n]*)
+    | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+    | (?P<punct>->|==|!=|<=|>=|\+\+|--|&&|\|\||[-+*/%&|^!~<>=?:;,.(){}\[\]])
+    ''', re.VERBOSE | re.DOTALL)
+
+_LINE_MARKER_PATTERN = re.compile(r'^\s*#\s*(?:line\s+)?\d+\s+"((?:\\.|[^"\\])*)"(.*)$')
+_INCLUDE_PATTERN = re.compile(r'^\s*#\s*include\s*([<"])([^>"]+)[>"]')
+_PRAGMA_PATTERN = re.compile(r'^\s*#\s*pragma\s+FAB\s+(Sys|Usr)Include(Start|End)\b')
+
+_KEYWORDS = {
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum', 'extern',
+    'float', 'for', 'goto', 'if', 'inline', 'int', 'long', 'register', 'restrict', 'return', 'short', 'signed',
+    'sizeof', 'static', 'struct', 'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile', 'while',
+    '_Alignas', '_Alignof', '_Atomic', '_Bool', '_Complex', '_Generic', '_Imaginary', '_Noreturn',
+    '_Static_assert', '_Thread_local',
+    '__const', '__extension__', '__inline', '__inline__', '__restrict', '__restrict__', '__signed__',
+    '__volatile__', '__typeof__', 'typeof', '__builtin_va_list',
+}
+
+# keywords which are followed by a parenthesised group we should ignore
+_ATTRIBUTES = {'__attribute__', '__attribute', '__asm__', '__asm', 'asm', '__declspec', '_Alignas'}
+
+_AGGREGATES = {'struct', 'union', 'enum'}
+
+
+class _Token(object):
+    __slots__ = ('kind', 'value', 'region')
+
+    def __init__(self, kind: str, value: str, region: Optional[str]):
+        self.kind = kind
+        self.value = value
+        self.region = region
+
+
+class _Group(object):
+    """A braced group inside a top level declaration, such as a struct body or an initialiser."""
+    __slots__ = ('tokens',)
+    kind = 'group'
+    value = '{}'
+
+    def __init__(self, tokens: List[_Token]):
+        self.tokens = tokens
+
+
+class CSymbolScanner(object):
+    """
+    Scan a single C file for symbol definitions and dependencies.
+
+    """
+    def __init__(self, include_paths: Optional[Iterable[Path]] = None):
+        """
+        :param include_paths:
+            Folders to search for user headers in unpreprocessed source, after the including file's own folder.
+
+        """
+        self.include_paths = list(include_paths or [])
+
+        self.symbol_defs: Set[str] = set()
+        self.symbol_deps: Set[str] = set()
+        self.header_deps: Dict[Path, int] = {}
+
+        # symbols declared in user headers, which are dependencies when used
+        self._usr_symbols: Set[str] = set()
+
+    def scan(self, fpath: Path):
+        """
+        Scan the file, filling in :attr:`symbol_defs`, :attr:`symbol_deps` and :attr:`header_deps`.
+
+        """
+        chunks: List[Tuple[Optional[str], str]] = []
+        self._read_regions(fpath, region=None, chunks=chunks, include_stack=[fpath])
+
+        tokens: List[_Token] = []
+        for region, text in chunks:
+            tokens.extend(self._tokenise(text, region))
+
+        self._scan_top_level(tokens)
+        return self
+
+    # reading
+    def _resolve_include(self, name: str, including_file: Path) -> Optional[Path]:
+        for folder in [including_file.parent] + self.include_paths:
+            candidate = folder / name
+            if candidate.is_file():
+                return candidate
+        return None
+
+    def _read_regions(self, fpath: Path, region: Optional[str],
+                      chunks: List[Tuple[Optional[str], str]], include_stack: List[Path]):
+        """
+        Split the source into chunks of text, each labelled as coming from a system include, a user include
+        or neither. Preprocessor directives are removed, user includes are read in place.
+
+        """
+        text = fpath.read_text(encoding='utf-8', errors='replace')
+        # join continuation lines, so multi-line directives are seen whole
+        text = text.replace('\\\n', '')
+
+        pragma_stack: List[str] = []
+        marker_region: Optional[str] = None
+        main_marker: Optional[str] = None
+        lines: List[str] = []
+
+        def current_region():
+            regions = {region, marker_region, pragma_stack[-1] if pragma_stack else None}
+            if SYS_INCLUDE in regions:
+                return SYS_INCLUDE
+            if USR_INCLUDE in regions:
+                return USR_INCLUDE
+            return None
+
+        def flush():
+            if lines:
+                chunks.append((current_region(), '\n'.join(lines)))
+                lines.clear()
+
+        for line in text.splitlines():
+            if not line.lstrip().startswith('#'):
+                lines.append(line)
+                continue
+
+            # everything below changes the region, or is a directive we don't keep
+            flush()
+
+            pragma = _PRAGMA_PATTERN.match(line)
+            if pragma:
+                kind, start_end = pragma.groups()
+                if start_end == 'Start':
+                    pragma_stack.append(SYS_INCLUDE if kind == 'Sys' else USR_INCLUDE)
+                elif pragma_stack:
+                    pragma_stack.pop()
+                continue
+
+            marker = _LINE_MARKER_PATTERN.match(line)
+            if marker:
+                marker_file, marker_flags = marker.groups()
+                if main_marker is None:
+                    main_marker = marker_file
+                if marker_file == main_marker:
+                    marker_region = None
+                elif '3' in marker_flags.split() or marker_file.startswith('<'):
+                    marker_region = SYS_INCLUDE
+                else:
+                    marker_region = USR_INCLUDE
+                continue
+
+            include = _INCLUDE_PATTERN.match(line)
+            if include and include.group(1) == '"':
+                header = self._resolve_include(include.group(2), including_file=fpath)
+                if header and header not in include_stack and header not in self.header_deps:
+                    header_region = SYS_INCLUDE if current_region() == SYS_INCLUDE else USR_INCLUDE
+                    if header_region == USR_INCLUDE:
+                        self.header_deps[header] = file_checksum(header).file_hash
+                    self._read_regions(header, region=header_region, chunks=chunks,
+                                       include_stack=include_stack + [header])
+
+        flush()
+
+    @staticmethod
+    def _tokenise(text: str, region: Optional[str]) -> List[_Token]:
+        tokens = []
+        for match in _TOKEN_PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind in ('comment', 'string', 'number'):
+                continue
+            tokens.append(_Token(kind, match.group(), region))  # type: ignore
+        return tokens
+
+    # parsing
+    def _scan_top_level(self, tokens: List[_Token]):
+        """
+        Split the tokens into top level declarations and function definitions.
+
+        """
+        statement: List = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.value == ';':
+                self._handle_declaration(statement)
+                statement = []
+            elif token.value == '{':
+                end = self._matching_brace(tokens, i)
+                body = tokens[i + 1:end]
+                name_token = self._function_name(statement)
+                if name_token is not None:
+                    self._handle_function_definition(statement, name_token, body)
+                    statement = []
+                else:
+                    statement.append(_Group(body))
+                i = end
+            else:
+                statement.append(token)
+            i += 1
+
+    @staticmethod
+    def _matching_brace(tokens: List[_Token], start: int) -> int:
+        depth = 0
+        for i in range(start, len(tokens)):
+            value = tokens[i].value
+            if value == '{':
+                depth += 1
+            elif value == '}':
+                depth -= 1
+                if depth == 0:
+                    return i
+        return len(tokens)
+
+    @staticmethod
+    def _strip_attributes(statement: List) -> List:
+        """Remove attribute and asm specifiers, with their parenthesised arguments."""
+        result = []
+        i = 0
+        while i < len(statement):
+            item = statement[i]
+            if item.value in _ATTRIBUTES:
+                i += 1
+                if i < len(statement) and statement[i].value == '(':
+                    depth = 0
+                    while i < len(statement):
+                        if statement[i].value == '(':
+                            depth += 1
+                        elif statement[i].value == ')':
+                            depth -= 1
+                            if depth == 0:
+                                break
+                        i += 1
+            else:
+                result.append(item)
+            i += 1
+        return result
+
+    def _function_name(self, statement: List) -> Optional[_Token]:
+        """
+        If the statement is the head of a function definition, return the function name token.
+
+        """
+        statement = self._strip_attributes(statement)
+        if not statement or statement[-1].value != ')':
+            return None
+
+        name_token = None
+        depth = 0
+        for i, item in enumerate(statement):
+            if item.value == '=' and depth == 0:
+                # an initialiser, not a function definition
+                return None
+            if item.value == '(':
+                if depth == 0 and i > 0 and self._is_name(statement[i - 1]):
+                    name_token = statement[i - 1]
+                depth += 1
+            elif item.value == ')':
+                depth -= 1
+        return name_token
+
+    @staticmethod
+    def _is_name(item) -> bool:
+        return item.kind == 'name' and item.value not in _KEYWORDS and item.value not in _ATTRIBUTES
+
+    def _handle_function_definition(self, statement: List, name_token: _Token, body: List[_Token]):
+        if name_token.region == SYS_INCLUDE:
+            return
+        if not any(item.value == 'static' for item in statement):
+            self.symbol_defs.add(name_token.value)
+        self._handle_uses(body)
+
+    def _handle_uses(self, tokens: Iterable):
+        """Record any use of a user declared symbol as a dependency."""
+        previous = None
+        for token in tokens:
+            if isinstance(token, _Group):
+                self._handle_uses(token.tokens)
+            elif token.kind == 'name' and token.region != SYS_INCLUDE and token.value in self._usr_symbols:
+                # ignore struct members with the same name as a user symbol
+                if previous is None or previous.value not in ('.', '->'):
+                    self.symbol_deps.add(token.value)
+            previous = token
+
+    def _handle_declaration(self, statement: List):
+        statement = self._strip_attributes(statement)
+        if not statement or statement[0].region == SYS_INCLUDE:
+            return
+        if any(item.value == 'typedef' for item in statement):
+            return
+
+        is_static = any(item.value == 'static' for item in statement)
+        region = statement[0].region
+
+        for declarator in self._split_declarators(statement):
+            name, is_function, initialiser = self._declarator_name(declarator)
+            if not name:
+                continue
+
+            if initialiser is not None:
+                # a variable definition
+                if not is_static:
+                    self.symbol_defs.add(name)
+                self._handle_uses(initialiser)
+            elif region == USR_INCLUDE:
+                # a function or variable declaration, which code in this file might use
+                self._usr_symbols.add(name)
+
+    @staticmethod
+    def _split_declarators(statement: List) -> List[List]:
+        declarators: List[List] = [[]]
+        depth = 0
+        for item in statement:
+            if item.value in ('(', '['):
+                depth += 1
+            elif item.value in (')', ']'):
+                depth -= 1
+            elif item.value == ',' and depth == 0:
+                declarators.append([])
+                continue
+            declarators[-1].append(item)
+        return declarators
+
+    def _declarator_name(self, declarator: List) -> Tuple[Optional[str], bool, Optional[List]]:
+        """
+        Find the declared name in a declarator, whether it's a function, and any initialiser tokens.
+
+        """
+        initialiser = None
+        for i, item in enumerate(declarator):
+            if item.value == '=':
+                initialiser = declarator[i + 1:]
+                declarator = declarator[:i]
+                break
+
+        name = None
+        depth = 0
+        for i, item in enumerate(declarator):
+            if item.value == '(':
+                if depth == 0 and i > 0 and self._is_name(declarator[i - 1]):
+                    # a function declaration
+                    return declarator[i - 1].value, True, None
+                # a function pointer, (*name)
+                if i + 2 < len(declarator) and declarator[i + 1].value == '*' and \
+                        self._is_name(declarator[i + 2]):
+                    return declarator[i + 2].value, False, initialiser
+                depth += 1
+            elif item.value == ')':
+                depth -= 1
+            elif item.value in ('[', ':'):
+                break
+            elif depth == 0 and self._is_name(item):
+                # struct, union or enum tags are not variables
+                if i > 0 and declarator[i - 1].value in _AGGREGATES:
+                    continue
+                name = item.value
+
+        return name, False, initialiser
@@ -9,6 +9,7 @@ Fortran language handling classes.
 """
 import logging
 from pathlib import Path
+from sys import intern
 from typing import Union, Optional, Iterable, Dict, Any, Set
 
 from fparser.common.readfortran import FortranStringReader   # type: ignore
@@ -37,6 +38,8 @@ class AnalysedFortran(AnalysedDependent):
     :class:`~fab.steps.analyse.Analyse` step, which will be converted at runtime into an instance of this class.
 
     """
+    __slots__ = ('program_defs', 'module_defs', 'module_deps', 'mo_commented_file_deps', 'psyclone_kernels')
+
     def __init__(self, fpath: Union[str, Path], file_hash: Optional[int] = None,
                  program_defs: Optional[Iterable[str]] = None,
                  module_defs: Optional[Iterable[str]] = None, symbol_defs: Optional[Iterable[str]] = None,
@@ -73,9 +76,9 @@ class AnalysedFortran(AnalysedDependent):
         super().__init__(fpath=fpath, file_hash=file_hash,
                          symbol_defs=symbol_defs, symbol_deps=symbol_deps, file_deps=file_deps)
 
-        self.program_defs: Set[str] = set(program_defs or [])
-        self.module_defs: Set[str] = set(module_defs or [])
-        self.module_deps: Set[str] = set(module_deps or [])
+        self.program_defs: Set[str] = set(map(intern, program_defs or []))
+        self.module_defs: Set[str] = set(map(intern, module_defs or []))
+        self.module_deps: Set[str] = set(map(intern, module_deps or []))
         self.mo_commented_file_deps: Set[str] = set(mo_commented_file_deps or [])
 
         # Todo: Ideally Psyclone stuff would not be part of this general fortran analysis code.
@@ -85,15 +88,15 @@ class AnalysedFortran(AnalysedDependent):
         self.validate()
 
     def add_program_def(self, name):
-        self.program_defs.add(name.lower())
+        self.program_defs.add(intern(name.lower()))
         self.add_symbol_def(name)
 
     def add_module_def(self, name):
-        self.module_defs.add(name.lower())
+        self.module_defs.add(intern(name.lower()))
         self.add_symbol_def(name)
 
     def add_module_dep(self, name):
-        self.module_deps.add(name.lower())
+        self.module_deps.add(intern(name.lower()))
         self.add_symbol_dep(name)
 
     @property
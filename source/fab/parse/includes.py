@@ -0,0 +1,110 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+"""
+Find the files included by a source file, so that changing them triggers a rebuild.
+
+Both C preprocessor `#include` directives and Fortran `include` lines are followed, recursively.
+Quoted includes and Fortran includes are searched for in the including file's own folder, then the include paths.
+Angle bracket includes are only searched for in the include paths, so system headers are not found.
+Included files which can't be found are ignored.
+
+Conditional compilation is not evaluated, so this may find files which aren't actually included.
+That can only cause an unnecessary rebuild.
+
+"""
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from fab.util import file_checksum
+
+_CPP_INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+_FORTRAN_INCLUDE_PATTERN = re.compile(r'''^[ \t]*include[ \t]*(['"])([^'"\n]+)\1''',
+                                      re.MULTILINE | re.IGNORECASE)
+
+
+def include_paths_from_flags(flags: Iterable[str]) -> List[Path]:
+    """
+    Get the user include paths from a list of preprocessor flags, in order.
+
+    """
+    include_paths = []
+    flags = list(flags)
+    for i, flag in enumerate(flags):
+        if flag in ('-I', '-iquote'):
+            if i + 1 < len(flags):
+                include_paths.append(Path(flags[i + 1]))
+        elif flag.startswith('-I'):
+            include_paths.append(Path(flag[2:]))
+        elif flag.startswith('-iquote'):
+            include_paths.append(Path(flag[7:]))
+    return include_paths
+
+
+def find_includes(fpath: Path, include_paths: Optional[Iterable[Path]] = None) -> Dict[Path, int]:
+    """
+    Find the files included by a source file, directly or indirectly.
+
+    Returns the included files mapped to their checksums.
+
+    :param fpath:
+        The source file.
+    :param include_paths:
+        Folders to search for included files, after the including file's own folder.
+
+    """
+    include_paths = list(include_paths or [])
+    includes: Dict[Path, int] = {}
+    todo = [fpath]
+    while todo:
+        including_file = todo.pop()
+        for include in _read_includes(including_file, include_paths):
+            if include not in includes and include != fpath:
+                includes[include] = file_checksum(include).file_hash
+                todo.append(include)
+    return includes
+
+
+def includes_hash(includes: Dict[Path, int]) -> int:
+    """
+    A hash of included files, as returned by :func:`find_includes`, for use in a prebuild hash.
+
+    The hash uses the file names rather than their full paths, so that prebuilds can be shared between users.
+
+    """
+    return sum(zlib.crc32(include.name.encode()) + include_hash for include, include_hash in includes.items())
+
+
+def _read_includes(fpath: Path, include_paths: List[Path]) -> List[Path]:
+    # the files directly included by a file, which can be found
+    try:
+        text = fpath.read_text(errors='replace')
+    except OSError:
+        return []
+    # most files include nothing
+    if 'include' not in text.lower():
+        return []
+
+    result = []
+    for match in _CPP_INCLUDE_PATTERN.finditer(text):
+        search_paths = include_paths if match.group(1) == '<' else [fpath.parent] + include_paths
+        include = _resolve(match.group(2).strip(), search_paths)
+        if include:
+            result.append(include)
+    for match in _FORTRAN_INCLUDE_PATTERN.finditer(text):
+        include = _resolve(match.group(2).strip(), [fpath.parent] + include_paths)
+        if include:
+            result.append(include)
+    return result
+
+
+def _resolve(name: str, search_paths: List[Path]) -> Optional[Path]:
+    for folder in search_paths:
+        candidate = folder / name
+        if candidate.is_file():
+            return candidate
+    return None
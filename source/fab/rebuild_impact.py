@@ -0,0 +1,153 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+"""
+Rebuild impact analysis: which files cause the most recompilation when they change.
+
+The :func:`~fab.steps.analyse.analyse` step saves the dependents of every file, the reverse of the file
+dependencies, next to the build metrics. Combined with the compile times recorded by previous builds,
+this tells us the cost of changing each file. Files with a large transitive fan-in, such as widely used
+modules, are the ones which make incremental builds slow.
+
+"""
+import json
+import logging
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from fab.compile_prediction import load_compile_history
+from fab.metrics import JSON_FILENAME
+
+logger = logging.getLogger(__name__)
+
+DEPENDENTS_FILENAME = 'dependents.json'
+
+# metrics groups which record the time taken to compile each file
+COMPILE_METRICS_GROUPS = ['compile fortran', 'compile fortran syntax-only', 'compile c']
+
+# metrics groups whose times aren't kept in the compile history
+C_METRICS_GROUPS = ['compile c']
+
+
+# The cost of changing a file: the number of files which depend on it, directly or indirectly,
+# and the total historical compile time, in seconds, of the file and all its dependents.
+RebuildImpact = namedtuple('RebuildImpact', ['fpath', 'fan_in', 'rebuild_time'])
+
+
+def save_dependents(dependents: Dict[Path, List[Path]], fpath: Path):
+    """
+    Save a dependents index, as made by :meth:`fab.dep_tree.SourceGraph.dependents_index`.
+
+    """
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    data = {str(k): sorted(map(str, v)) for k, v in sorted(dependents.items())}
+    with open(fpath, 'wt') as outfile:
+        json.dump(data, outfile, indent=4)
+
+
+def load_dependents(fpath: Path) -> Dict[Path, List[Path]]:
+    with open(fpath, 'rt') as infile:
+        data = json.load(infile)
+    return {Path(k): list(map(Path, v)) for k, v in data.items()}
+
+
+def compile_times(metrics: Dict, groups: Iterable[str] = COMPILE_METRICS_GROUPS) -> Dict[Path, float]:
+    """
+    Get the time taken to compile each file from the build metrics.
+
+    Files compiled more than once, e.g in a two-stage build, get the total time.
+    Files which used a prebuild are ignored, as they weren't compiled.
+
+    """
+    result: Dict[Path, float] = {}
+    for group in groups:
+        for name, value in metrics.get(group, {}).items():
+            if value.get('prebuild'):
+                continue
+            fpath = Path(name)
+            result[fpath] = result.get(fpath, 0.0) + value['time_taken']
+    return result
+
+
+def historical_compile_times(metrics_folder: Path) -> Dict[Path, float]:
+    """
+    Get the last known time taken to compile each file.
+
+    Fortran times come from the compile history, so files which used a prebuild in the latest build
+    keep the time from when they were last compiled. C times come from the latest build's metrics.
+
+    :param metrics_folder:
+        The project's metrics folder.
+
+    """
+    history = load_compile_history(metrics_folder)
+    result: Dict[Path, float] = {}
+    for times in history:
+        for fpath, time_taken in times.items():
+            result[fpath] = result.get(fpath, 0.0) + time_taken
+
+    metrics_fpath = metrics_folder / JSON_FILENAME
+    if metrics_fpath.exists():
+        with open(metrics_fpath, 'rt') as infile:
+            result.update(compile_times(json.load(infile), groups=C_METRICS_GROUPS))
+    return result
+
+
+def rebuild_impact(dependents: Dict[Path, List[Path]], times: Dict[Path, float],
+                   fpaths: Optional[Iterable[Path]] = None) -> List[RebuildImpact]:
+    """
+    Rank files by the compile time needed to rebuild them and everything which depends on them.
+
+    The rebuild time is the transitive fan-in multiplied by the average historical compile time of the dependents,
+    plus the file's own compile time.
+
+    :param dependents:
+        The files which depend directly on each file.
+    :param times:
+        The historical compile time of each file. Files without a time count as zero.
+    :param fpaths:
+        The files to assess. Defaults to all the files with any dependents.
+
+    """
+    results = []
+    for fpath in (fpaths if fpaths is not None else dependents):
+        seen = {fpath}
+        todo = [fpath]
+        while todo:
+            for dependent in dependents.get(todo.pop(), []):
+                if dependent not in seen:
+                    seen.add(dependent)
+                    todo.append(dependent)
+
+        rebuild_time = sum(times.get(f, 0.0) for f in seen)
+        results.append(RebuildImpact(fpath=fpath, fan_in=len(seen) - 1, rebuild_time=rebuild_time))
+
+    return sorted(results, key=lambda r: (-r.rebuild_time, -r.fan_in, str(r.fpath)))
+
+
+def impact_report(metrics_folder: Path, top: int = 20) -> str:
+    """
+    Create a text report of the files with the biggest rebuild impact, from a previous build.
+
+    The compile times are the last known times from previous builds, as given by :func:`historical_compile_times`.
+
+    :param metrics_folder:
+        The metrics folder of a build, containing its metrics and dependents index.
+    :param top:
+        How many files to list.
+
+    """
+    dependents = load_dependents(metrics_folder / DEPENDENTS_FILENAME)
+    times = historical_compile_times(metrics_folder)
+    if not times:
+        logger.warning(f"no compile times found in {metrics_folder}, ranking by fan-in only")
+
+    impacts = rebuild_impact(dependents, times)[:top]
+
+    lines = [f"{'rebuild time (s)':>16}  {'fan-in':>6}  file"]
+    for impact in impacts:
+        lines.append(f"{impact.rebuild_time:16.2f}  {impact.fan_in:6d}  {impact.fpath}")
+    return '\n'.join(lines)
@@ -8,6 +8,9 @@ Predefined build steps with sensible defaults.
 
 """
 import multiprocessing
+from collections import deque
+from queue import SimpleQueue
+from typing import Optional
 
 from fab.metrics import send_metric
 from fab.util import by_type, TimerLogger
@@ -30,7 +33,7 @@ def step(func):
     return wrapper
 
 
-def run_mp(config, items, func, no_multiprocessing: bool = False):
+def run_mp(config, items, func, no_multiprocessing: bool = False, n_procs: Optional[int] = None):
     """
     Called from Step.run() to process multiple items in parallel.
 
@@ -44,10 +47,16 @@ def run_mp(config, items, func, no_multiprocessing: bool = False):
         A function to process a single item. Must accept a single argument.
     :param no_multiprocessing:
         Overrides the config's multiprocessing flag, disabling multiprocessing for this call.
+    :param n_procs:
+        Optionally limit the number of processes below the config's *n_procs*,
+        for work which needs a lot of memory, such as linking.
 
     """
-    if config.multiprocessing and not no_multiprocessing:
-        with multiprocessing.Pool(config.n_procs) as p:
+    if not no_multiprocessing and config.multiprocessing:
+        procs = config.n_procs
+        if n_procs and procs:
+            procs = min(n_procs, procs)
+        with multiprocessing.Pool(procs) as p:
             results = p.map(func, items)
     else:
         results = [func(f) for f in items]
@@ -79,6 +88,40 @@ def run_mp_imap(config, items, func, result_handler):
         result_handler(analysis_results)
 
 
+def run_mp_dynamic(config, items, func, result_handler):
+    """
+    Like run_mp_imap, but each result can give us more items to process, which are started straight away.
+
+    This is useful for processing a dependency graph, where finishing one item makes others ready,
+    without waiting for everything else in progress to finish first.
+
+    :param items:
+        An iterable of the items which can be processed first.
+    :param func:
+        A function to process a single item. Must accept a single argument.
+    :param result_handler:
+        A function to handle a single result, returning an iterable of new items to process.
+        Exceptions raised by *func* are passed to the handler when multiprocessing.
+
+    """
+    pending = deque(items)
+    if config.multiprocessing:
+        # the pool calls back from its result thread, so we pass the results back through a queue
+        results = SimpleQueue()
+        with multiprocessing.Pool(config.n_procs) as p:
+            outstanding = 0
+            while pending or outstanding:
+                while pending:
+                    p.apply_async(func, (pending.popleft(),), callback=results.put, error_callback=results.put)
+                    outstanding += 1
+                result = results.get()
+                outstanding -= 1
+                pending.extend(result_handler(result))
+    else:
+        while pending:
+            pending.extend(result_handler(func(pending.popleft())))
+
+
 def check_for_errors(results, caller_label=None):
     """
     Check an iterable of results for any exceptions and handle them gracefully.
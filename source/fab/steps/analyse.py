@@ -42,11 +42,13 @@ from typing import Dict, List, Iterable, Set, Optional, Union
 
 from fab import FabException
 from fab.artefacts import ArtefactsGetter, ArtefactSet, CollectionConcat
-from fab.dep_tree import extract_sub_tree, validate_dependencies, AnalysedDependent
+from fab.build_config import FlagsConfig
+from fab.dep_tree import extract_sub_tree, validate_dependencies, AnalysedDependent, BuildTree, SourceGraph
 from fab.mo import add_mo_commented_file_deps
 from fab.parse import AnalysedFile, EmptySourceFile
 from fab.parse.c import AnalysedC, CAnalyser
 from fab.parse.fortran import AnalysedFortran, FortranParserWorkaround, FortranAnalyser
+from fab.rebuild_impact import DEPENDENTS_FILENAME, save_dependents
 from fab.steps import run_mp, step
 from fab.util import TimerLogger, by_type
 
@@ -71,6 +73,10 @@ def analyse(
         special_measure_analysis_results: Optional[Iterable[FortranParserWorkaround]] = None,
         unreferenced_deps: Optional[Iterable[str]] = None,
         ignore_mod_deps: Optional[Iterable[str]] = None,
+        c_single_pass: bool = False,
+        c_common_flags: Optional[List[str]] = None,
+        c_path_flags: Optional[List] = None,
+        c_engine: str = 'libclang',
         ):
     """
     Produce one or more build trees by analysing source code dependencies.
@@ -111,6 +117,19 @@ def analyse(
         those files and all their dependencies will be added to the build tree(s).
     :param ignore_mod_deps:
         Third party Fortran module names to be ignored.
+    :param c_single_pass:
+        Analyse the original C source in a single libclang pass, classifying symbols by their source location.
+        The :func:`~fab.steps.c_pragma_injector.c_pragma_injector` and
+        :func:`~fab.steps.preprocess.preprocess_c` steps are not needed when this is used.
+    :param c_common_flags:
+        Preprocessor flags for all C files, used by single pass C analysis. E.g `['-I$source/include']`.
+    :param c_path_flags:
+        A list of :class:`~fab.build_config.AddFlags`, defining preprocessor flags for selected C files,
+        used by single pass C analysis.
+    :param c_engine:
+        The C analysis engine. The default, 'libclang', gives a precise analysis.
+        Use 'scanner' for a much faster approximate analysis, see :mod:`fab.parse.c_scanner`.
+        The scanner is used automatically when libclang is not installed.
     :param name:
         Human friendly name for logger output, with sensible default.
 
@@ -131,7 +150,9 @@ def analyse(
 
     # todo: these seem more like functions
     fortran_analyser = FortranAnalyser(std=std, ignore_mod_deps=ignore_mod_deps)
-    c_analyser = CAnalyser()
+    c_analyser = CAnalyser(single_pass=c_single_pass,
+                           flags=FlagsConfig(common_flags=c_common_flags, path_flags=c_path_flags),
+                           engine=c_engine)
 
     # Creates the *build_trees* artefact from the files in `self.source_getter`.
 
@@ -178,10 +199,15 @@ def analyse(
     logger.info(f"source tree size {len(project_source_tree)}")
 
     # extract "build trees" for executables.
+    # these are all views of the same compact source graph
+    source_graph = SourceGraph(project_source_tree)
+
+    # record which files depend on each file, for rebuild impact reports
+    save_dependents(source_graph.dependents_index(), config.metrics_folder / DEPENDENTS_FILENAME)
     if root_symbols:
-        build_trees = _extract_build_trees(root_symbols, project_source_tree, symbol_table)
+        build_trees = _extract_build_trees(root_symbols, source_graph, symbol_table)
     else:
-        build_trees = {None: project_source_tree}
+        build_trees = {None: source_graph.full_tree()}
 
     # throw in any extra source we need, which Fab can't automatically detect
     for build_tree in build_trees.values():
@@ -210,7 +236,7 @@ def _analyse_dependencies(analysed_files: Iterable[AnalysedDependent]):
     return source_tree, symbol_table
 
 
-def _extract_build_trees(root_symbols, project_source_tree, symbol_table):
+def _extract_build_trees(root_symbols, source_graph: SourceGraph, symbol_table):
     """
     Find the subset of files needed to build each root symbol (executable).
 
@@ -218,14 +244,12 @@ def _extract_build_trees(root_symbols, project_source_tree, symbol_table):
     Returns a build tree for every root symbol.
 
     """
-    build_trees = {}
     assert root_symbols is not None
-    for root in root_symbols:
-        with TimerLogger(f"extracting build tree for root '{root}'"):
-            build_tree = extract_sub_tree(project_source_tree, symbol_table[root], verbose=False)
+    with TimerLogger(f"extracting build trees for {len(root_symbols)} roots"):
+        build_trees = source_graph.sub_trees({root: symbol_table[root] for root in root_symbols})
 
+    for root, build_tree in build_trees.items():
         logger.info(f"target source tree size {len(build_tree)} (target '{symbol_table[root]}')")
-        build_trees[root] = build_tree
 
     return build_trees
 
@@ -357,6 +381,7 @@ def _add_unreferenced_deps(unreferenced_deps, symbol_table: Dict[str, Path],
         return
     logger.info(f"Adding {len(unreferenced_deps or [])} unreferenced dependencies")
 
+    to_add = []
     for symbol_dep in unreferenced_deps:
 
         # what file is the symbol in?
@@ -377,6 +402,11 @@ def _add_unreferenced_deps(unreferenced_deps, symbol_table: Dict[str, Path],
                         f"is already in the build tree")
             continue
 
-        # add the file and it's file deps
-        sub_tree = extract_sub_tree(source_tree=all_analysed_files, root=analysed_fpath)
-        build_tree.update(sub_tree)
+        to_add.append(analysed_fpath)
+
+    # add the files and their file deps, in a single traversal
+    if isinstance(build_tree, BuildTree):
+        build_tree.update(build_tree.graph.reachable(to_add))
+    else:
+        for analysed_fpath in to_add:
+            build_tree.update(extract_sub_tree(source_tree=all_analysed_files, root=analysed_fpath))
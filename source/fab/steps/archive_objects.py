@@ -8,13 +8,16 @@ Object archive creation from a list of object files for use in static linking.
 
 """
 
+import json
 import logging
+import os
+from pathlib import Path
 from string import Template
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
 
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
-from fab.steps import step
+from fab.steps import check_for_errors, run_mp, step
 from fab.util import log_or_dot
 from fab.tools import Ar, Category
 from fab.artefacts import ArtefactsGetter, CollectionGetter
@@ -35,7 +38,9 @@ DEFAULT_SOURCE_GETTER = CollectionGetter(ArtefactSet.OBJECT_FILES)
 def archive_objects(config: BuildConfig,
                     source: Optional[ArtefactsGetter] = None,
                     output_fpath=None,
-                    output_collection=ArtefactSet.OBJECT_ARCHIVES):
+                    output_collection=ArtefactSet.OBJECT_ARCHIVES,
+                    thin: bool = False,
+                    n_procs: Optional[int] = None):
     """
     Create an object archive for every build target, from their object files.
 
@@ -97,6 +102,22 @@ def archive_objects(config: BuildConfig,
     :param output_collection:
         The name of the artefact collection to create. Defaults to the name in
         :const:`fab.artefacts.ArtefactSet.OBJECT_ARCHIVES`.
+    :param thin:
+        Create GNU thin archives, which refer to the object files in the
+        prebuild folder instead of containing copies of them. A thin archive
+        is only usable while its object files exist.
+    :param n_procs:
+        The maximum number of archives to create at once, when multiprocessing.
+        Defaults to the config's *n_procs*.
+
+    **Incremental Updates:**
+
+    A manifest of the archive's members, with the size and modification time
+    of each object file, is saved next to each archive. If the members haven't
+    changed since the archive was made, it's left as it is. If only some members
+    have changed, just those members are replaced in the archive, and any
+    members no longer needed are removed. Thin archives are recreated whenever
+    their members change, which is cheap.
 
     """
     # todo: the output path should not be an abs fpath, it should be relative
@@ -117,23 +138,105 @@ def archive_objects(config: BuildConfig,
     if not output_fpath and list(target_objects.keys()) == [None]:
         raise ValueError("You must specify an output path when building a library.")
 
-    for root, objects in target_objects.items():
+    root_outputs = {}
+    for root in target_objects:
 
         if root:
             # we're building an object archive for an executable
-            output_fpath = str(config.build_output / f'{root}.a')
+            root_outputs[root] = str(config.build_output / f'{root}.a')
         else:
             # we're building a single object archive with a given filename
             assert len(target_objects) == 1, "unexpected root of None with multiple build targets"
-            output_fpath = Template(str(output_fpath)).substitute(
+            root_outputs[root] = Template(str(output_fpath)).substitute(
                 output=config.build_output)
 
-        log_or_dot(logger, f"CreateObjectArchive running archiver for "
-                           f"'{output_fpath}'.")
+    # the archives are independent, so create them in parallel when there's more than one
+    items = [(ar, root_outputs[root], sorted(map(str, objects)), thin)
+             for root, objects in target_objects.items()]
+    results = run_mp(config, items, _archive, no_multiprocessing=len(items) < 2, n_procs=n_procs)
+    check_for_errors(results, caller_label='archive_objects')
+
+    for root, output in root_outputs.items():
+        config.artefact_store.update_dict(output_collection, root, output)
+
+
+def _archive(arg):
+    # Create or update a single archive, returning any exception for the parent process to report.
+    ar, output_fpath, objects, thin = arg
+    try:
+        _update_archive(ar, Path(output_fpath), objects, thin=thin)
+    except RuntimeError as err:
+        return RuntimeError(f"error creating object archive:\n{err}")
+    return None
+
+
+def _update_archive(ar: Ar, output_fpath: Path, objects: List[str], thin: bool):
+    # Create the archive, or bring an existing archive up to date using its manifest.
+    manifest_fpath = Path(f'{output_fpath}.manifest')
+    members = _member_signatures(objects)
+
+    old_manifest = _read_manifest(manifest_fpath) if output_fpath.exists() else None
+    if members is not None and old_manifest and old_manifest.get('thin') == thin:
+        old_members = old_manifest['members']
+        if old_members == members:
+            log_or_dot(logger, f"CreateObjectArchive archive is up to date: '{output_fpath}'.")
+            return
+
+        # Members are identified by their file names, so they must be unique to update them in place.
+        if not thin and _unique_names(members) and _unique_names(old_members):
+            changed = [obj for obj in objects if old_members.get(obj) != members[obj]]
+            # objects with the same name as a changed one are replaced, not deleted
+            removed = {Path(obj).name for obj in old_members if obj not in members} - \
+                {Path(obj).name for obj in changed}
+
+            log_or_dot(logger, f"CreateObjectArchive updating {len(changed)} and removing {len(removed)} "
+                               f"members of '{output_fpath}'.")
+            # if we fail part way through, the next build will recreate the archive
+            manifest_fpath.unlink()
+            if removed:
+                ar.delete(output_fpath, sorted(removed))
+            if changed:
+                ar.replace(output_fpath, changed)
+            _write_manifest(manifest_fpath, members, thin)
+            return
+
+    log_or_dot(logger, f"CreateObjectArchive running archiver for "
+                       f"'{output_fpath}'.")
+    # ar adds to an existing archive, which might contain members we no longer want
+    for fpath in [manifest_fpath, output_fpath]:
+        if fpath.exists():
+            fpath.unlink()
+    ar.create(output_fpath, objects, thin=thin)
+    if members is not None:
+        _write_manifest(manifest_fpath, members, thin)
+
+
+def _member_signatures(objects: Iterable[str]) -> Optional[Dict[str, List[int]]]:
+    # The size and modification time of each object file, which change whenever it's rebuilt.
+    # Returns None if any object is missing, leaving it to the archiver to report.
+    signatures = {}
+    for obj in objects:
         try:
-            ar.create(output_fpath, sorted(objects))
-        except RuntimeError as err:
-            raise RuntimeError(f"error creating object archive:\n{err}") from err
+            stat = os.stat(obj)
+        except OSError:
+            return None
+        signatures[obj] = [stat.st_size, stat.st_mtime_ns]
+    return signatures
 
-        config.artefact_store.update_dict(output_collection, root,
-                                          output_fpath)
+
+def _unique_names(members: Iterable[str]) -> bool:
+    names = [Path(obj).name for obj in members]
+    return len(names) == len(set(names))
+
+
+def _read_manifest(fpath: Path) -> Optional[Dict]:
+    try:
+        with open(fpath, 'rt') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(fpath: Path, members: Dict[str, List[int]], thin: bool):
+    with open(fpath, 'wt') as outfile:
+        json.dump({'thin': thin, 'members': members}, outfile)
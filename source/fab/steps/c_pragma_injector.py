@@ -14,6 +14,7 @@ from typing import Generator, Pattern, Optional, Match
 from fab import FabException
 from fab.artefacts import ArtefactSet, ArtefactsGetter, SuffixFilter
 from fab.steps import run_mp, step
+from fab.util import write_if_changed
 
 DEFAULT_SOURCE_GETTER = SuffixFilter(ArtefactSet.C_BUILD_FILES, '.c')
 
@@ -59,7 +60,7 @@ def c_pragma_injector(config, source: Optional[ArtefactsGetter] = None,
 
 def _process_artefact(fpath: Path):
     prag_output_fpath = fpath.with_suffix('.prag')
-    prag_output_fpath.open('w').writelines(inject_pragmas(fpath))
+    write_if_changed(prag_output_fpath, ''.join(inject_pragmas(fpath)))
     return prag_output_fpath
 
 
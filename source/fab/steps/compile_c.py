@@ -10,13 +10,17 @@ C file compilation.
 import logging
 import os
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
+from itertools import chain
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Union
 
 from fab import FabException
-from fab.artefacts import ArtefactsGetter, ArtefactSet, FilterBuildTrees
+from fab.artefacts import ArtefactsGetter, ArtefactSet, BuildPlan, FilterBuildTrees
 from fab.build_config import BuildConfig, FlagsConfig
+from fab.compile_batches import compile_batch, make_compile_batches
 from fab.metrics import send_metric
 from fab.parse.c import AnalysedC
+from fab.parse.includes import includes_hash
 from fab.steps import check_for_errors, run_mp, step
 from fab.tools import Category, CCompiler, Flags
 from fab.util import CompiledFile, log_or_dot, Timer, by_type
@@ -36,7 +40,8 @@ class MpCommonArgs:
 
 @step
 def compile_c(config, common_flags: Optional[List[str]] = None,
-              path_flags: Optional[List] = None, source: Optional[ArtefactsGetter] = None):
+              path_flags: Optional[List] = None, source: Optional[ArtefactsGetter] = None,
+              batch_size: int = 1):
     """
     Compiles all C files in all build trees, creating or extending a set of compiled files for each target.
 
@@ -56,6 +61,11 @@ def compile_c(config, common_flags: Optional[List[str]] = None,
         for selected files.
     :param source:
         An :class:`~fab.artefacts.ArtefactsGetter` which give us our c files to process.
+    :param batch_size:
+        The maximum number of files to compile in a single compiler invocation.
+        Batching files saves the compiler start-up time for each file, which can dominate for small files.
+        Only files with the same flags are batched together. If a batch fails to compile,
+        its files are compiled individually to report the errors. Defaults to one file per invocation.
 
     """
     # todo: tell the compiler (and other steps) which artefact name to create?
@@ -69,16 +79,23 @@ def compile_c(config, common_flags: Optional[List[str]] = None,
     flags = FlagsConfig(common_flags=common_flags, path_flags=path_flags)
     source_getter = source or DEFAULT_SOURCE_GETTER
 
-    # gather all the source to compile, for all build trees, into one big lump
-    build_lists: Dict = source_getter(config.artefact_store)
-    to_compile: list = sum(build_lists.values(), [])
-    logger.info(f"compiling {len(to_compile)} c files")
+    # gather all the source to compile, for all build trees, compiling files shared between targets once
+    build_plan = BuildPlan.from_build_lists(source_getter(config.artefact_store))
+    logger.info(f"compiling {len(build_plan)} c files")
 
     mp_payload = MpCommonArgs(config=config, flags=flags)
-    mp_items = [(fpath, mp_payload) for fpath in to_compile]
 
     # compile everything in one go
-    compilation_results = run_mp(config, items=mp_items, func=_compile_file)
+    if batch_size > 1:
+        batches = make_compile_batches(
+            build_plan.units, flags_for=lambda af: flags.flags_for_path(path=af.fpath, config=config),
+            batch_size=batch_size, n_procs=config.n_procs if config.multiprocessing else 1)
+        logger.info(f"compiling in {len(batches)} batches")
+        batch_results = run_mp(config, items=[(batch, mp_payload) for batch in batches], func=_compile_batch)
+        compilation_results = list(chain(*batch_results))
+    else:
+        mp_items = [(fpath, mp_payload) for fpath in build_plan.units]
+        compilation_results = run_mp(config, items=mp_items, func=_compile_file)
     check_for_errors(compilation_results, caller_label='compile c')
     compiled_c = list(by_type(compilation_results, CompiledFile))
     logger.info(f"compiled {len(compiled_c)} c files")
@@ -88,22 +105,69 @@ def compile_c(config, common_flags: Optional[List[str]] = None,
     config.add_current_prebuilds(prebuild_files)
 
     # record the compilation results for the next step
-    store_artefacts(compiled_c, build_lists, config.artefact_store)
+    store_artefacts(compiled_c, build_plan, config.artefact_store)
 
 
 # todo: very similar code in fortran compiler
-def store_artefacts(compiled_files: List[CompiledFile], build_lists: Dict[str, List], artefact_store):
+def store_artefacts(compiled_files: List[CompiledFile], build_lists: Union[BuildPlan, Dict[str, List]],
+                    artefact_store):
     """
     Create our artefact collection; object files for each compiled file, per root symbol.
 
     """
     # add the new object files to the artefact store, by target
-    lookup = {c.input_fpath: c for c in compiled_files}
-    for root, source_files in build_lists.items():
-        new_objects = [lookup[af.fpath].output_fpath for af in source_files]
+    build_plan = BuildPlan.from_build_lists(build_lists)
+    lookup = {c.input_fpath: c.output_fpath for c in compiled_files}
+    for root, new_objects in build_plan.target_outputs(lookup).items():
         artefact_store.update_dict(ArtefactSet.OBJECT_FILES, root, new_objects)
 
 
+def _compile_batch(arg: Tuple[List[AnalysedC], MpCommonArgs]):
+    """
+    Compile the files in a batch which have no prebuild, with a single compiler invocation.
+
+    Returns a result for each file, as :func:`_compile_file`.
+
+    """
+    analysed_files, mp_payload = arg
+    config = mp_payload.config
+    compiler = config.tool_box[Category.C_COMPILER]
+    if not isinstance(compiler, CCompiler):
+        raise RuntimeError(f"Unexpected tool '{compiler.name}' of type "
+                           f"'{type(compiler)}' instead of CCompiler")
+
+    with Timer() as timer:
+        # the files in a batch all have the same flags
+        to_compile: Dict[Path, Path] = {}
+        flags = Flags()
+        for analysed_file in analysed_files:
+            flags = Flags(mp_payload.flags.flags_for_path(path=analysed_file.fpath, config=config))
+            obj_combo_hash = _get_obj_combo_hash(compiler, analysed_file, flags)
+            obj_file_prebuild = config.prebuild_folder / f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o'
+            if not obj_file_prebuild.exists():
+                to_compile[analysed_file.fpath] = obj_file_prebuild
+
+        compiled: Dict[Path, Path] = {}
+        if len(to_compile) > 1:
+            log_or_dot(logger, f'CompileC compiling batch of {len(to_compile)} files')
+            if compile_batch(compiler, to_compile, flags):
+                compiled = {fpath: obj for fpath, obj in to_compile.items() if obj.exists()}
+
+    # anything not compiled in the batch is prebuilt, or compiled on its own
+    results = []
+    for analysed_file in analysed_files:
+        if analysed_file.fpath in compiled:
+            send_metric(
+                group="compile c",
+                name=str(analysed_file.fpath),
+                value={'time_taken': timer.taken / len(compiled), 'start': timer.start})
+            results.append(CompiledFile(input_fpath=analysed_file.fpath, output_fpath=compiled[analysed_file.fpath]))
+        else:
+            results.append(_compile_file((analysed_file, mp_payload)))
+
+    return results
+
+
 def _compile_file(arg: Tuple[AnalysedC, MpCommonArgs]):
 
     analysed_file, mp_payload = arg
@@ -145,7 +209,19 @@ def _get_obj_combo_hash(compiler, analysed_file, flags: Flags):
             analysed_file.file_hash,
             flags.checksum(),
             compiler.get_hash(),
+            _get_header_hash(analysed_file),
         ])
     except TypeError:
         raise ValueError("could not generate combo hash for object file")
     return obj_combo_hash
+
+
+def _get_header_hash(analysed_file: AnalysedC) -> int:
+    """
+    A hash of the user headers included by the file, when we're compiling the original source.
+
+    Single pass analysis records the user headers with their checksums, which are up to date because
+    the analysis is redone when a header changes. Preprocessed source already contains its headers.
+
+    """
+    return includes_hash(analysed_file.header_deps)
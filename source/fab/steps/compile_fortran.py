@@ -8,20 +8,28 @@ Fortran file compilation.
 
 """
 
+import json
 import logging
 import os
 import shutil
-from dataclasses import dataclass
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from itertools import chain
 from pathlib import Path
-from typing import List, Set, Dict, Tuple, Optional, Union
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from fab.artefacts import (ArtefactsGetter, ArtefactSet, ArtefactStore,
-                           FilterBuildTrees)
+                           BuildPlan, FilterBuildTrees)
 from fab.build_config import BuildConfig, FlagsConfig
+from fab.compile_batches import compile_batch, make_compile_batches
+from fab.compile_prediction import estimate_compile_times, load_compile_history, predict, Prediction
 from fab.metrics import send_metric
 from fab.parse.fortran import AnalysedFortran
-from fab.steps import check_for_errors, run_mp, step
+from fab.parse.includes import find_includes, include_paths_from_flags, includes_hash
+from fab.constants import TWO_STAGE_AUTO
+from fab.steps import check_for_errors, run_mp, run_mp_dynamic, step
 from fab.tools import Category, Compiler, Flags, FortranCompiler
 from fab.util import (CompiledFile, log_or_dot_finish, log_or_dot, Timer,
                       by_type, file_checksum)
@@ -38,16 +46,28 @@ class MpCommonArgs:
     flags: FlagsConfig
     mod_hashes: Dict[str, int]
     syntax_only: bool
+    # in a two-stage compile, the first stage creates the mod files and the second the object files
+    two_stage: bool = False
 
 
 @step
 def compile_fortran(config: BuildConfig, common_flags: Optional[List[str]] = None,
-                    path_flags: Optional[List] = None, source: Optional[ArtefactsGetter] = None):
+                    path_flags: Optional[List] = None, source: Optional[ArtefactsGetter] = None,
+                    batch_size: int = 1):
     """
     Compiles all Fortran files in all build trees, creating/extending a set of compiled files for each build target.
 
     Files are compiled in multiple passes, with each pass enabling further files to be compiled in the next pass.
 
+    If the config asks for a two-stage compile, and the compiler supports it, the mod files are first created
+    by syntax-only compiles, and the object files in a second stage. The two stages are scheduled together:
+    a file's object compile starts as soon as its mod files exist, while other mod files are still being made.
+    Files which define no modules skip the first stage.
+
+    If the config's *two_stage* is 'auto', both kinds of compile are simulated on the module dependency graph,
+    using the compile times of previous builds, and the one predicted to be faster is used.
+    The prediction and the actual time taken are logged.
+
     Uses multiprocessing, unless disabled in the config.
 
     :param config:
@@ -60,6 +80,11 @@ def compile_fortran(config: BuildConfig, common_flags: Optional[List[str]] = Non
         for selected files.
     :param source:
         An :class:`~fab.artefacts.ArtefactsGetter` which gives us our Fortran files to process.
+    :param batch_size:
+        The maximum number of files to compile in a single compiler invocation.
+        Files which are ready to compile in the same pass, with the same flags, can be batched together,
+        saving the compiler start-up time for each file. If a batch fails to compile,
+        its files are compiled individually to report the errors. Defaults to one file per invocation.
 
     """
 
@@ -71,46 +96,54 @@ def compile_fortran(config: BuildConfig, common_flags: Optional[List[str]] = Non
     source_getter = source or DEFAULT_SOURCE_GETTER
     mod_hashes: Dict[str, int] = {}
 
-    # get all the source to compile, for all build trees, into one big lump
-    build_lists: Dict[str, List] = source_getter(config.artefact_store)
+    # get all the source to compile, for all build trees, with files shared between targets only once
+    build_plan = BuildPlan.from_build_lists(source_getter(config.artefact_store))
+
+    compiled: Dict[Path, CompiledFile] = {}
+    compile_queue = CompileQueue(build_plan.units)  # type: ignore
+    logger.info(f"compiling {len(compile_queue)} fortran files")
+
+    prediction = None
+    if not compiler.has_syntax_only:
+        if config.two_stage:
+            logger.info(f"Compiler {compiler.name} does not support syntax-only, "
+                        f"disabling two-stage compile.")
+        syntax_only = False
+    elif config.two_stage == TWO_STAGE_AUTO:
+        prediction = predict_two_stage(config, build_plan.units)  # type: ignore
+        syntax_only = prediction.two_stage < prediction.single_stage
+    else:
+        syntax_only = bool(config.two_stage)
 
-    syntax_only = compiler.has_syntax_only and config.two_stage
     # build the arguments passed to the multiprocessing function
     mp_common_args = MpCommonArgs(
         config=config, flags=flags_config,
         mod_hashes=mod_hashes, syntax_only=syntax_only)
 
-    # compile everything in multiple passes
-    compiled: Dict[Path, CompiledFile] = {}
-    uncompiled: Set[AnalysedFortran] = set(sum(build_lists.values(), []))
-    logger.info(f"compiling {len(uncompiled)} fortran files")
-
-    if syntax_only:
-        logger.info("Starting two-stage compile: mod files, multiple passes")
-    elif config.two_stage:
-        logger.info(f"Compiler {compiler.name} does not support syntax-only, "
-                    f"disabling two-stage compile.")
-
-    while uncompiled:
-        uncompiled = compile_pass(config=config, compiled=compiled, uncompiled=uncompiled,
-                                  mp_common_args=mp_common_args, mod_hashes=mod_hashes)
+    with Timer() as timer:
+        if syntax_only:
+            logger.info("Starting two-stage compile: mod files and object files, pipelined")
+            compile_two_stage(config=config, compiled=compiled, compile_queue=compile_queue,
+                              mp_common_args=mp_common_args, batch_size=batch_size)
+        else:
+            # compile everything in multiple passes
+            while compile_queue:
+                compile_pass(config=config, compiled=compiled, compile_queue=compile_queue,
+                             mp_common_args=mp_common_args, mod_hashes=mod_hashes, batch_size=batch_size)
     log_or_dot_finish(logger)
 
-    if syntax_only:
-        logger.info("Finalising two-stage compile: object files, single pass")
-        mp_common_args.syntax_only = False
-
-        # a single pass should now compile all the object files in one go
-        uncompiled = set(sum(build_lists.values(), []))  # todo: order by last compile duration
-        mp_args = [(fpath, mp_common_args) for fpath in uncompiled]
-        results_this_pass = run_mp(config, items=mp_args, func=process_file)
-        log_or_dot_finish(logger)
-        check_for_errors(results_this_pass, caller_label="compile_fortran")
-        compiled_this_pass = list(by_type(results_this_pass, CompiledFile))
-        logger.info(f"stage 2 compiled {len(compiled_this_pass)} files")
+    if prediction:
+        predicted = prediction.two_stage if syntax_only else prediction.single_stage
+        logger.info(f"{'two' if syntax_only else 'single'}-stage compile took {timer.taken:.2f}s, "
+                    f"predicted {predicted:.2f}s")
+        send_metric(
+            group="compile fortran auto",
+            name="two-stage",
+            value={'single_stage': prediction.single_stage, 'two_stage': prediction.two_stage,
+                   'chosen': 'two_stage' if syntax_only else 'single_stage', 'actual': timer.taken})
 
     # record the compilation results for the next step
-    store_artefacts(compiled, build_lists, config.artefact_store)
+    store_artefacts(compiled, build_plan, config.artefact_store)
 
 
 def handle_compiler_args(config: BuildConfig, common_flags=None,
@@ -132,19 +165,122 @@ def handle_compiler_args(config: BuildConfig, common_flags=None,
     return compiler, flags_config
 
 
-def compile_pass(config, compiled: Dict[Path, CompiledFile], uncompiled: Set[AnalysedFortran],
-                 mp_common_args: MpCommonArgs, mod_hashes: Dict[str, int]):
+class CompileQueue(object):
+    """
+    Tracks which Fortran files are ready to compile.
+
+    Each file has a count of the dependencies it's still waiting for. When a file is compiled,
+    the counts of the files which depend on it are reduced, and any which reach zero become ready.
+
+    Files which can never be compiled, because of circular or missing dependencies, are found up front,
+    before anything is compiled.
+
+    """
+    def __init__(self, uncompiled: Iterable[AnalysedFortran], compiled: Optional[Iterable[Path]] = None):
+        """
+        :param uncompiled:
+            The files to compile.
+        :param compiled:
+            Files which have already been compiled.
+
+        """
+        compiled = set(compiled or [])
+        self._files: Dict[Path, AnalysedFortran] = {af.fpath: af for af in uncompiled}
+        self._waiting_for: Dict[Path, int] = {}
+        self._dependents: Dict[Path, List[Path]] = defaultdict(list)
+        self._ready: List[AnalysedFortran] = []
+
+        for af in self._files.values():
+            unfulfilled = [dep for dep in af.file_deps if dep not in compiled and dep.suffix == '.f90']
+            for dep in unfulfilled:
+                self._dependents[dep].append(af.fpath)
+            self._waiting_for[af.fpath] = len(unfulfilled)
+            if not unfulfilled:
+                self._ready.append(af)
+
+        self._check_compilable()
+
+    def __len__(self):
+        """The number of files still to compile."""
+        return len(self._waiting_for)
+
+    def _check_compilable(self):
+        # Simulate compiling everything, in dependency order, to find the files which never become ready.
+        waiting_for = dict(self._waiting_for)
+        todo = [af.fpath for af in self._ready]
+        while todo:
+            for dependent in self._dependents.get(todo.pop(), []):
+                waiting_for[dependent] -= 1
+                if not waiting_for[dependent]:
+                    todo.append(dependent)
+
+        stuck = {fpath for fpath, count in waiting_for.items() if count}
+        if stuck:
+            msg = 'Cannot compile due to circular or unfulfilled dependencies:\n'
+            for fpath in sorted(stuck):
+                msg += f'\n\n{fpath}'
+                for dep in sorted(self._files[fpath].file_deps):
+                    if dep in stuck or (dep.suffix == '.f90' and dep not in self._files):
+                        msg += f'\n    {str(dep)}'
+            raise ValueError(msg)
+
+    def analysed_file(self, fpath: Path) -> AnalysedFortran:
+        return self._files[fpath]
+
+    def next_pass(self) -> List[AnalysedFortran]:
+        """
+        Take all the files which are ready to compile.
+
+        """
+        ready, self._ready = self._ready, []
+        return ready
+
+    def done(self, fpaths: Iterable[Path]):
+        """
+        Record that files have been compiled, making their dependents ready when they have nothing else to wait for.
+
+        """
+        for fpath in fpaths:
+            if self._waiting_for.pop(fpath, None) is None:
+                continue
+            for dependent in self._dependents.get(fpath, []):
+                self._waiting_for[dependent] -= 1
+                if not self._waiting_for[dependent]:
+                    self._ready.append(self._files[dependent])
+
+
+def predict_two_stage(config, analysed_files: List[AnalysedFortran]) -> Prediction:
+    """
+    Predict how long single-stage and two-stage compiles of the files will take.
+
+    Uses the compile times from previous builds, where there are any.
+    See :mod:`fab.compile_prediction`.
+
+    """
+    history = load_compile_history(config.metrics_folder)
+    times = estimate_compile_times(analysed_files, history)
+    n_procs = config.n_procs if config.multiprocessing else 1
+    prediction = predict(analysed_files, times, n_procs=n_procs)
+
+    logger.info(f"two-stage auto: predicted single-stage {prediction.single_stage:.2f}s, "
+                f"two-stage {prediction.two_stage:.2f}s, "
+                f"from the history of {len(history.full)} files")
+    return prediction
+
+
+def compile_pass(config, compiled: Dict[Path, CompiledFile], compile_queue: CompileQueue,
+                 mp_common_args: MpCommonArgs, mod_hashes: Dict[str, int], batch_size: int = 1):
 
     # what can we compile next?
-    compile_next = get_compile_next(compiled, uncompiled)
+    compile_next = compile_queue.next_pass()
 
     # compile
-    logger.info(f"\ncompiling {len(compile_next)} of {len(uncompiled)} remaining files")
-    mp_args = [(fpath, mp_common_args) for fpath in compile_next]
-    results_this_pass = run_mp(config, items=mp_args, func=process_file)
+    logger.info(f"\ncompiling {len(compile_next)} of {len(compile_queue)} remaining files")
+    results_this_pass = _run_compile(config, compile_next, mp_common_args, batch_size)
 
-    # there's a compilation result and a list of prebuild files for each compiled file
-    compilation_results, prebuild_files = zip(*results_this_pass) if results_this_pass else (tuple(), tuple())
+    # there's a compilation result, a list of prebuild files and the module hashes for each compiled file
+    compilation_results, prebuild_files, new_mod_hashes = \
+        zip(*results_this_pass) if results_this_pass else (tuple(), tuple(), tuple())
     check_for_errors(compilation_results, caller_label="compile_pass")
     compiled_this_pass = list(by_type(compilation_results, CompiledFile))
     logger.debug(f"compiled {len(compiled_this_pass)} files")
@@ -152,61 +288,144 @@ def compile_pass(config, compiled: Dict[Path, CompiledFile], uncompiled: Set[Ana
     # record the prebuild files as being current, so the cleanup knows not to delete them
     config.add_current_prebuilds(chain(*prebuild_files))
 
-    # hash the modules we just created
-    new_mod_hashes = get_mod_hashes(compile_next, config)
-    mod_hashes.update(new_mod_hashes)
+    # record the hashes of the modules we just created
+    for file_mod_hashes in new_mod_hashes:
+        mod_hashes.update(file_mod_hashes)
 
     # add compiled files to all compiled files
     compiled.update({cf.input_fpath: cf for cf in compiled_this_pass})
 
-    # remove compiled files from remaining files
-    uncompiled = set(filter(lambda af: af.fpath not in compiled, uncompiled))
-    return uncompiled
+    # make the files which depend on them ready for the next pass
+    compile_queue.done(cf.input_fpath for cf in compiled_this_pass)
+
+
+def compile_two_stage(config, compiled: Dict[Path, CompiledFile], compile_queue: CompileQueue,
+                      mp_common_args: MpCommonArgs, batch_size: int = 1):
+    """
+    Compile the mod files and then the object files, scheduling both stages as one graph.
 
+    A file's syntax-only compile starts when the mod files it depends on exist,
+    and its object compile starts as soon as its own syntax-only compile is done.
+    There's no need to wait for the rest of the pass.
 
-def get_compile_next(compiled: Dict[Path, CompiledFile], uncompiled: Set[AnalysedFortran]) \
-        -> Set[AnalysedFortran]:
+    An object compile can run while other files' syntax-only compiles read the mod files it would rewrite,
+    so the object compiles create their mod files in a throwaway folder, leaving the module folder alone.
 
-    # find what to compile next
-    compile_next = set()
-    not_ready: Dict[Path, List[Path]] = {}
-    for af in uncompiled:
-        # all deps ready?
-        unfulfilled = [dep for dep in af.file_deps if dep not in compiled and dep.suffix == '.f90']
-        if unfulfilled:
-            not_ready[af.fpath] = unfulfilled
+    """
+    stage_args = {
+        syntax_only: replace(mp_common_args, syntax_only=syntax_only, two_stage=True)
+        for syntax_only in [True, False]
+    }
+    mod_hashes = mp_common_args.mod_hashes
+    prebuild_files: List[Path] = []
+    errors: List[Exception] = []
+    stage2_count = 0
+
+    def make_tasks(analysed_files: List[AnalysedFortran], syntax_only: bool) -> List:
+        # each task gets just the mod hashes it needs, because they're still being added to
+        if batch_size <= 1:
+            batches = [[af] for af in analysed_files]
         else:
-            compile_next.add(af)
+            batches = make_compile_batches(
+                analysed_files,
+                flags_for=lambda af: mp_common_args.flags.flags_for_path(path=af.fpath, config=config),
+                batch_size=batch_size, n_procs=config.n_procs if config.multiprocessing else 1)
+
+        tasks = []
+        for batch in batches:
+            needed = set(chain(*(af.module_deps for af in batch)))
+            batch_hashes = {mod: mod_hashes[mod] for mod in needed if mod in mod_hashes}
+            tasks.append((batch, replace(stage_args[syntax_only], mod_hashes=batch_hashes)))
+        return tasks
+
+    def stage1_done(analysed_files: List[AnalysedFortran]) -> List:
+        # start the object compiles for these files, and the syntax-only compiles they've made ready
+        stage2 = list(analysed_files)
+        stage1: List[AnalysedFortran] = []
+        compile_queue.done(af.fpath for af in analysed_files)
+        ready = compile_queue.next_pass()
+        while ready:
+            # files which define no modules have nothing to make in the first stage
+            no_mods = [af for af in ready if not af.module_defs]
+            stage1.extend(af for af in ready if af.module_defs)
+            stage2.extend(no_mods)
+            compile_queue.done(af.fpath for af in no_mods)
+            ready = compile_queue.next_pass()
+        return make_tasks(stage1, syntax_only=True) + make_tasks(stage2, syntax_only=False)
+
+    def handle_result(task_result) -> List:
+        nonlocal stage2_count
+        if isinstance(task_result, Exception):
+            errors.append(task_result)
+            return []
+
+        syntax_only, results = task_result
+        done = []
+        for compilation_result, artefacts, new_mod_hashes in results:
+            if isinstance(compilation_result, Exception):
+                errors.append(compilation_result)
+                continue
+            prebuild_files.extend(artefacts)
+            if syntax_only:
+                mod_hashes.update(new_mod_hashes)
+                done.append(compile_queue.analysed_file(compilation_result.input_fpath))
+            else:
+                compiled[compilation_result.input_fpath] = compilation_result
+                stage2_count += 1
+
+        # don't start anything new once there's an error, but let the compiles in progress finish
+        if errors:
+            return []
+        return stage1_done(done)
+
+    run_mp_dynamic(config, items=stage1_done([]), func=_process_stage, result_handler=handle_result)
+    check_for_errors(errors, caller_label="compile_two_stage")
+
+    # record the prebuild files as being current, so the cleanup knows not to delete them
+    config.add_current_prebuilds(prebuild_files)
+    logger.info(f"stage 2 compiled {stage2_count} files")
+
 
-    # unable to compile anything?
-    if len(uncompiled) and not compile_next:
-        msg = 'Nothing more can be compiled due to unfulfilled dependencies:\n'
-        for f, unf in not_ready.items():
-            msg += f'\n\n{f}'
-            for u in unf:
-                msg += f'\n    {str(u)}'
+def _process_stage(arg: Tuple[List[AnalysedFortran], MpCommonArgs]) -> Tuple[bool, List]:
+    # compile a file or a batch in either stage of a two-stage compile, saying which stage the results are from
+    analysed_files, mp_common_args = arg
+    if len(analysed_files) == 1:
+        results = [process_file((analysed_files[0], mp_common_args))]
+    else:
+        results = process_batch(arg)
+    return mp_common_args.syntax_only, results
 
-        raise ValueError(msg)
 
-    return compile_next
+def _run_compile(config, analysed_files: List[AnalysedFortran], mp_common_args: MpCommonArgs, batch_size: int):
+    # compile the files one per process, or in batches, returning a result for each file
+    if batch_size <= 1:
+        mp_args = [(af, mp_common_args) for af in analysed_files]
+        return run_mp(config, items=mp_args, func=process_file)
+
+    batches = make_compile_batches(
+        analysed_files, flags_for=lambda af: mp_common_args.flags.flags_for_path(path=af.fpath, config=config),
+        batch_size=batch_size, n_procs=config.n_procs if config.multiprocessing else 1)
+    batch_results = run_mp(config, items=[(batch, mp_common_args) for batch in batches], func=process_batch)
+    return list(chain(*batch_results))
 
 
 def store_artefacts(compiled_files: Dict[Path, CompiledFile],
-                    build_lists: Dict[str, List],
+                    build_lists: Union[BuildPlan, Dict[str, List]],
                     artefact_store: ArtefactStore):
     """
     Create our artefact collection; object files for each compiled file, per root symbol.
 
     """
     # add the new object files to the artefact store, by target
-    lookup = {c.input_fpath: c for c in compiled_files.values()}
-    for root, source_files in build_lists.items():
-        new_objects = {lookup[af.fpath].output_fpath for af in source_files}
+    build_plan = BuildPlan.from_build_lists(build_lists)
+    lookup = {c.input_fpath: c.output_fpath for c in compiled_files.values()}
+    for root, new_objects in build_plan.target_outputs(lookup).items():
         artefact_store.update_dict(ArtefactSet.OBJECT_FILES, root, new_objects)
 
 
-def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
-        -> Union[Tuple[CompiledFile, List[Path]], Tuple[Exception, None]]:
+def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs], batch_time: Optional[float] = None,
+                 prebuild_paths: Optional[Tuple[int, Path, List[Path], Path]] = None) \
+        -> Union[Tuple[CompiledFile, List[Path], Dict[str, int]], Tuple[Exception, None, None]]:
     """
     Prepare to compile a fortran file, and compile it if anything has changed since it was last compiled.
 
@@ -219,10 +438,27 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
         Prebuild filenames include a "combo-hash" of everything that, if changed, must trigger a recompile.
         For mod and object files, this includes a checksum of: *source code, compiler*.
         For object files, this also includes a checksum of: *compiler flags, modules on which we depend*.
+        Both also include a checksum of any files included by the source, e.g with a Fortran `include` line.
 
         Before compiling a file, we calculate the combo hashes and see if the output files already exists.
 
-    Returns a compilation result, regardless of whether it was compiled or prebuilt.
+        In a two-stage compile, the first stage only needs the mod files and the second stage only needs
+        the object file, so each stage can use its prebuilds independently.
+
+    The checksums of the mod files are stored alongside the prebuilt mod files,
+    so that using a prebuild doesn't need to read the mod files again.
+
+    Returns a compilation result, regardless of whether it was compiled or prebuilt,
+    the prebuild files and the checksum of each mod file defined.
+
+    :param arg:
+        The file to compile, and the common arguments.
+    :param batch_time:
+        Given when the file has just been compiled in a batch, with this share of the batch's time.
+        The new object and mod files are then stored as if they had been compiled here.
+    :param prebuild_paths:
+        The file's prebuild paths, as given by :func:`_get_prebuild_paths`, if they're already known.
+        Finding them reads the file and everything it includes, so a batch passes on the ones it found.
 
     """
     with Timer() as timer:
@@ -235,51 +471,71 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
                                f"FortranCompiler")
         flags = Flags(mp_common_args.flags.flags_for_path(path=analysed_file.fpath, config=config))
 
-        mod_combo_hash = _get_mod_combo_hash(analysed_file, compiler=compiler)
-        obj_combo_hash = _get_obj_combo_hash(analysed_file,
-                                             mp_common_args=mp_common_args,
-                                             compiler=compiler, flags=flags)
-
         # calculate the incremental/prebuild artefact filenames
-        obj_file_prebuild = mp_common_args.config.prebuild_folder / f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o'
-        mod_file_prebuilds = [
-            mp_common_args.config.prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod'
-            for mod_def in analysed_file.module_defs
-        ]
+        if prebuild_paths is None:
+            prebuild_paths = _get_prebuild_paths(
+                analysed_file, mp_common_args=mp_common_args, compiler=compiler, flags=flags)
+        mod_combo_hash, obj_file_prebuild, mod_file_prebuilds, mod_hashes_prebuild = prebuild_paths
 
         # have we got all the prebuilt artefacts we need to avoid a recompile?
-        prebuilds_exist = list(map(lambda f: f.exists(), [obj_file_prebuild] + mod_file_prebuilds))
+        stage_prebuilds = _stage_prebuilds(mp_common_args, obj_file_prebuild, mod_file_prebuilds)
+        if batch_time is not None:
+            prebuilds_exist = [False]
+        else:
+            prebuilds_exist = list(map(lambda f: f.exists(), stage_prebuilds))
+        makes_mods = _makes_mods(mp_common_args)
         if not all(prebuilds_exist):
-            # compile
-            try:
-                logger.debug(f'CompileFortran compiling {analysed_file.fpath}')
-                compile_file(analysed_file.fpath, flags,
-                             output_fpath=obj_file_prebuild,
-                             mp_common_args=mp_common_args)
-            except Exception as err:
-                return Exception(f"Error compiling {analysed_file.fpath}:\n{err}"), None
-
-            # copy the mod files to the prebuild folder as artefacts for reuse
-            # note: perhaps we could sometimes avoid these copies because mods can change less frequently than obj
-            for mod_def in analysed_file.module_defs:
-                shutil.copy2(
-                    mp_common_args.config.build_output / f'{mod_def}.mod',
-                    mp_common_args.config.prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod',
-                )
+            # compile, unless it was just compiled in a batch
+            if batch_time is None:
+                try:
+                    logger.debug(f'CompileFortran compiling {analysed_file.fpath}')
+                    compile_file(analysed_file.fpath, flags,
+                                 output_fpath=obj_file_prebuild,
+                                 mp_common_args=mp_common_args)
+                except Exception as err:
+                    return Exception(f"Error compiling {analysed_file.fpath}:\n{err}"), None, None
+
+            mod_hashes: Dict[str, int] = {}
+            if makes_mods:
+                # copy the mod files to the prebuild folder as artefacts for reuse
+                # note: perhaps we could sometimes avoid these copies because mods can change less frequently
+                for mod_def in analysed_file.module_defs:
+                    shutil.copy2(
+                        mp_common_args.config.build_output / f'{mod_def}.mod',
+                        mp_common_args.config.prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod',
+                    )
+
+                # hash the new mod files here, in parallel, and store the hashes for when they're next reused
+                mod_hashes = get_mod_hashes([analysed_file], config)
+                if mod_hashes:
+                    _write_mod_hashes(mod_hashes, mod_hashes_prebuild)
 
         else:
             log_or_dot(logger, f'CompileFortran using prebuild: {analysed_file.fpath}')
 
-            # copy the prebuilt mod files from the prebuild folder
-            for mod_def in analysed_file.module_defs:
-                shutil.copy2(
-                    mp_common_args.config.prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod',
-                    mp_common_args.config.build_output / f'{mod_def}.mod',
-                )
+            mod_hashes = {}
+            if makes_mods:
+                # copy the prebuilt mod files from the prebuild folder
+                for mod_def in analysed_file.module_defs:
+                    shutil.copy2(
+                        mp_common_args.config.prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod',
+                        mp_common_args.config.build_output / f'{mod_def}.mod',
+                    )
+
+                # the mod hashes were stored when they were built, but older prebuilds may not have them
+                stored_mod_hashes = _read_mod_hashes(mod_hashes_prebuild, analysed_file)
+                if stored_mod_hashes is not None:
+                    mod_hashes = stored_mod_hashes
+                else:
+                    mod_hashes = get_mod_hashes([analysed_file], config)
+                    if mod_hashes:
+                        _write_mod_hashes(mod_hashes, mod_hashes_prebuild)
 
         # return the results
         compiled_file = CompiledFile(input_fpath=analysed_file.fpath, output_fpath=obj_file_prebuild)
-        artefacts = [obj_file_prebuild] + mod_file_prebuilds
+        artefacts = stage_prebuilds
+        if mod_hashes:
+            artefacts.append(mod_hashes_prebuild)
 
     metric_name = "compile fortran"
     if mp_common_args.syntax_only:
@@ -288,14 +544,134 @@ def process_file(arg: Tuple[AnalysedFortran, MpCommonArgs]) \
     send_metric(
         group=metric_name,
         name=str(analysed_file.fpath),
-        value={'time_taken': timer.taken, 'start': timer.start})
+        value={'time_taken': timer.taken + (batch_time or 0.0), 'start': timer.start,
+               'prebuild': all(prebuilds_exist)})
+
+    return compiled_file, artefacts, mod_hashes
+
+
+def process_batch(arg: Tuple[List[AnalysedFortran], MpCommonArgs]) -> List:
+    """
+    Compile the files in a batch which have no prebuild, with a single compiler invocation.
+
+    The files in a batch must have the same flags. If the batch fails to compile,
+    its files are compiled individually, to find which of them failed.
 
-    return compiled_file, artefacts
+    Returns a result for each file, as :func:`process_file`.
+
+    """
+    with Timer() as timer:
+        analysed_files, mp_common_args = arg
+        config = mp_common_args.config
+        compiler = config.tool_box[Category.FORTRAN_COMPILER]
+        if not isinstance(compiler, FortranCompiler):
+            raise RuntimeError(f"Unexpected tool '{compiler.name}' of type "
+                               f"'{type(compiler)}' instead of "
+                               f"FortranCompiler")
+
+        to_compile: Dict[Path, Path] = {}
+        prebuild_paths: Dict[Path, Tuple[int, Path, List[Path], Path]] = {}
+        flags = Flags()
+        for analysed_file in analysed_files:
+            flags = Flags(mp_common_args.flags.flags_for_path(path=analysed_file.fpath, config=config))
+            prebuild_paths[analysed_file.fpath] = \
+                _get_prebuild_paths(analysed_file, mp_common_args=mp_common_args, compiler=compiler, flags=flags)
+            _, obj_file_prebuild, mod_file_prebuilds, _ = prebuild_paths[analysed_file.fpath]
+            if not all(f.exists() for f in _stage_prebuilds(mp_common_args, obj_file_prebuild, mod_file_prebuilds)):
+                to_compile[analysed_file.fpath] = obj_file_prebuild
+
+        compiled: Set[Path] = set()
+        if len(to_compile) > 1:
+            logger.debug(f'CompileFortran compiling batch of {len(to_compile)} files')
+            with _module_folder(mp_common_args) as module_folder:
+                batch_ok = compile_batch(compiler, to_compile, flags, syntax_only=mp_common_args.syntax_only,
+                                         module_folder=module_folder)
+            if batch_ok:
+                # a syntax-only compile creates no object files
+                compiled = {fpath for fpath, obj in to_compile.items() if mp_common_args.syntax_only or obj.exists()}
+
+    # store the batch's outputs, use prebuilds, or compile individually
+    return [
+        process_file((analysed_file, mp_common_args),
+                     batch_time=timer.taken / len(compiled) if analysed_file.fpath in compiled else None,
+                     prebuild_paths=prebuild_paths[analysed_file.fpath])
+        for analysed_file in analysed_files
+    ]
+
+
+def _get_prebuild_paths(analysed_file: AnalysedFortran, mp_common_args: MpCommonArgs,
+                        compiler: Compiler, flags: Flags) -> Tuple[int, Path, List[Path], Path]:
+    # the prebuild paths for the object file, mod files and mod hashes, named with their combo hashes
+    # the compiler runs in the source file's folder, so relative include paths are relative to that
+    include_paths = [analysed_file.fpath.parent / path for path in include_paths_from_flags(flags)]
+    include_hash = includes_hash(find_includes(analysed_file.fpath, include_paths))
+    mod_combo_hash = _get_mod_combo_hash(analysed_file, compiler=compiler, include_hash=include_hash)
+    obj_combo_hash = _get_obj_combo_hash(analysed_file,
+                                         mp_common_args=mp_common_args,
+                                         compiler=compiler, flags=flags, include_hash=include_hash)
+
+    prebuild_folder = mp_common_args.config.prebuild_folder
+    obj_file_prebuild = prebuild_folder / f'{analysed_file.fpath.stem}.{obj_combo_hash:x}.o'
+    mod_file_prebuilds = [
+        prebuild_folder / f'{mod_def}.{mod_combo_hash:x}.mod'
+        for mod_def in analysed_file.module_defs
+    ]
+    mod_hashes_prebuild = prebuild_folder / f'{analysed_file.fpath.stem}.{mod_combo_hash:x}.modhash'
+
+    return mod_combo_hash, obj_file_prebuild, mod_file_prebuilds, mod_hashes_prebuild
+
+
+def _makes_mods(mp_common_args: MpCommonArgs) -> bool:
+    # the second stage of a two-stage compile uses the mod files from the first stage
+    return mp_common_args.syntax_only or not mp_common_args.two_stage
+
+
+@contextmanager
+def _module_folder(mp_common_args: MpCommonArgs):
+    # Where to create mod files, or None for the module folder.
+    # The second stage of a two-stage compile doesn't touch the mod files made by the first stage,
+    # which may be being read by other compiles, so its own copies go in a throwaway folder.
+    if _makes_mods(mp_common_args):
+        yield None
+    else:
+        with TemporaryDirectory(prefix='fab_mods_') as folder:
+            yield Path(folder)
+
+
+def _stage_prebuilds(mp_common_args: MpCommonArgs, obj_file_prebuild: Path, mod_file_prebuilds: List[Path]) \
+        -> List[Path]:
+    # the prebuild files made by this compile, which must all exist to avoid compiling
+    prebuilds = []
+    if not mp_common_args.syntax_only:
+        prebuilds.append(obj_file_prebuild)
+    if _makes_mods(mp_common_args):
+        prebuilds.extend(mod_file_prebuilds)
+    return prebuilds
+
+
+def _write_mod_hashes(mod_hashes: Dict[str, int], fpath: Path):
+    with open(fpath, 'wt') as outfile:
+        json.dump(mod_hashes, outfile)
+
+
+def _read_mod_hashes(fpath: Path, analysed_file: AnalysedFortran) -> Optional[Dict[str, int]]:
+    # Returns None if the stored hashes are missing or don't cover all the modules we define.
+    if not analysed_file.module_defs:
+        return {}
+    try:
+        with open(fpath, 'rt') as infile:
+            mod_hashes = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if set(mod_hashes) != set(analysed_file.module_defs):
+        return None
+    return mod_hashes
 
 
 def _get_obj_combo_hash(analysed_file, mp_common_args: MpCommonArgs,
-                        compiler: Compiler, flags: Flags):
-    # get a combo hash of things which matter to the object file we define
+                        compiler: Compiler, flags: Flags, include_hash: int = 0):
+    # get a combo hash of things which matter to the object file we define,
+    # including the files it includes, as given by include_hash
     # todo: don't just silently use 0 for a missing dep hash
     mod_deps_hashes = {
         mod_dep: mp_common_args.mod_hashes.get(mod_dep, 0) for mod_dep in analysed_file.module_deps}
@@ -305,18 +681,20 @@ def _get_obj_combo_hash(analysed_file, mp_common_args: MpCommonArgs,
             flags.checksum(),
             sum(mod_deps_hashes.values()),
             compiler.get_hash(),
+            include_hash,
         ])
     except TypeError:
         raise ValueError("could not generate combo hash for object file")
     return obj_combo_hash
 
 
-def _get_mod_combo_hash(analysed_file, compiler: Compiler):
+def _get_mod_combo_hash(analysed_file, compiler: Compiler, include_hash: int = 0):
     # get a combo hash of things which matter to the mod files we define
     try:
         mod_combo_hash = sum([
             analysed_file.file_hash,
             compiler.get_hash(),
+            include_hash,
         ])
     except TypeError:
         raise ValueError("could not generate combo hash for mod files")
@@ -339,12 +717,14 @@ def compile_file(analysed_file, flags, output_fpath, mp_common_args):
     config = mp_common_args.config
     compiler = config.tool_box[Category.FORTRAN_COMPILER]
 
-    compiler.compile_file(input_file=analysed_file, output_file=output_fpath,
-                          add_flags=flags,
-                          syntax_only=mp_common_args.syntax_only)
+    with _module_folder(mp_common_args) as module_folder:
+        compiler.compile_file(input_file=analysed_file, output_file=output_fpath,
+                              add_flags=flags,
+                              syntax_only=mp_common_args.syntax_only,
+                              module_folder=module_folder)
 
 
-def get_mod_hashes(analysed_files: Set[AnalysedFortran], config) -> Dict[str, int]:
+def get_mod_hashes(analysed_files: Iterable[AnalysedFortran], config) -> Dict[str, int]:
     """
     Get the hash of every module file defined in the list of analysed files.
 
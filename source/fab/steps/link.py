@@ -8,16 +8,28 @@ Link an executable.
 
 """
 import logging
+import os
+import shutil
+from pathlib import Path
 from string import Template
-from typing import Optional
+from typing import Dict, List, Optional
 
 from fab.artefacts import ArtefactSet
-from fab.steps import step
-from fab.tools import Category
+from fab.metrics import send_metric
+from fab.steps import check_for_errors, run_mp, step
+from fab.tools import Category, Flags, Linker
 from fab.artefacts import ArtefactsGetter, CollectionGetter
+from fab.util import file_checksum, log_or_dot, Timer
 
 logger = logging.getLogger(__name__)
 
+# Linking can need a lot of memory, so by default we only link this many targets at once.
+DEFAULT_LINK_PROCS = 4
+
+# Where the linker looks for -l libraries which aren't in a -L folder.
+SYSTEM_LIB_DIRS = ['/usr/local/lib64', '/usr/local/lib', '/usr/lib64', '/usr/lib',
+                   '/usr/lib/x86_64-linux-gnu', '/lib64', '/lib']
+
 
 class DefaultLinkerSource(ArtefactsGetter):
     """
@@ -32,7 +44,8 @@ class DefaultLinkerSource(ArtefactsGetter):
 
 
 @step
-def link_exe(config, flags=None, source: Optional[ArtefactsGetter] = None):
+def link_exe(config, flags=None, source: Optional[ArtefactsGetter] = None,
+             n_procs: Optional[int] = DEFAULT_LINK_PROCS):
     """
     Link object files into an executable for every build target.
 
@@ -50,6 +63,14 @@ def link_exe(config, flags=None, source: Optional[ArtefactsGetter] = None):
     :param source:
         An optional :class:`~fab.artefacts.ArtefactsGetter`. It defaults to the
         output from compiler steps, which typically is the expected behaviour.
+    :param n_procs:
+        The maximum number of executables to link at once, when multiprocessing.
+        This is separate from the config's *n_procs* because linking can need a
+        lot of memory. Use None to link as many as the config allows.
+
+    Linked executables are kept in the prebuild folder, named with a hash of the
+    linker inputs, flags and linker. If nothing has changed, the executable is
+    restored from there instead of being linked again.
 
     """
     linker = config.tool_box[Category.LINKER]
@@ -59,9 +80,9 @@ def link_exe(config, flags=None, source: Optional[ArtefactsGetter] = None):
     source_getter = source or DefaultLinkerSource()
 
     target_objects = source_getter(config.artefact_store)
-    for root, objects in target_objects.items():
-        exe_path = config.project_workspace / f'{root}'
-        linker.link(objects, exe_path, flags)
+    exe_objects = {config.project_workspace / f'{root}': objects for root, objects in target_objects.items()}
+    _link_all(config, linker, exe_objects, flags, n_procs)
+    for exe_path in exe_objects:
         config.artefact_store.add(ArtefactSet.EXECUTABLES, exe_path)
 
 
@@ -106,4 +127,116 @@ def link_shared_object(config, output_fpath: str, flags=None,
 
     objects = target_objects[None]
     out_name = Template(output_fpath).substitute(output=config.build_output)
-    linker.link(objects, out_name, add_libs=flags)
+    _link_all(config, linker, {Path(out_name): objects}, flags)
+
+
+def _link_all(config, linker: Linker, output_objects: Dict[Path, List], flags: List[str],
+              n_procs: Optional[int] = None):
+    # Link each output from its objects, in parallel when there's more than one.
+    items = [(config, linker, objects, output_fpath, flags) for output_fpath, objects in output_objects.items()]
+    results = run_mp(config, items, _link, no_multiprocessing=len(items) < 2, n_procs=n_procs)
+    check_for_errors(results, caller_label='linking')
+
+    # record the prebuild files as being current, so the cleanup knows not to delete them
+    prebuild_fpaths = [fpath for fpath in results if fpath]
+    if prebuild_fpaths:
+        config.add_current_prebuilds(prebuild_fpaths)
+
+
+def _link(arg):
+    """
+    Link the objects, or restore the output from the prebuild folder if nothing has changed.
+
+    Returns the prebuild file, if there is one, or the exception if linking failed.
+
+    """
+    config, linker, objects, output_fpath, flags = arg
+    prebuild_fpath = None
+    try:
+        with Timer() as timer:
+            link_hash = _get_link_combo_hash(linker, objects, flags)
+            if link_hash is None:
+                # we can't hash a missing input, so leave it to the linker to report
+                linker.link(objects, output_fpath, add_libs=flags)
+                prebuilt = False
+            else:
+                suffix = output_fpath.suffix or '.exe'
+                prebuild_fpath = config.prebuild_folder / f'{output_fpath.stem}.{link_hash:x}{suffix}'
+                prebuilt = prebuild_fpath.exists()
+                if prebuilt:
+                    log_or_dot(logger, f'Link using prebuild: {output_fpath}')
+                    shutil.copy2(prebuild_fpath, output_fpath)
+                else:
+                    linker.link(objects, output_fpath, add_libs=flags)
+                    prebuild_fpath.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(output_fpath, prebuild_fpath)
+    except Exception as err:
+        return err
+
+    send_metric(
+        group="link",
+        name=str(output_fpath),
+        value={'time_taken': timer.taken, 'start': timer.start, 'prebuild': prebuilt})
+
+    return prebuild_fpath
+
+
+def _get_link_combo_hash(linker: Linker, objects, flags: List[str]) -> Optional[int]:
+    # get a combo hash of things which matter to the linked output: the inputs, flags and linker
+    lib_fpaths = _find_flag_libs(list(linker.flags) + list(flags))
+    if lib_fpaths is None:
+        return None
+    try:
+        input_hashes = [file_checksum(fpath).file_hash for fpath in objects]
+        lib_hashes = [file_checksum(fpath).file_hash for fpath in lib_fpaths]
+    except OSError:
+        return None
+    return sum([
+        sum(input_hashes),
+        sum(lib_hashes),
+        Flags(flags).checksum(),
+        linker.get_hash(),
+    ])
+
+
+def _find_flag_libs(flags: List[str]) -> Optional[List[Path]]:
+    """
+    Find the library files which the link flags bring in, so they can be part of the link hash.
+
+    Each *-l* library is looked for as a ``lib<name>.so`` or ``lib<name>.a`` in the *-L* folders,
+    then in the *LIBRARY_PATH* and system library folders. Any other flag which is an existing
+    file, such as the path of a static library, is included as it is.
+
+    Returns None if a library can't be found, as we then can't tell whether it has changed.
+
+    """
+    lib_dirs: List[Path] = []
+    lib_names: List[str] = []
+    lib_fpaths: List[Path] = []
+
+    flags_iter = iter(flags)
+    for flag in flags_iter:
+        if flag in ('-L', '-l'):
+            # the value is in the next argument
+            flag += next(flags_iter, '')
+        if flag.startswith('-L'):
+            lib_dirs.append(Path(flag[2:]))
+        elif flag.startswith('-l'):
+            lib_names.append(flag[2:])
+        elif not flag.startswith('-') and Path(flag).is_file():
+            lib_fpaths.append(Path(flag))
+
+    lib_dirs.extend(Path(d) for d in os.getenv('LIBRARY_PATH', '').split(os.pathsep) if d)
+    lib_dirs.extend(Path(d) for d in SYSTEM_LIB_DIRS)
+
+    for name in lib_names:
+        # "-l:libfoo.a" names the file exactly
+        fnames = [name[1:]] if name.startswith(':') else [f'lib{name}.so', f'lib{name}.a']
+        found = next((lib_dir / fname for lib_dir in lib_dirs for fname in fnames
+                      if (lib_dir / fname).is_file()), None)
+        if found is None:
+            logger.debug(f"can't find library '{name}' for the link prebuild hash")
+            return None
+        lib_fpaths.append(found)
+
+    return lib_fpaths
@@ -8,22 +8,28 @@ Fortran and C Preprocessing.
 
 """
 import logging
-import shutil
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Collection, List, Optional, Tuple, Union
 
 from fab.artefacts import (ArtefactSet, ArtefactsGetter, SuffixFilter,
                            CollectionGetter)
 from fab.build_config import BuildConfig, FlagsConfig
 from fab.metrics import send_metric
+from fab.parse.includes import find_includes, include_paths_from_flags, includes_hash
 from fab.steps import check_for_errors, run_mp, step
-from fab.tools import Category, Cpp, CppFortran, Preprocessor
+from fab.tools import Category, Cpp, CppFortran, Flags, Preprocessor
+from fab.tools.cpp_engine import CppEngine, UnsupportedPreprocessing
 from fab.util import (log_or_dot_finish, input_to_output_fpath, log_or_dot,
-                      suffix_filter, Timer, by_type)
+                      suffix_filter, Timer, file_checksum, copy_if_changed, write_if_changed)
 
 logger = logging.getLogger(__name__)
 
+COPY_METHODS = ('copy', 'hardlink', 'symlink')
+
 
 @dataclass
 class MpCommonArgs():
@@ -33,6 +39,8 @@ class MpCommonArgs():
     preprocessor: Preprocessor
     flags: FlagsConfig
     name: str
+    preprocessor_hash: int = 0
+    engine: Optional[CppEngine] = None
 
 
 def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
@@ -41,10 +49,15 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
                   output_suffix,
                   common_flags: Optional[List[str]] = None,
                   path_flags: Optional[List] = None,
-                  name="preprocess"):
+                  name="preprocess",
+                  engine: Optional[CppEngine] = None):
     """
     Preprocess Fortran or C files.
 
+    The preprocessed files are stored in the prebuild folder, named with a hash of the source file,
+    the flags, the preprocessor and any files the source includes. Unchanged files are copied from there
+    instead of being preprocessed again.
+
     Uses multiprocessing, unless disabled in the config.
 
     :param config:
@@ -64,6 +77,9 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
         Used to construct a :class:`~fab.build_config.FlagsConfig` object.
     :param name:
         Human friendly name for logger output, with sensible default.
+    :param engine:
+        An in-process preprocessor to use instead of the preprocessor executable, where it can.
+        Files it can't preprocess are passed to the executable.
 
     """
     common_flags = common_flags or []
@@ -71,8 +87,16 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
 
     logger.info(f"preprocessor is '{preprocessor.name}'.")
 
+    if engine:
+        logger.info("using the python preprocessor where possible")
+
     logger.info(f'preprocessing {len(files)} files')
 
+    # the engine's output should match the preprocessor's, but make sure a fix to it replaces prebuilds
+    preprocessor_hash = preprocessor.get_hash()
+    if engine:
+        preprocessor_hash += engine.get_hash()
+
     # common args for the child process
     mp_common_args = MpCommonArgs(
         config=config,
@@ -80,6 +104,8 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
         preprocessor=preprocessor,
         flags=flags,
         name=name,
+        preprocessor_hash=preprocessor_hash,
+        engine=engine,
     )
 
     # bundle files with common args
@@ -89,17 +115,22 @@ def pre_processor(config: BuildConfig, preprocessor: Preprocessor,
     check_for_errors(results, caller_label=name)
 
     log_or_dot_finish(logger)
-    config.artefact_store.add(output_collection, set(by_type(results, Path)))
+    config.add_current_prebuilds(prebuild for _, prebuild in results if prebuild)
+    config.artefact_store.add(output_collection, {output_fpath for output_fpath, _ in results})
 
 
-def process_artefact(arg: Tuple[Path, MpCommonArgs]):
+def process_artefact(arg: Tuple[Path, MpCommonArgs]) -> Tuple[Path, Optional[Path]]:
     """
     Expects an input file in the source folder.
     Writes the output file to the output folder, with a lower case extension.
 
+    Returns the output file, and the prebuild file it was stored as or restored from.
+
     """
     input_fpath, args = arg
 
+    prebuild_fpath = None
+    used_prebuild = False
     with Timer() as timer:
         output_fpath = (input_to_output_fpath(config=args.config,
                                               input_path=input_fpath)
@@ -114,21 +145,62 @@ def process_artefact(arg: Tuple[Path, MpCommonArgs]):
 
             params = args.flags.flags_for_path(path=input_fpath, config=args.config)
 
-            log_or_dot(logger, f"PreProcessor running with parameters: "
-                               f"'{' '.join(params)}'.'")
-            try:
-                args.preprocessor.preprocess(input_fpath, output_fpath, params)
-            except Exception as err:
-                raise Exception(f"error preprocessing {input_fpath}:\n"
-                                f"{err}") from err
-
-    send_metric(args.name, str(input_fpath), {'time_taken': timer.taken, 'start': timer.start})
-    return output_fpath
+            prebuild_hash = _get_prebuild_hash(input_fpath, params, args.preprocessor_hash)
+            prebuild_fpath = args.config.prebuild_folder / f'{input_fpath.stem}.{prebuild_hash:x}{args.output_suffix}'
+
+            if prebuild_fpath.exists():
+                log_or_dot(logger, f'Preprocessor using prebuild: {input_fpath}')
+                copy_if_changed(prebuild_fpath, output_fpath)
+                used_prebuild = True
+            else:
+                log_or_dot(logger, f"PreProcessor running with parameters: "
+                                   f"'{' '.join(params)}'.'")
+                # preprocess to a local temporary file, so an unchanged output isn't rewritten
+                with TemporaryDirectory() as tmp_folder:
+                    tmp_fpath = Path(tmp_folder) / output_fpath.name
+                    try:
+                        _preprocess(input_fpath, tmp_fpath, params, args)
+                    except Exception as err:
+                        raise Exception(f"error preprocessing {input_fpath}:\n"
+                                        f"{err}") from err
+                    output = tmp_fpath.read_bytes()
+                write_if_changed(output_fpath, output)
+                prebuild_fpath.parent.mkdir(parents=True, exist_ok=True)
+                write_if_changed(prebuild_fpath, output)
+
+    send_metric(args.name, str(input_fpath),
+                {'time_taken': timer.taken, 'start': timer.start, 'prebuild': used_prebuild})
+    return output_fpath, prebuild_fpath
+
+
+def _preprocess(input_fpath: Path, output_fpath: Path, params: List, args: MpCommonArgs):
+    # use the in-process engine if we have one, falling back to the preprocessor executable
+    if args.engine:
+        try:
+            args.engine.preprocess(input_fpath, output_fpath, params)
+            return
+        except UnsupportedPreprocessing as err:
+            log_or_dot(logger, f"python preprocessor can't preprocess {input_fpath}, "
+                               f"using {args.preprocessor.name}: {err}")
+    args.preprocessor.preprocess(input_fpath, output_fpath, params)
+
+
+def _get_prebuild_hash(input_fpath: Path, params: List[str], preprocessor_hash: int) -> int:
+    # get a combo hash of things which matter to the preprocessed output,
+    # including the files it includes, which are searched for using the -I flags
+    includes = find_includes(input_fpath, include_paths_from_flags(params))
+    return sum([
+        file_checksum(input_fpath).file_hash,
+        Flags(params).checksum(),
+        preprocessor_hash,
+        includes_hash(includes),
+    ])
 
 
 # todo: rename preprocess_fortran
 @step
-def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] = None, **kwargs):
+def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] = None, engine: str = 'external',
+                       copy_method: str = 'copy', **kwargs):
     """
     Wrapper to pre_processor for Fortran files.
 
@@ -142,7 +214,21 @@ def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] =
     If source is not provided, it defaults to
     `SuffixFilter(ArtefactStore.FORTRAN_BUILD_FILES, '.F90')`.
 
+    The engine can be 'external', to run the preprocessor for every file, or 'python', to preprocess files
+    in the worker processes where possible, which avoids starting a subprocess per file. The python engine
+    implements the subset of `cpp -traditional-cpp -P` used by Fortran, and any file using anything else,
+    such as a function-like macro, is passed to the preprocessor.
+
+    The little f90s are copied in parallel, skipping files whose copy is unchanged. The copy method can be
+    'copy', 'hardlink' or 'symlink'. Links avoid the copying, but an edit to a linked file in the build output
+    would change the source. Hard links fall back to copying when the build output is on another file system.
+
     """
+    if engine not in ('external', 'python'):
+        raise ValueError(f"unknown preprocessor engine '{engine}'")
+    if copy_method not in COPY_METHODS:
+        raise ValueError(f"unknown copy method '{copy_method}'")
+
     if source:
         source_files = source(config.artefact_store)
     else:
@@ -161,6 +247,13 @@ def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] =
     except KeyError:
         common_flags = []
 
+    cpp_engine = None
+    if engine == 'python' and F90s:
+        try:
+            cpp_engine = CppEngine.from_preprocessor(fpp)
+        except RuntimeError as err:
+            logger.warning(f"python preprocessor not available, using {fpp.name}: {err}")
+
     # preprocess big F90s
     pre_processor(
         config,
@@ -170,6 +263,7 @@ def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] =
         output_collection=ArtefactSet.PREPROCESSED_FORTRAN,
         output_suffix='.f90',
         name='preprocess fortran',
+        engine=cpp_engine,
         **kwargs,
     )
 
@@ -177,27 +271,75 @@ def preprocess_fortran(config: BuildConfig, source: Optional[ArtefactsGetter] =
                                   remove_files=F90s,
                                   add_files=config.artefact_store[ArtefactSet.PREPROCESSED_FORTRAN])
 
-    # todo: parallel copy?
     # copy little f90s from source to output folder
     logger.info(f'Fortran preprocessor copying {len(f90s)} files to build_output')
-    new_files = []
-    remove_files = []
+    to_copy = []
     for f90 in f90s:
         output_path = input_to_output_fpath(config, input_path=f90)
         if output_path != f90:
-            if not output_path.parent.exists():
-                output_path.parent.mkdir(parents=True)
-            log_or_dot(logger, f'copying {f90}')
-            shutil.copyfile(str(f90), str(output_path))
-            # Only remove and add a file when it is actually copied.
-            remove_files.append(f90)
-            new_files.append(output_path)
+            to_copy.append((f90, output_path, copy_method))
+
+    with Timer() as timer:
+        if config.multiprocessing and len(to_copy) > 1:
+            # copying is mostly waiting for the file system, so threads will do
+            with ThreadPoolExecutor(max_workers=config.n_procs) as executor:
+                bytes_copied = list(executor.map(_copy_f90, to_copy))
+        else:
+            bytes_copied = list(map(_copy_f90, to_copy))
+    log_or_dot_finish(logger)
+
+    send_metric('preprocess fortran copy', copy_method,
+                {'time_taken': timer.taken, 'files': len(to_copy), 'bytes_copied': sum(bytes_copied)})
 
+    # Only remove and add a file when it is actually copied.
+    remove_files = [f90 for f90, _, _ in to_copy]
+    new_files = [output_path for _, output_path, _ in to_copy]
     config.artefact_store.replace(ArtefactSet.FORTRAN_BUILD_FILES,
                                   remove_files=remove_files,
                                   add_files=new_files)
 
 
+def _copy_f90(arg: Tuple[Path, Path, str]) -> int:
+    # Copy or link a file into the build output, unless it's already there.
+    # Returns the number of bytes copied.
+    f90, output_path, copy_method = arg
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if copy_method == 'symlink':
+        target = f90.resolve()
+        if not (output_path.is_symlink() and Path(os.readlink(output_path)) == target):
+            log_or_dot(logger, f'linking {f90}')
+            _replace_with_link(output_path, lambda link_path: os.symlink(target, link_path))
+        return 0
+
+    if copy_method == 'hardlink':
+        if output_path.exists() and os.path.samefile(f90, output_path):
+            return 0
+        try:
+            log_or_dot(logger, f'linking {f90}')
+            _replace_with_link(output_path, lambda link_path: os.link(f90, link_path))
+            return 0
+        except OSError as err:
+            log_or_dot(logger, f'could not link {f90}, copying: {err}')
+
+    # don't write through a link left by a different copy method
+    if output_path.is_symlink() or (output_path.exists() and output_path.stat().st_nlink > 1):
+        output_path.unlink()
+    if copy_if_changed(f90, output_path):
+        log_or_dot(logger, f'copied {f90}')
+        return f90.stat().st_size
+    return 0
+
+
+def _replace_with_link(output_path: Path, make_link):
+    # make a link next to the output and rename it into place, so the output is never missing
+    link_path = output_path.with_name(f'.{output_path.name}.{os.getpid()}.link')
+    if link_path.is_symlink() or link_path.exists():
+        link_path.unlink()
+    make_link(link_path)
+    os.replace(link_path, output_path)
+
+
 class DefaultCPreprocessorSource(ArtefactsGetter):
     """
     A source getter specifically for c preprocessing.
@@ -27,7 +27,7 @@ from fab.steps.preprocess import pre_processor
 from fab.tools import Category, Psyclone
 from fab.util import (log_or_dot, input_to_output_fpath, file_checksum,
                       file_walk, TimerLogger, string_checksum, suffix_filter,
-                      by_type, log_or_dot_finish)
+                      by_type, log_or_dot_finish, write_if_changed)
 
 logger = logging.getLogger(__name__)
 
@@ -210,7 +210,7 @@ def _analyse_x90s(config, x90s: Set[Path]) -> Dict[Path, AnalysedX90]:
 
     # make the hashes from the original x90s, not the parsable versions which have invoke names removed.
     for p, r in analysed_x90.items():
-        analysed_x90[p]._file_hash = file_checksum(p).file_hash
+        analysed_x90[p].file_hash = file_checksum(p).file_hash
 
     return analysed_x90
 
@@ -478,7 +478,7 @@ def make_parsable_x90(x90_path: Path) -> Path:
     out = _x90_compliance_pattern.sub(repl=repl, string=src)
 
     out_path = x90_path.with_suffix('.parsable_x90')
-    open(out_path, 'wt').write(out)
+    write_if_changed(out_path, out)
 
     logger.debug(f'names removed from {str(x90_path)}: {replaced}')
 
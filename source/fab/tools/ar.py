@@ -8,10 +8,10 @@
 """
 
 from pathlib import Path
-from typing import List, Union
+from typing import Iterable, List, Union
 
 from fab.tools.category import Category
-from fab.tools.tool import Tool
+from fab.tools.tool import RESPONSE_FILE_THRESHOLD, Tool
 
 
 class Ar(Tool):
@@ -20,16 +20,44 @@ class Ar(Tool):
 
     def __init__(self):
         super().__init__("ar", "ar", Category.AR)
+        self.set_response_file_threshold(RESPONSE_FILE_THRESHOLD)
 
     def create(self, output_fpath: Path,
-               members: List[Union[Path, str]]):
+               members: Iterable[Union[Path, str]],
+               thin: bool = False):
         '''Create the archive with the specified name, containing the
         listed members.
 
         :param output_fpath: the output path.
         :param members: the list of objects to be added to the archive.
+        :param thin: create a GNU thin archive, which refers to the
+            objects by their paths instead of containing copies of them.
         '''
         # Explicit type is required to avoid mypy errors :(
-        parameters: List[Union[Path, str]] = ["cr", output_fpath]
+        parameters: List[Union[Path, str]] = ["crT" if thin else "cr",
+                                              output_fpath]
         parameters.extend(map(str, members))
         return self.run(additional_parameters=parameters)
+
+    def replace(self, output_fpath: Path,
+                members: Iterable[Union[Path, str]]):
+        '''Add the listed members to an existing archive, replacing any
+        members with the same names.
+
+        :param output_fpath: the archive path.
+        :param members: the list of objects to be added to the archive.
+        '''
+        parameters: List[Union[Path, str]] = ["r", output_fpath]
+        parameters.extend(map(str, members))
+        return self.run(additional_parameters=parameters)
+
+    def delete(self, output_fpath: Path, member_names: List[str]):
+        '''Delete the named members from an existing archive.
+
+        :param output_fpath: the archive path.
+        :param member_names: the names of the members, i.e. the file names
+            of the objects which were added.
+        '''
+        parameters: List[Union[Path, str]] = ["d", output_fpath]
+        parameters.extend(member_names)
+        return self.run(additional_parameters=parameters)
@@ -16,7 +16,7 @@ import zlib
 
 from fab.tools.category import Category
 from fab.tools.flags import Flags
-from fab.tools.tool import CompilerSuiteTool
+from fab.tools.tool import CompilerSuiteTool, RESPONSE_FILE_THRESHOLD
 
 
 class Compiler(CompilerSuiteTool):
@@ -82,6 +82,27 @@ class Compiler(CompilerSuiteTool):
         return self.run(cwd=input_file.parent,
                         additional_parameters=params)
 
+    def compile_files(self, input_files: List[Path],
+                      add_flags: Union[None, List[str]] = None):
+        '''Compiles several files, which must be in the same folder, in a
+        single invocation, to save the process start-up time per file. As
+        for compile_file, the command is run in the source folder. Without
+        an output flag, the compiler names each object file after its
+        source file, in that folder, so the files must have different names
+        without their suffixes.
+
+        :param input_files: the paths of the input files.
+        :param add_flags: additional compiler flags.
+        '''
+        params: List[Union[Path, str]] = [self._compile_flag]
+        if add_flags:
+            params += add_flags
+
+        params.extend(input_file.name for input_file in input_files)
+
+        return self.run(cwd=input_files[0].parent,
+                        additional_parameters=params)
+
     def check_available(self) -> bool:
         '''Checks if the compiler is available. While the method in
         the Tools base class would be sufficient (when using --version),
@@ -155,7 +176,7 @@ class Compiler(CompilerSuiteTool):
             error.
         '''
         try:
-            return self.run(version_command, capture_output=True)
+            return self.run_cached(version_command)
         except RuntimeError as err:
             raise RuntimeError(f"Error asking for version of compiler "
                                f"'{self.name}'") from err
@@ -250,7 +271,8 @@ class FortranCompiler(Compiler):
 
     def compile_file(self, input_file: Path, output_file: Path,
                      add_flags: Union[None, List[str]] = None,
-                     syntax_only: bool = False):
+                     syntax_only: bool = False,
+                     module_folder: Optional[Path] = None):
         '''Compiles a file.
 
         :param input_file: the name of the input file.
@@ -258,8 +280,37 @@ class FortranCompiler(Compiler):
         :param add_flags: additional flags for the compiler.
         :param syntax_only: if set, the compiler will only do
             a syntax check
+        :param module_folder: optional, a folder to create the module
+            files in instead of the module output path. Modules are still
+            read from the module output path.
         '''
 
+        params = self._fortran_params(add_flags, syntax_only, module_folder)
+        super().compile_file(input_file, output_file, params)
+
+    def compile_files(self, input_files: List[Path],
+                      add_flags: Union[None, List[str]] = None,
+                      syntax_only: bool = False,
+                      module_folder: Optional[Path] = None):
+        '''Compiles several files in a single invocation. The module files
+        are created in the module output path, as for a single file.
+
+        :param input_files: the paths of the input files.
+        :param add_flags: additional flags for the compiler.
+        :param syntax_only: if set, the compiler will only do
+            a syntax check
+        :param module_folder: optional, a folder to create the module
+            files in instead of the module output path.
+        '''
+        params = self._fortran_params(add_flags, syntax_only, module_folder)
+        super().compile_files(input_files, params)
+
+    def _fortran_params(self, add_flags: Union[None, List[str]],
+                        syntax_only: bool,
+                        module_folder: Optional[Path] = None) -> List[str]:
+        ''':returns: the flags for a compilation, with the syntax-only and
+            module output flags managed by this compiler.
+        '''
         params: List[str] = []
         if add_flags:
             new_flags = Flags(add_flags)
@@ -271,10 +322,17 @@ class FortranCompiler(Compiler):
             params.append(self._syntax_only_flag)
 
         # Append module output path
-        if self._module_folder_flag and self._module_output_path:
+        if self._module_folder_flag and module_folder:
+            # Create the modules elsewhere, but still read the existing
+            # ones from the module output path
+            if self._module_output_path:
+                params.extend(["-I", self._module_output_path])
+            params.append(self._module_folder_flag)
+            params.append(str(module_folder))
+        elif self._module_folder_flag and self._module_output_path:
             params.append(self._module_folder_flag)
             params.append(self._module_output_path)
-        super().compile_file(input_file, output_file, params)
+        return params
 
 
 # ============================================================================
@@ -326,6 +384,7 @@ class Gcc(GnuVersionHandling, CCompiler):
                  name: str = "gcc",
                  exec_name: str = "gcc"):
         super().__init__(name, exec_name, "gnu", omp_flag="-fopenmp")
+        self.set_response_file_threshold(RESPONSE_FILE_THRESHOLD)
 
 
 # ============================================================================
@@ -342,6 +401,7 @@ class Gfortran(GnuVersionHandling, FortranCompiler):
                          module_folder_flag="-J",
                          omp_flag="-fopenmp",
                          syntax_only_flag="-fsyntax-only")
+        self.set_response_file_threshold(RESPONSE_FILE_THRESHOLD)
 
 
 # ============================================================================
@@ -390,6 +450,7 @@ class Icc(IntelVersionHandling, CCompiler):
                  exec_name: str = "icc"):
         super().__init__(name, exec_name, "intel-classic",
                          omp_flag="-qopenmp")
+        self.set_response_file_threshold(RESPONSE_FILE_THRESHOLD)
 
 
 # ============================================================================
@@ -406,3 +467,4 @@ class Ifort(IntelVersionHandling, FortranCompiler):
                          module_folder_flag="-module",
                          omp_flag="-qopenmp",
                          syntax_only_flag="-syntax-only")
+        self.set_response_file_threshold(RESPONSE_FILE_THRESHOLD)
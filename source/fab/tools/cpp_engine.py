@@ -0,0 +1,504 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+'''This file contains the CppEngine class, an in-process implementation of
+the subset of `cpp -traditional-cpp -P` which Fortran code uses. Running
+the preprocessor in Python avoids starting a subprocess for every file.
+
+It supports object-like macros, from `#define`, `#undef`, `-D` and `-U`,
+conditional compilation with `#if`, `#ifdef`, `#ifndef`, `#elif`, `#else`
+and `#endif`, and `#include` using `-I`. Anything else, e.g. function-like
+macros or C comments, raises an UnsupportedPreprocessing error, so that the
+caller can use the external preprocessor instead.
+
+The predefined macros, and the blank lines which cpp writes before the
+output, are read from the external preprocessor when the engine is created.
+'''
+
+import re
+import zlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Optional, Tuple, Union
+
+from fab.tools.preprocessor import Preprocessor
+
+# Changing the engine's output must change this, to invalidate prebuilds
+ENGINE_VERSION = 2
+
+# Flags which make no difference to us, and flags we need
+IGNORED_FLAGS = {'-P', '-traditional-cpp', '-traditional'}
+REQUIRED_FLAGS = {'-P', '-traditional-cpp'}
+
+# Macros which cpp defines itself, and which aren't listed by `cpp -dM`
+BUILTIN_MACROS = {'__FILE__', '__LINE__', '__DATE__', '__TIME__',
+                  '__TIMESTAMP__', '__COUNTER__', '__INCLUDE_LEVEL__',
+                  '__BASE_FILE__', '__has_include', '__has_include_next',
+                  '_Pragma'}
+
+MAX_INCLUDE_DEPTH = 200
+
+# cpp evaluates expressions in intmax_t, wrapping on overflow
+INTMAX_BITS = 64
+INTMAX_MAX = 2 ** (INTMAX_BITS - 1) - 1
+
+# A text line is made of strings, which run to the end of the line if they
+# aren't closed, and identifiers. Anything else is copied.
+_TEXT_TOKEN = re.compile(r'''(?P<string>'[^']*'?|"[^"]*"?)|(?P<name>[A-Za-z_][A-Za-z0-9_]*)''')
+_DIRECTIVE = re.compile(r'#[ \t]*([A-Za-z_][A-Za-z0-9_]*)?(.*)$')
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+_DEFINE = re.compile(r'[ \t]+([A-Za-z_][A-Za-z0-9_]*)(\(?)(.*)$')
+_INCLUDE = re.compile(r'[ \t]*(?:"([^"]+)"|<([^>]+)>)[ \t]*$')
+_DM_DEFINE = re.compile(r'#define ([A-Za-z_][A-Za-z0-9_]*)(\(?)(.*)$')
+_EXPR_TOKEN = re.compile(r'''[ \t]*(?:
+      (?P<number>0[xX][0-9a-fA-F]+|[0-9]+)(?P<suffix>[uUlL]*)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op>&&|\|\||<<|>>|<=|>=|==|!=|[-+*/%<>()!~&|^?:])
+    )''', re.VERBOSE)
+
+_BINARY_OPERATORS = [['||'], ['&&'], ['|'], ['^'], ['&'], ['==', '!='],
+                     ['<', '>', '<=', '>='], ['<<', '>>'], ['+', '-'],
+                     ['*', '/', '%']]
+
+# Macro values, with None for a function-like macro
+Macros = Dict[str, Optional[str]]
+
+
+class UnsupportedPreprocessing(Exception):
+    '''Raised when a file uses a preprocessor feature, or a flag, which the
+    CppEngine does not implement.
+    '''
+
+
+class CppEngine:
+    '''Preprocesses Fortran files in-process, giving the same output as
+    `cpp -traditional-cpp -P`.
+
+    :param prologue: the output of the external preprocessor for an
+        empty file.
+    :param predefined: the macros defined by the external preprocessor.
+    :param tool_flags: the flags of the external preprocessor, which are
+        used before the flags given for each file.
+    '''
+
+    def __init__(self, prologue: str, predefined: Macros,
+                 tool_flags: Optional[List[str]] = None):
+        self._prologue = prologue
+        self._predefined = dict(predefined)
+        self._tool_flags = list(tool_flags or [])
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor: Preprocessor) -> 'CppEngine':
+        '''Creates an engine which imitates the given preprocessor, asking
+        it for its predefined macros.
+
+        :param preprocessor: the external preprocessor.
+
+        :raises RuntimeError: if the preprocessor can't be run.
+        '''
+        with TemporaryDirectory() as tmp:
+            empty = Path(tmp) / 'empty.F90'
+            empty.write_text('')
+            prologue = preprocessor.run([str(empty)])
+            definitions = preprocessor.run(['-dM', '-E', str(empty)])
+
+        predefined: Macros = {}
+        for line in definitions.splitlines():
+            match = _DM_DEFINE.match(line)
+            if match:
+                name, paren, value = match.groups()
+                predefined[name] = None if paren else value.strip()
+        return cls(prologue, predefined, list(preprocessor.flags))
+
+    def get_hash(self) -> int:
+        ''':returns: a hash of everything which can change the output of
+            this engine, other than the files and flags.
+        '''
+        definitions = sorted((name, value or '()')
+                             for name, value in self._predefined.items())
+        return (zlib.crc32(f'CppEngine {ENGINE_VERSION}'.encode()) +
+                zlib.crc32(self._prologue.encode()) +
+                zlib.crc32(repr(definitions).encode()) +
+                zlib.crc32(' '.join(self._tool_flags).encode()))
+
+    def preprocess(self, input_file: Path, output_file: Path,
+                   add_flags: Optional[List[Union[Path, str]]] = None):
+        '''Preprocesses a file. The output file is only written if the
+        whole file could be processed.
+
+        :param input_file: input file.
+        :param output_file: the output filename.
+        :param add_flags: the preprocessor flags for this file.
+
+        :raises UnsupportedPreprocessing: if the file, or the flags, use
+            a feature which is not supported.
+        '''
+        output = self.process(input_file, [str(flag) for flag in add_flags or []])
+        # cpp works on bytes, so use an encoding which keeps them all
+        output_file.write_text(output, encoding='latin-1')
+
+    def process(self, input_file: Path, flags: List[str]) -> str:
+        ''':returns: the preprocessed text of a file.
+
+        :param input_file: input file.
+        :param flags: the preprocessor flags for this file.
+
+        :raises UnsupportedPreprocessing: if the file, or the flags, use
+            a feature which is not supported.
+        '''
+        macros, include_paths = self._parse_flags(self._tool_flags + flags)
+        output: List[str] = [self._prologue]
+        self._process_file(input_file, macros, include_paths, output, depth=0)
+        return ''.join(output)
+
+    def _parse_flags(self, flags: List[str]) -> Tuple[Macros, List[Path]]:
+        missing = REQUIRED_FLAGS - set(flags)
+        if missing:
+            raise UnsupportedPreprocessing(
+                f"missing flags {' '.join(sorted(missing))}")
+
+        macros = dict(self._predefined)
+        include_paths = []
+        i = 0
+        while i < len(flags):
+            flag = flags[i]
+            if flag in ('-D', '-U', '-I'):
+                if i + 1 == len(flags):
+                    raise UnsupportedPreprocessing(f"missing value for {flag}")
+                i += 1
+                flag += flags[i]
+            i += 1
+
+            if flag.startswith('-D'):
+                name, equals, value = flag[2:].partition('=')
+                if not _IDENTIFIER.match(name):
+                    raise UnsupportedPreprocessing(f"unsupported flag {flag}")
+                macros[name] = value.strip() if equals else '1'
+            elif flag.startswith('-U'):
+                macros.pop(flag[2:], None)
+            elif flag.startswith('-I'):
+                include_paths.append(Path(flag[2:]))
+            elif flag not in IGNORED_FLAGS:
+                raise UnsupportedPreprocessing(f"unsupported flag {flag}")
+
+        return macros, include_paths
+
+    def _process_file(self, fpath: Path, macros: Macros,
+                      include_paths: List[Path], output: List[str],
+                      depth: int):
+        if depth > MAX_INCLUDE_DEPTH:
+            raise UnsupportedPreprocessing("too many nested includes")
+        with open(fpath, 'rt', encoding='latin-1', newline='') as infile:
+            text = infile.read()
+        if '/*' in text:
+            raise UnsupportedPreprocessing("C comments are not supported")
+        if '\\\n' in text or '\r' in text:
+            raise UnsupportedPreprocessing(
+                "line continuations and carriage returns are not supported")
+
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+
+        # the active state of each open conditional: whether the enclosing
+        # text is active, whether a branch has been taken, whether this
+        # branch is active and whether #else has been seen
+        conditionals: List[List[bool]] = []
+
+        def active() -> bool:
+            return not conditionals or conditionals[-1][2]
+
+        for line in lines:
+            if not line.startswith('#'):
+                if active():
+                    output.append(_expand_text(line, macros, set()) + '\n')
+                continue
+
+            match = _DIRECTIVE.match(line)
+            assert match
+            name, rest = match.groups()
+            if name is None:
+                # the null directive
+                if rest.strip():
+                    raise UnsupportedPreprocessing(f"unsupported directive '{line}'")
+                continue
+
+            if name in ('if', 'ifdef', 'ifndef'):
+                enclosing = active()
+                condition = False
+                if enclosing:
+                    if name == 'if':
+                        condition = _evaluate(rest, macros)
+                    else:
+                        condition = _is_defined(rest.strip(), macros) == (name == 'ifdef')
+                conditionals.append([enclosing, condition, condition, False])
+            elif name in ('elif', 'else'):
+                if not conditionals or conditionals[-1][3]:
+                    raise UnsupportedPreprocessing(f"unexpected #{name}")
+                conditional = conditionals[-1]
+                condition = False
+                if conditional[0] and not conditional[1]:
+                    condition = True if name == 'else' else _evaluate(rest, macros)
+                conditional[1] = conditional[1] or condition
+                conditional[2] = condition
+                conditional[3] = name == 'else'
+            elif name == 'endif':
+                if not conditionals:
+                    raise UnsupportedPreprocessing("unexpected #endif")
+                conditionals.pop()
+            elif not active():
+                # other directives are ignored in skipped text
+                continue
+            elif name == 'define':
+                define = _DEFINE.match(rest)
+                if not define or define.group(2):
+                    raise UnsupportedPreprocessing(f"unsupported macro '{line}'")
+                macros[define.group(1)] = define.group(3).strip()
+            elif name == 'undef':
+                macros.pop(rest.strip(), None)
+            elif name == 'include':
+                include = _INCLUDE.match(rest)
+                if not include:
+                    raise UnsupportedPreprocessing(f"unsupported include '{line}'")
+                quoted, bracketed = include.groups()
+                if quoted:
+                    search_paths = [fpath.parent] + include_paths
+                else:
+                    search_paths = include_paths
+                include_fpath = _find_include(quoted or bracketed, search_paths)
+                self._process_file(include_fpath, macros, include_paths,
+                                   output, depth + 1)
+            else:
+                raise UnsupportedPreprocessing(f"unsupported directive '{line}'")
+
+        if conditionals:
+            raise UnsupportedPreprocessing(f"unterminated conditional in {fpath}")
+
+
+def _find_include(name: str, search_paths: List[Path]) -> Path:
+    for folder in search_paths:
+        candidate = folder / name
+        if candidate.is_file():
+            return candidate
+    # cpp may find it in the system include folders, or report the error
+    raise UnsupportedPreprocessing(f"include file '{name}' not found")
+
+
+def _macro_value(name: str, macros: Macros) -> Optional[str]:
+    # the value of a macro, or None if it's not defined
+    if name in BUILTIN_MACROS:
+        raise UnsupportedPreprocessing(f"unsupported macro {name}")
+    if name not in macros:
+        return None
+    value = macros[name]
+    if value is None:
+        raise UnsupportedPreprocessing(f"unsupported function-like macro {name}")
+    return value
+
+
+def _is_defined(name: str, macros: Macros) -> bool:
+    if not _IDENTIFIER.match(name):
+        raise UnsupportedPreprocessing(f"expected a macro name, not '{name}'")
+    if name in BUILTIN_MACROS:
+        raise UnsupportedPreprocessing(f"unsupported macro {name}")
+    return name in macros
+
+
+def _expand_text(text: str, macros: Macros, disabled: set) -> str:
+    # replace the macros in some text, outside of strings
+    result = []
+    pos = 0
+    for match in _TEXT_TOKEN.finditer(text):
+        name = match.group('name')
+        if name is None:
+            continue
+        value = _macro_value(name, macros)
+        if value is None:
+            continue
+        if name in disabled:
+            # cpp reports an error for recursive macros in traditional mode
+            raise UnsupportedPreprocessing(f"recursive macro {name}")
+        if any(token.group('string') and
+               (len(token.group()) == 1 or token.group()[-1] != token.group()[0])
+               for token in _TEXT_TOKEN.finditer(value)):
+            raise UnsupportedPreprocessing(f"unterminated string in macro {name}")
+        result.append(text[pos:match.start()])
+        result.append(_expand_text(value, macros, disabled | {name}))
+        pos = match.end()
+    result.append(text[pos:])
+    return ''.join(result)
+
+
+def _evaluate(expression: str, macros: Macros) -> bool:
+    # evaluate the condition of an #if or #elif
+    tokens = _expand_expression(_tokenise_expression(expression), macros, set())
+    return _ExpressionParser(tokens).parse() != 0
+
+
+def _tokenise_expression(expression: str) -> List[Union[int, str]]:
+    tokens: List[Union[int, str]] = []
+    pos = 0
+    while True:
+        match = _EXPR_TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+        if match.group('number'):
+            if 'u' in match.group('suffix').lower():
+                raise UnsupportedPreprocessing("unsigned numbers are not supported")
+            number = match.group('number')
+            if number[:2].lower() == '0x':
+                value = int(number, 16)
+            elif number.startswith('0'):
+                value = int(number, 8)
+            else:
+                value = int(number)
+            if value > INTMAX_MAX:
+                # cpp makes it unsigned
+                raise UnsupportedPreprocessing(f"number {number} is too large")
+            tokens.append(value)
+        else:
+            tokens.append(match.group('name') or match.group('op'))
+    if expression[pos:].strip():
+        raise UnsupportedPreprocessing(f"unsupported expression '{expression.strip()}'")
+    return tokens
+
+
+def _expand_expression(tokens: List[Union[int, str]], macros: Macros,
+                       disabled: set) -> List[Union[int, str]]:
+    # replace defined() and macros with their values, and other names with 0
+    result: List[Union[int, str]] = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not isinstance(token, str) or not _IDENTIFIER.match(token):
+            result.append(token)
+        elif token == 'defined':
+            if tokens[i:i + 1] == ['(']:
+                if tokens[i + 2:i + 3] != [')']:
+                    raise UnsupportedPreprocessing("unsupported use of defined")
+                name = tokens[i + 1]
+                i += 3
+            elif i < len(tokens):
+                name = tokens[i]
+                i += 1
+            else:
+                raise UnsupportedPreprocessing("unsupported use of defined")
+            result.append(int(_is_defined(str(name), macros)))
+        else:
+            value = _macro_value(token, macros)
+            if value is None:
+                result.append(0)
+            elif token in disabled:
+                raise UnsupportedPreprocessing(f"recursive macro {token}")
+            else:
+                result.extend(_expand_expression(_tokenise_expression(value),
+                                                 macros, disabled | {token}))
+    return result
+
+
+class _ExpressionParser:
+    # evaluates the tokens of an expression, with C's precedence and semantics
+
+    def __init__(self, tokens: List[Union[int, str]]):
+        self._tokens = tokens
+        self._pos = 0
+
+    def parse(self) -> int:
+        value = self._conditional()
+        if self._pos != len(self._tokens):
+            raise UnsupportedPreprocessing("unsupported expression")
+        return value
+
+    def _peek(self) -> Union[int, str, None]:
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _next(self) -> Union[int, str, None]:
+        token = self._peek()
+        self._pos += 1
+        return token
+
+    def _expect(self, op: str):
+        if self._next() != op:
+            raise UnsupportedPreprocessing(f"expected '{op}' in expression")
+
+    def _conditional(self) -> int:
+        condition = self._binary(0)
+        if self._peek() != '?':
+            return condition
+        self._next()
+        if_true = self._conditional()
+        self._expect(':')
+        if_false = self._conditional()
+        return if_true if condition else if_false
+
+    def _binary(self, level: int) -> int:
+        if level == len(_BINARY_OPERATORS):
+            return self._unary()
+        left = self._binary(level + 1)
+        while self._peek() in _BINARY_OPERATORS[level]:
+            op = str(self._next())
+            right = self._binary(level + 1)
+            left = _apply(op, left, right)
+        return left
+
+    def _unary(self) -> int:
+        token = self._next()
+        if isinstance(token, int):
+            return token
+        if token == '(':
+            value = self._conditional()
+            self._expect(')')
+            return value
+        if token == '!':
+            return int(not self._unary())
+        if token == '~':
+            return ~self._unary()
+        if token == '-':
+            return _wrap(-self._unary())
+        if token == '+':
+            return self._unary()
+        raise UnsupportedPreprocessing(f"unexpected '{token}' in expression")
+
+
+def _apply(op: str, left: int, right: int) -> int:
+    if op in ('/', '%'):
+        if right == 0:
+            raise UnsupportedPreprocessing("division by zero")
+        # C division truncates towards zero
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return _wrap(quotient if op == '/' else left - right * quotient)
+    if op in ('<<', '>>'):
+        if right < 0:
+            raise UnsupportedPreprocessing("negative shift")
+        # shifting further gives the same result, 0 or -1
+        right = min(right, INTMAX_BITS)
+    return _wrap({
+        '||': lambda: int(bool(left) or bool(right)),
+        '&&': lambda: int(bool(left) and bool(right)),
+        '|': lambda: left | right,
+        '^': lambda: left ^ right,
+        '&': lambda: left & right,
+        '==': lambda: int(left == right),
+        '!=': lambda: int(left != right),
+        '<': lambda: int(left < right),
+        '>': lambda: int(left > right),
+        '<=': lambda: int(left <= right),
+        '>=': lambda: int(left >= right),
+        '<<': lambda: left << right,
+        '>>': lambda: left >> right,
+        '+': lambda: left + right,
+        '-': lambda: left - right,
+        '*': lambda: left * right,
+    }[op]())
+
+
+def _wrap(value: int) -> int:
+    # the value as a signed intmax_t, as cpp gives on overflow
+    return (value + INTMAX_MAX + 1) % (2 * (INTMAX_MAX + 1)) - INTMAX_MAX - 1
@@ -10,7 +10,8 @@ PR.
 '''
 
 import logging
-from typing import List, Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 import warnings
 
 from fab.util import string_checksum
@@ -31,12 +32,12 @@ class Flags(list):
         if list_of_flags:
             self.extend(list_of_flags)
 
-    def checksum(self) -> str:
+    def checksum(self) -> int:
         """
         :returns: a checksum of the flags.
 
         """
-        return string_checksum(str(self))
+        return _flags_checksum(tuple(self))
 
     def remove_flag(self, remove_flag: str, has_parameter: bool = False):
         '''Removes all occurrences of `remove_flag` in flags`.
@@ -51,8 +52,9 @@ class Flags(list):
         :param has_parameter: if the flag to remove takes a parameter
         '''
 
-        # TODO #313: Check if we can use an OrderedDict and get O(1)
-        # behaviour here (since ordering of flags can be important)
+        # Build the remaining flags in a single pass, rather than deleting
+        # from the list in place, which is quadratic for long lists.
+        kept: List[str] = []
         i = 0
         flag_len = len(remove_flag)
         while i < len(self):
@@ -63,12 +65,10 @@ class Flags(list):
                 if has_parameter and i + 1 == len(self):
                     # We have a flag which takes a parameter, but there is no
                     # parameter. Issue a warning:
-                    self._logger.warning(f"Flags '{' '. join(self)}' contain "
+                    self._logger.warning(f"Flags '{' '. join(kept + self[i:])}' contain "
                                          f"'{remove_flag}' but no parameter.")
-                    del self[i]
-                else:
-                    # Delete the argument and if required its parameter
-                    del self[i:i+(2 if has_parameter else 1)]
+                # Skip the argument and if required its parameter
+                i += 2 if has_parameter else 1
                 warnings.warn(f"Removing managed flag '{remove_flag}'.")
                 continue
             # Now check if it has flag and parameter as one argument (-J/tmp)
@@ -76,6 +76,17 @@ class Flags(list):
             if has_parameter and flag[:flag_len] == remove_flag:
                 # No space between flag and parameter, remove this one flag
                 warnings.warn(f"Removing managed flag '{remove_flag}'.")
-                del self[i]
+                i += 1
                 continue
+            kept.append(flag)
             i += 1
+
+        if len(kept) != len(self):
+            self[:] = kept
+
+
+@lru_cache(maxsize=1024)
+def _flags_checksum(flags: Tuple[str, ...]) -> int:
+    # The same flags are checksummed for most of the files in a build.
+    # Note: we checksum the list representation, for checksums which match older prebuilds.
+    return string_checksum(str(list(flags)))
@@ -10,6 +10,7 @@
 import os
 from pathlib import Path
 from typing import cast, List, Optional
+import zlib
 
 from fab.tools.category import Category
 from fab.tools.compiler import Compiler
@@ -50,6 +51,9 @@ class Linker(CompilerSuiteTool):
         super().__init__(name, exec_name, suite, Category.LINKER)
         self._compiler = compiler
         self.flags.extend(os.getenv("LDFLAGS", "").split())
+        # The linker runs the compiler, so supports response files if it does
+        if compiler:
+            self.set_response_file_threshold(compiler.response_file_threshold)
 
     def check_available(self) -> bool:
         '''
@@ -61,6 +65,18 @@ class Linker(CompilerSuiteTool):
 
         return super().check_available()
 
+    def get_hash(self) -> int:
+        ''':returns: a hash of the linker's name, version and flags, all of
+            which can change the linked output.
+        '''
+        if self._compiler:
+            compiler_hash = (self._compiler.get_hash() +
+                             self._compiler.flags.checksum())
+        else:
+            compiler_hash = zlib.crc32(self.exec_name.encode())
+        return (zlib.crc32(self.name.encode()) + compiler_hash +
+                self.flags.checksum())
+
     def link(self, input_files: List[Path], output_file: Path,
              add_libs: Optional[List[str]] = None) -> str:
         '''Executes the linker with the specified input files,
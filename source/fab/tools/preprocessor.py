@@ -11,6 +11,7 @@ classes for cpp and fpp.
 
 from pathlib import Path
 from typing import List, Optional, Union
+import zlib
 
 from fab.tools.category import Category
 from fab.tools.tool import Tool
@@ -27,8 +28,29 @@ class Preprocessor(Tool):
     def __init__(self, name: str, exec_name: Union[str, Path],
                  category: Category,
                  availablility_option: Optional[str] = None):
-        super().__init__(name, exec_name, category)
-        self._version = None
+        super().__init__(name, exec_name, category,
+                         availablility_option=availablility_option)
+        self._version: Optional[str] = None
+
+    def get_version_string(self) -> str:
+        ''':returns: the output of the preprocessor's availability option,
+            which usually contains its version, or an empty string if it
+            can't be run.
+        '''
+        if self._version is None:
+            try:
+                self._version = self.run_cached(self._availability_option)
+            except RuntimeError:
+                self._version = ""
+        return self._version
+
+    def get_hash(self) -> int:
+        ''':returns: a hash of the preprocessor's name, version and flags,
+            all of which can change the preprocessed output.
+        '''
+        return (zlib.crc32(self.name.encode()) +
+                zlib.crc32(self.get_version_string().encode()) +
+                self.flags.checksum())
 
     def preprocess(self, input_file: Path, output_file: Path,
                    add_flags: Union[None, List[Union[Path, str]]] = None):
@@ -14,12 +14,20 @@ a tool is actually available.
 """
 
 import logging
+import os
 from pathlib import Path
+import re
 import subprocess
+import tempfile
 from typing import Dict, List, Optional, Union
 
 from fab.tools.category import Category
 from fab.tools.flags import Flags
+from fab.tools.tool_cache import get_tool_cache
+
+# The default command line length, in characters, above which tools which
+# support response files are given their arguments in a response file.
+RESPONSE_FILE_THRESHOLD = 100000
 
 
 class Tool:
@@ -57,13 +65,17 @@ class Tool:
         # to use `run` to determine if a tool is available or not.
         self._is_available: Optional[bool] = None
 
+        # Tools which accept `@file` arguments set this to the command line
+        # length above which their arguments are passed in a response file.
+        self._response_file_threshold: Optional[int] = None
+
     def check_available(self) -> bool:
         '''Run a 'test' command to check if this tool is available in the
         system.
         :returns: whether the tool is working (True) or not.
         '''
         try:
-            self.run(self._availability_option)
+            self.run_cached(self._availability_option)
         except (RuntimeError, FileNotFoundError):
             return False
         return True
@@ -106,6 +118,24 @@ class Tool:
         ''':returns: the flags to be used with this tool.'''
         return self._flags
 
+    @property
+    def response_file_threshold(self) -> Optional[int]:
+        ''':returns: the command line length above which the arguments
+            are passed in a response file, or None if this tool does not
+            support response files.
+        '''
+        return self._response_file_threshold
+
+    def set_response_file_threshold(self, threshold: Optional[int]):
+        '''Sets the command line length above which the arguments are
+        passed to this tool in a response file, i.e. as `@file`. The tool
+        must support response files.
+
+        :param threshold: the length in characters, or None to never use
+            a response file.
+        '''
+        self._response_file_threshold = threshold
+
     @property
     def logger(self) -> logging.Logger:
         ''':returns: a logger object for convenience.'''
@@ -114,6 +144,46 @@ class Tool:
     def __str__(self):
         return f"{type(self).__name__} - {self._name}: {self._exec_name}"
 
+    def run_cached(self,
+                   additional_parameters: Optional[
+                       Union[str, List[Union[Path, str]]]] = None) -> str:
+        '''Runs a command whose output only depends on the executable,
+        such as `--version`, using the results in the tool cache if
+        the executable hasn't changed. Failures are only cached for the
+        life of this process.
+
+        :param additional_parameters: the command line arguments, as
+            for :meth:`run`.
+
+        :raises RuntimeError: if the command fails, now or when cached.
+        '''
+        if isinstance(additional_parameters, str):
+            arguments = [additional_parameters]
+        else:
+            arguments = [str(arg) for arg in additional_parameters or []]
+
+        cache = get_tool_cache()
+        key = None
+        if cache.fpath and self._is_available is not False:
+            key = cache.key(self.exec_name, self.flags + arguments)
+        if key is None:
+            return self.run(additional_parameters)
+
+        cached = cache.get(key)
+        if cached is not None:
+            success, output = cached
+            if not success:
+                raise RuntimeError(output)
+            return output
+
+        try:
+            output = self.run(additional_parameters)
+        except RuntimeError as err:
+            cache.set(key, False, str(err))
+            raise
+        cache.set(key, True, output)
+        return output
+
     def run(self,
             additional_parameters: Optional[
                 Union[str, List[Union[Path, str]]]] = None,
@@ -154,12 +224,28 @@ class Tool:
             raise RuntimeError(f"Tool '{self.name}' is not available to run "
                                f"'{command}'.")
         self._logger.debug(f'run_command: {" ".join(command)}')
+
+        # Very long command lines can exceed the system's limit, so pass the
+        # arguments in a response file. The full command is still logged
+        # and reported in any errors.
+        run_command = command
+        response_file = None
+        if (self._response_file_threshold is not None and
+                sum(len(i) + 1 for i in command) >
+                self._response_file_threshold):
+            response_file = write_response_file(command[1:])
+            run_command = [command[0], f"@{response_file}"]
+            self._logger.debug(f'using response file {response_file}')
+
         try:
-            res = subprocess.run(command, capture_output=capture_output,
+            res = subprocess.run(run_command, capture_output=capture_output,
                                  env=env, cwd=cwd, check=False)
         except FileNotFoundError as err:
             raise RuntimeError(f"Command '{command}' could not be "
                                f"executed.") from err
+        finally:
+            if response_file:
+                response_file.unlink()
         if res.returncode != 0:
             msg = (f'Command failed with return code {res.returncode}:\n'
                    f'{command}')
@@ -173,6 +259,23 @@ class Tool:
         return ""
 
 
+def write_response_file(arguments: List[str]) -> Path:
+    '''Writes command line arguments to a temporary response file, one per
+    line, escaping any whitespace, quotes and backslashes. The caller must
+    delete the file.
+
+    :param arguments: the arguments to write.
+
+    :returns: the path of the response file.
+    '''
+    handle, fpath = tempfile.mkstemp(prefix="fab_", suffix=".rsp")
+    with os.fdopen(handle, "wt") as response_file:
+        for argument in arguments:
+            response_file.write(re.sub(r'([\s\'"\\])', r'\\\1', argument))
+            response_file.write("\n")
+    return Path(fpath)
+
+
 class CompilerSuiteTool(Tool):
     '''A tool that is part of a compiler suite (typically compiler
     and linker).
@@ -8,7 +8,8 @@
 '''
 
 import warnings
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
 
 from fab.tools.category import Category
 from fab.tools.tool import Tool
@@ -46,6 +47,30 @@ class ToolBox:
                           f"'{tool}'.")
         self._all_tools[tool.category] = tool
 
+    def add_tools(self, tools: Iterable[Tool],
+                  silent_replace: bool = False) -> None:
+        '''Adds several tools, checking whether they're available in
+        parallel, which is faster than adding them one by one when their
+        checks aren't in the tool cache.
+
+        :param tools: the tools to add.
+        :param silent_replace: if set, no warning will be printed
+            if an existing tool is replaced.
+
+        :raises RuntimeError: if a tool to be added is not available.
+        '''
+        tools = list(tools)
+        # Linkers use their compiler's check, so leave them until after
+        # the compilers have been checked.
+        to_check = [tool for tool in tools
+                    if tool.category != Category.LINKER]
+        if len(to_check) > 1:
+            with ThreadPoolExecutor(max_workers=len(to_check)) as executor:
+                list(executor.map(lambda tool: tool.is_available, to_check))
+
+        for tool in tools:
+            self.add_tool(tool, silent_replace=silent_replace)
+
     def get_tool(self, category: Category) -> Tool:
         '''Returns the tool for the specified category.
 
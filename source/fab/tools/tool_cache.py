@@ -0,0 +1,158 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+'''This file contains the ToolCache class, a persistent cache of the output
+of the commands used to probe tools, e.g. `--version`. Probing a tool
+starts a subprocess, which can be slow, especially for tools on network
+file systems. The results are stored by the executable's resolved path,
+size and modification time, and the environment variables which can
+change the result, so they're discarded when the tool changes. Only
+successful probes are saved. Failures are only remembered by the current
+process, so a tool which was missing or broken is probed again by the
+next build.
+
+The cache is stored in the Fab workspace. It can be moved, or disabled
+with an empty value, using the `FAB_TOOL_CACHE` environment variable.
+'''
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fab.util import get_fab_workspace
+
+TOOL_CACHE_FILENAME = 'tool_cache.json'
+
+# The environment variables in the cache key. A tool's output can depend
+# on other variables too, e.g. a wrapper script's own settings, which
+# aren't tracked.
+KEY_ENVIRONMENT = ('PATH', 'LD_LIBRARY_PATH')
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCache:
+    '''A cache of tool probe results, i.e. whether the probe command
+    succeeded, and its output or error message. Successes are saved in
+    the cache file, failures are only kept in memory.
+
+    :param fpath: the cache file, or None to cache nothing.
+    '''
+
+    def __init__(self, fpath: Optional[Path]):
+        self._fpath = fpath
+        self._entries: Optional[Dict[str, List]] = None
+        self._failures: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def fpath(self) -> Optional[Path]:
+        ''':returns: the cache file, or None if caching is disabled.'''
+        return self._fpath
+
+    @staticmethod
+    def key(exec_name: str, arguments: List[str]) -> Optional[str]:
+        ''':returns: the cache key for running the executable with the
+            given arguments in the current environment, or None if the
+            executable can't be found.
+
+        :param exec_name: the name or path of the executable.
+        :param arguments: the command line arguments.
+        '''
+        exec_path = shutil.which(exec_name)
+        if not exec_path:
+            return None
+        exec_path = os.path.realpath(exec_path)
+        try:
+            stat = os.stat(exec_path)
+        except OSError:
+            return None
+        environment = [os.environ.get(name) for name in KEY_ENVIRONMENT]
+        return json.dumps([exec_path, stat.st_size, stat.st_mtime_ns,
+                           arguments, environment])
+
+    def get(self, key: str) -> Optional[Tuple[bool, str]]:
+        ''':returns: whether the probe succeeded and its output, or None
+            if it's not in the cache.
+
+        :param key: the cache key, from :meth:`key`.
+        '''
+        if not self._fpath:
+            return None
+        with self._lock:
+            if key in self._failures:
+                return False, self._failures[key]
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        return bool(entry[0]), str(entry[1])
+
+    def set(self, key: str, success: bool, output: str):
+        '''Stores the result of a probe. A success is saved in the cache
+        file, a failure is only kept for the life of this process.
+
+        :param key: the cache key, from :meth:`key`.
+        :param success: whether the probe succeeded.
+        :param output: the output of the probe, or its error message.
+        '''
+        if not self._fpath:
+            return
+        with self._lock:
+            if not success:
+                self._failures[key] = output
+                return
+            self._failures.pop(key, None)
+            self._load()[key] = [success, output]
+            self._save()
+
+    def _load(self) -> Dict[str, List]:
+        # Read the cache file the first time we need it
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self._fpath, 'rt') as infile:  # type: ignore
+                    self._entries = json.load(infile)
+            except (OSError, ValueError):
+                pass
+        return self._entries
+
+    def _save(self):
+        # Replace the cache file in one go, so other processes never see
+        # a partly written file.
+        try:
+            self._fpath.parent.mkdir(parents=True, exist_ok=True)
+            handle, tmp_fpath = tempfile.mkstemp(dir=self._fpath.parent,
+                                                 prefix=self._fpath.name)
+            with os.fdopen(handle, 'wt') as outfile:
+                json.dump(self._entries, outfile)
+            os.replace(tmp_fpath, self._fpath)
+        except OSError as err:
+            logger.warning(f"could not save the tool cache: {err}")
+
+
+_tool_cache: Optional[ToolCache] = None
+_tool_cache_setting: Optional[Tuple] = None
+
+
+def get_tool_cache() -> ToolCache:
+    ''':returns: the tool cache for the current `FAB_TOOL_CACHE` and
+        `FAB_WORKSPACE` environment variables.
+    '''
+    global _tool_cache, _tool_cache_setting
+    setting = (os.getenv('FAB_TOOL_CACHE'), os.getenv('FAB_WORKSPACE'))
+    if _tool_cache is None or setting != _tool_cache_setting:
+        if setting[0] is not None:
+            fpath = Path(setting[0]) if setting[0] else None
+        else:
+            fpath = get_fab_workspace() / TOOL_CACHE_FILENAME
+        _tool_cache = ToolCache(fpath)
+        _tool_cache_setting = setting
+    return _tool_cache
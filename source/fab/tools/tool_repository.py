@@ -12,19 +12,57 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Type
+from typing import Any, List, Optional, Type, Union, cast
 
 from fab.tools.tool import Tool
 from fab.tools.category import Category
+from fab.tools.compiler import Compiler
 from fab.tools.linker import Linker
 from fab.tools.versioning import Fcm, Git, Subversion
 
 
+class _LazyTool:
+    '''A tool in the repository which has not been created yet. It is
+    created the first time its category is looked up, so that only the
+    tools which are actually used are created.
+
+    :param cls: the tool to instantiate.
+    '''
+
+    def __init__(self, cls: Type[Any]):
+        self._cls = cls
+        self._tool: Optional[Tool] = None
+
+    def create(self) -> Tool:
+        ''':returns: the tool, which is only created once.'''
+        if self._tool is None:
+            self._tool = self._cls()
+        return self._tool
+
+
+class _LazyLinker:
+    '''The linker for a compiler which has not been created yet.
+
+    :param compiler: the compiler to link with.
+    '''
+
+    def __init__(self, compiler: _LazyTool):
+        self._compiler = compiler
+
+    def create(self) -> Linker:
+        ''':returns: a linker using the compiler.'''
+        compiler = cast(Compiler, self._compiler.create())
+        return Linker(name=f"linker-{compiler.name}", compiler=compiler)
+
+
 class ToolRepository(dict):
     '''This class implements the tool repository. It stores a list of
     tools for various categories. For each compiler, it will automatically
     create a tool called "linker-{compiler-name}" which can be used for
     linking with the specified compiler.
+
+    The FAB default tools are only created when their category is first
+    looked up, and no tool is checked for availability here.
     '''
 
     _singleton: None | ToolRepository = None
@@ -61,16 +99,48 @@ class ToolRepository(dict):
         from fab.tools import (Ar, Cpp, CppFortran, Gcc, Gfortran,
                                Icc, Ifort, Psyclone, Rsync)
 
-        for cls in [Gcc, Icc, Gfortran, Ifort, Cpp, CppFortran,
-                    Fcm, Git, Subversion, Ar, Psyclone, Rsync]:
-            self.add_tool(cls)
-
-    def add_tool(self, cls: Type[Any]):
-        '''Creates an instance of the specified class and adds it
-        to the tool repository.
+        for cls, category in [(Gcc, Category.C_COMPILER),
+                              (Icc, Category.C_COMPILER),
+                              (Gfortran, Category.FORTRAN_COMPILER),
+                              (Ifort, Category.FORTRAN_COMPILER),
+                              (Cpp, Category.C_PREPROCESSOR),
+                              (CppFortran, Category.FORTRAN_PREPROCESSOR),
+                              (Fcm, Category.FCM),
+                              (Git, Category.GIT),
+                              (Subversion, Category.SUBVERSION),
+                              (Ar, Category.AR),
+                              (Psyclone, Category.PSYCLONE),
+                              (Rsync, Category.RSYNC)]:
+            self.add_tool(cls, category)
+
+    def __getitem__(self, category: Category) -> List[Any]:
+        ''':returns: the tools in the given category, creating any
+        which have not been created yet.
+
+        :param category: the category of the tools.
+        '''
+        all_tools: List[Union[Tool, _LazyTool, _LazyLinker]] = \
+            super().__getitem__(category)
+        for index, tool in enumerate(all_tools):
+            if not isinstance(tool, Tool):
+                all_tools[index] = tool.create()
+        return all_tools
+
+    def add_tool(self, cls: Type[Any], category: Optional[Category] = None):
+        '''Adds the specified class to the tool repository. If the
+        category is given, the tool is only created when this category is
+        looked up, otherwise it is created now.
 
         :param cls: the tool to instantiate.
+        :param category: the category of the tool.
         '''
+        if category is not None:
+            lazy_tool = _LazyTool(cls)
+            super().__getitem__(category).append(lazy_tool)
+            if category.is_compiler:
+                super().__getitem__(Category.LINKER).append(
+                    _LazyLinker(lazy_tool))
+            return
 
         # Note that we cannot declare `cls` to be `Type[Tool]`, since the
         # Tool constructor requires arguments, but the classes used here are
@@ -11,7 +11,9 @@ Various utility functions live here - until we give them a proper place to live!
 import datetime
 import logging
 import os
+import stat
 import sys
+import uuid
 import zlib
 from argparse import ArgumentParser
 from collections import namedtuple, defaultdict
@@ -76,6 +78,61 @@ def string_checksum(s: str):
     return zlib.crc32(s.encode())
 
 
+def write_if_changed(fpath: Path, content: Union[str, bytes]) -> bool:
+    """
+    Write a file, unless it already has the given content.
+
+    Leaving an unchanged file alone keeps its modification time, and avoids the write on shared file systems.
+    The content is written to a temporary file which then replaces the target,
+    so nothing ever sees a partly written file. A replaced file keeps its permissions,
+    and a new file gets the permissions allowed by the umask, as with a normal write.
+
+    Returns whether the file was written.
+
+    :param fpath:
+        The file to write.
+    :param content:
+        The new content. Strings are written as utf-8.
+
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    # only read the existing file if it could be the same
+    old_stat: Optional[os.stat_result] = None
+    try:
+        old_stat = fpath.stat()
+        if old_stat.st_size == len(content) and fpath.read_bytes() == content:
+            return False
+    except OSError:
+        pass
+
+    # the open applies the umask, unlike mkstemp which makes files only we can read
+    tmp_fpath = fpath.parent / f'.{fpath.name}.{os.getpid()}.{uuid.uuid4().hex}'
+    handle = os.open(tmp_fpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+    try:
+        with os.fdopen(handle, 'wb') as outfile:
+            outfile.write(content)
+        if old_stat:
+            os.chmod(tmp_fpath, stat.S_IMODE(old_stat.st_mode))
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        if os.path.exists(tmp_fpath):
+            os.remove(tmp_fpath)
+        raise
+    return True
+
+
+def copy_if_changed(src: Path, dst: Path) -> bool:
+    """
+    Copy a file's content, unless the destination already has it. See :func:`write_if_changed`.
+
+    Returns whether the file was written.
+
+    """
+    return write_if_changed(dst, src.read_bytes())
+
+
 def file_walk(path: Union[str, Path], ignore_folders: Optional[List[Path]] = None) -> Iterator[Path]:
     """
     Return every file in *path* and its sub-folders.
@@ -14,6 +14,13 @@ import pytest
 from fab.tools import Category, CCompiler, FortranCompiler, Linker, ToolBox
 
 
+@pytest.fixture(autouse=True)
+def no_tool_cache(monkeypatch):
+    '''Disables the persistent tool cache, so that tests which mock
+    running a tool aren't affected by results cached by other tests.'''
+    monkeypatch.setenv("FAB_TOOL_CACHE", "")
+
+
 # This avoids pylint warnings about Redefining names from outer scope
 @pytest.fixture(name="mock_c_compiler")
 def fixture_mock_c_compiler():
@@ -23,17 +23,20 @@ import pytest
 PROJECT_SOURCE = Path(__file__).parent / 'project-source'
 
 
-def test_CFortranInterop(tmp_path):
+@pytest.mark.parametrize('c_engine', ['libclang', 'scanner'])
+@pytest.mark.parametrize('c_single_pass', [False, True])
+def test_CFortranInterop(tmp_path, c_single_pass, c_engine):
 
     # build
     with BuildConfig(fab_workspace=tmp_path, project_label='foo',
                      tool_box=ToolBox(), multiprocessing=False) as config:
         grab_folder(config, src=PROJECT_SOURCE)
         find_source_files(config)
-        c_pragma_injector(config)
-        preprocess_c(config)
+        if not c_single_pass:
+            c_pragma_injector(config)
+            preprocess_c(config)
         preprocess_fortran(config)
-        analyse(config, root_symbol='main')
+        analyse(config, root_symbol='main', c_single_pass=c_single_pass, c_engine=c_engine)
         compile_c(config, common_flags=['-c', '-std=c99'])
         with pytest.warns(UserWarning, match="Removing managed flag"):
             compile_fortran(config, common_flags=['-c'])
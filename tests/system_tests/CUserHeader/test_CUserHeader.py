@@ -17,10 +17,14 @@ from fab.steps.link import link_exe
 from fab.steps.preprocess import preprocess_c
 from fab.tools import ToolBox
 
+import pytest
+
 PROJECT_SOURCE = Path(__file__).parent / 'project-source'
 
 
-def test_CUseHeader(tmp_path):
+@pytest.mark.parametrize('c_engine', ['libclang', 'scanner'])
+@pytest.mark.parametrize('c_single_pass', [False, True])
+def test_CUseHeader(tmp_path, c_single_pass, c_engine):
 
     # build
     with BuildConfig(fab_workspace=tmp_path, tool_box=ToolBox(),
@@ -28,9 +32,10 @@ def test_CUseHeader(tmp_path):
 
         grab_folder(config, PROJECT_SOURCE)
         find_source_files(config)
-        c_pragma_injector(config)
-        preprocess_c(config)
-        analyse(config, root_symbol='main')
+        if not c_single_pass:
+            c_pragma_injector(config)
+            preprocess_c(config)
+        analyse(config, root_symbol='main', c_single_pass=c_single_pass, c_engine=c_engine)
         compile_c(config, common_flags=['-c', '-std=c99'])
         link_exe(config, flags=['-lgfortran'])
 
@@ -21,18 +21,21 @@ from fab.tools import ToolBox
 import pytest
 
 
-def test_fortran_dependencies(tmp_path):
+# a batch size of 1 compiles each file on its own
+@pytest.mark.parametrize('batch_size', [1, 4])
+@pytest.mark.parametrize('two_stage', [False, True])
+def test_fortran_dependencies(tmp_path, batch_size, two_stage):
 
     # build
     with BuildConfig(fab_workspace=tmp_path, tool_box=ToolBox(),
-                     project_label='foo', multiprocessing=False) as config:
+                     project_label='foo', multiprocessing=False, two_stage=two_stage) as config:
         grab_folder(config, src=Path(__file__).parent / 'project-source')
         find_source_files(config)
         preprocess_fortran(config)  # nothing to preprocess, actually, it's all little f90 files
         analyse(config, root_symbol=['first', 'second'])
-        compile_c(config, common_flags=['-c', '-std=c99'])
+        compile_c(config, common_flags=['-c', '-std=c99'], batch_size=batch_size)
         with pytest.warns(UserWarning, match="Removing managed flag"):
-            compile_fortran(config, common_flags=['-c'])
+            compile_fortran(config, common_flags=['-c'], batch_size=batch_size)
         link_exe(config, flags=['-lgfortran'])
 
     assert len(config.artefact_store[ArtefactSet.EXECUTABLES]) == 2
@@ -8,10 +8,12 @@ from unittest import mock
 from unittest.mock import Mock
 
 import clang  # type: ignore
+import pytest
 
-from fab.build_config import BuildConfig
-from fab.parse.c import CAnalyser, AnalysedC
+from fab.build_config import BuildConfig, FlagsConfig
+from fab.parse.c import CAnalyser, AnalysedC, _get_index
 from fab.tools import ToolBox
+from fab.util import file_checksum
 
 
 def test_simple_result(tmp_path):
@@ -32,6 +34,82 @@ def test_simple_result(tmp_path):
     assert artefact == c_analyser._config.prebuild_folder / f'test_c_analyser.{analysis.file_hash}.an'
 
 
+def test_single_pass_result(tmp_path):
+    # unpreprocessed source, with no pragmas, classified by source location
+    (tmp_path / 'usr.h').write_text('int usr_var;\nint usr_func(void);\n')
+    fpath = tmp_path / 'foo.c'
+    fpath.write_text(
+        '#include <stdio.h>\n'
+        '#include "usr.h"\n'
+        'int foo_var = 1;\n'
+        'static int foo_static(void) { return 1; }\n'
+        'int foo(void) { printf("hello"); return usr_func() + usr_var + foo_static(); }\n')
+
+    c_analyser = CAnalyser(single_pass=True)
+    c_analyser._config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+
+    with mock.patch('fab.parse.AnalysedFile.save'):
+        analysis, _ = c_analyser.run(fpath)
+
+    expected = AnalysedC(
+        fpath=fpath,
+        file_hash=file_checksum(fpath).file_hash,
+        symbol_deps={'usr_var', 'usr_func'},
+        symbol_defs={'foo', 'foo_var'},
+        header_deps={tmp_path / 'usr.h': file_checksum(tmp_path / 'usr.h').file_hash},
+    )
+    assert analysis == expected
+
+
+def test_single_pass_prebuild_headers_changed(tmp_path):
+    # a prebuild is not used if one of its user headers has changed
+    fpath = tmp_path / 'foo.c'
+    fpath.write_text('int foo(void) { return 1; }\n')
+
+    c_analyser = CAnalyser(single_pass=True)
+    c_analyser._config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+    c_analyser._config.prebuild_folder.mkdir(parents=True)
+
+    analysis, analysis_fpath = c_analyser.run(fpath)
+    assert analysis_fpath.exists()
+
+    with mock.patch('fab.parse.c.AnalysedC.headers_changed', return_value=True), \
+            mock.patch('fab.parse.c._get_index', wraps=_get_index) as mock_get_index:
+        c_analyser.run(fpath)
+    mock_get_index.assert_called_once()
+
+    with mock.patch('fab.parse.c._get_index') as mock_get_index:
+        c_analyser.run(fpath)
+    mock_get_index.assert_not_called()
+
+
+class Test_check_location:
+
+    def test_main_file(self):
+        analyser = CAnalyser(single_pass=True)
+        analyser._main_file = 'foo.c'
+        node = Mock()
+        node.location.file.name = 'foo.c'
+        assert analyser._include_type(node) is None
+
+    def test_no_file(self):
+        analyser = CAnalyser(single_pass=True)
+        analyser._main_file = 'foo.c'
+        assert analyser._include_type(Mock(location=Mock(file=None))) is None
+
+    def test_headers(self):
+        analyser = CAnalyser(single_pass=True)
+        analyser._main_file = 'foo.c'
+        node = Mock()
+        node.location.file.name = 'foo.h'
+
+        with mock.patch('fab.parse.c.clang.cindex.conf') as mock_conf:
+            mock_conf.lib.clang_Location_isInSystemHeader.return_value = 1
+            assert analyser._include_type(node) == "sys_include"
+            mock_conf.lib.clang_Location_isInSystemHeader.return_value = 0
+            assert analyser._include_type(node) == "usr_include"
+
+
 class Test__locate_include_regions:
 
     def test_vanilla(self) -> None:
@@ -161,11 +239,64 @@ class Test_process_symbol_dependency:
         return analysed_file
 
 
-def test_clang_disable():
+def test_clang_disable(tmp_path):
+    # without libclang, we fall back to the symbol scanner
+    c_analyser = CAnalyser()
+    c_analyser._config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
 
     with mock.patch('fab.parse.c.clang', None):
-        with mock.patch('fab.parse.c.file_checksum') as mock_file_checksum:
-            result = CAnalyser().run(Path(__file__).parent / "test_c_analyser.c")
-
-    assert isinstance(result[0], ImportWarning)
-    mock_file_checksum.assert_not_called()
+        with pytest.warns(ImportWarning, match='falling back to the C symbol scanner'):
+            with mock.patch('fab.parse.AnalysedFile.save'):
+                analysis, _ = c_analyser.run(Path(__file__).parent / "test_c_analyser.c")
+
+    assert analysis.symbol_deps == {'usr_var', 'usr_func'}
+    assert analysis.symbol_defs == {'func_decl', 'func_def', 'var_def', 'var_extern_def', 'main'}
+
+
+class TestScannerEngine(object):
+
+    def test_simple_result(self, tmp_path):
+        # the scanner agrees with libclang on the pragma'd test source
+        c_analyser = CAnalyser(engine='scanner')
+        c_analyser._config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+
+        with mock.patch('fab.parse.AnalysedFile.save'), mock.patch('fab.parse.c._get_index') as mock_get_index:
+            fpath = Path(__file__).parent / "test_c_analyser.c"
+            analysis, artefact = c_analyser.run(fpath)
+        mock_get_index.assert_not_called()
+
+        expected = AnalysedC(
+            fpath=fpath,
+            file_hash=1429445462,
+            symbol_deps={'usr_var', 'usr_func'},
+            symbol_defs={'func_decl', 'func_def', 'var_def', 'var_extern_def', 'main'},
+        )
+        assert analysis == expected
+
+        # scanner prebuilds are kept separate from libclang prebuilds
+        assert artefact != c_analyser._config.prebuild_folder / f'test_c_analyser.{analysis.file_hash}.an'
+
+    def test_single_pass(self, tmp_path):
+        (tmp_path / 'include').mkdir()
+        (tmp_path / 'include' / 'usr.h').write_text('int usr_var;\nint usr_func(void);\n')
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text(
+            '#include <stdio.h>\n'
+            '#include "usr.h"\n'
+            'int foo(void) { printf("hello"); return usr_func() + usr_var; }\n')
+
+        c_analyser = CAnalyser(single_pass=True, engine='scanner',
+                               flags=FlagsConfig(common_flags=['-I', str(tmp_path / 'include')]))
+        c_analyser._config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+
+        with mock.patch('fab.parse.AnalysedFile.save'):
+            analysis, _ = c_analyser.run(fpath)
+
+        assert analysis.symbol_defs == {'foo'}
+        assert analysis.symbol_deps == {'usr_var', 'usr_func'}
+        assert analysis.header_deps == {
+            tmp_path / 'include' / 'usr.h': file_checksum(tmp_path / 'include' / 'usr.h').file_hash}
+
+    def test_unknown_engine(self):
+        with pytest.raises(ValueError):
+            CAnalyser(engine='foo')
@@ -0,0 +1,142 @@
+"""
+Test the lightweight C symbol scanner.
+
+"""
+import pytest
+
+from fab.parse.c_scanner import CSymbolScanner
+from fab.util import file_checksum
+
+
+def scan(tmp_path, source, **kwargs):
+    fpath = tmp_path / 'foo.c'
+    fpath.write_text(source)
+    return CSymbolScanner(**kwargs).scan(fpath)
+
+
+class TestDefinitions(object):
+
+    @pytest.mark.parametrize('source, expected', [
+        ('int foo(void) { return 1; }', {'foo'}),
+        ('static int foo(void) { return 1; }', set()),
+        ('int foo(void) __attribute__((noinline)) { return 1; }', {'foo'}),
+        ('int *foo(int a, int b) { return 0; }', {'foo'}),
+        ('int foo = 1;', {'foo'}),
+        ('int foo[2] = {1, 2};', {'foo'}),
+        ('int a = 1, b, c = 2;', {'a', 'c'}),
+        ('extern int foo = 1;', {'foo'}),
+        ('static int foo = 1;', set()),
+        ('int foo;', set()),
+        ('int foo(void);', set()),
+        ('struct point {int x; int y;} p = {1, 2};', {'p'}),
+        ('struct point {int x; int y;};', set()),
+        ('typedef int foo;', set()),
+        ('int (*fp)(int) = 0;', {'fp'}),
+    ])
+    def test_definitions(self, tmp_path, source, expected):
+        assert scan(tmp_path, source).symbol_defs == expected
+
+
+class TestDependencies(object):
+
+    def test_usr_pragmas(self, tmp_path):
+        result = scan(tmp_path, '''
+            #pragma FAB UsrIncludeStart
+            int usr_var;
+            int usr_func(void);
+            int unused(void);
+            #pragma FAB UsrIncludeEnd
+            int foo(void) { return usr_func() + usr_var; }
+        ''')
+        assert result.symbol_deps == {'usr_var', 'usr_func'}
+
+    def test_sys_pragmas(self, tmp_path):
+        result = scan(tmp_path, '''
+            #pragma FAB SysIncludeStart
+            int sys_func(void);
+            int sys_def(void) { return 1; }
+            #pragma FAB SysIncludeEnd
+            int foo(void) { return sys_func(); }
+        ''')
+        assert result.symbol_defs == {'foo'}
+        assert result.symbol_deps == set()
+
+    def test_line_markers(self, tmp_path):
+        # as written by the C preprocessor
+        result = scan(tmp_path, '''
+            # 1 "foo.c"
+            # 1 "/usr/include/stdio.h" 1 3 4
+            int printf(const char *, ...);
+            int sys_def(void) { return 1; }
+            # 2 "foo.c" 2
+            # 1 "usr.h" 1
+            int usr_func(void);
+            # 3 "foo.c" 2
+            int foo(void) { return usr_func() + printf("hi"); }
+        ''')
+        assert result.symbol_defs == {'foo'}
+        assert result.symbol_deps == {'usr_func'}
+
+    def test_declared_later(self, tmp_path):
+        # symbols are only dependencies when they're declared before use
+        result = scan(tmp_path, '''
+            int foo(void) { return usr_func(); }
+            #pragma FAB UsrIncludeStart
+            int usr_func(void);
+            #pragma FAB UsrIncludeEnd
+        ''')
+        assert result.symbol_deps == set()
+
+    def test_ignored_tokens(self, tmp_path):
+        # members, comments and strings which share a user symbol's name are not dependencies
+        result = scan(tmp_path, '''
+            #pragma FAB UsrIncludeStart
+            int usr_var;
+            #pragma FAB UsrIncludeEnd
+            struct s {int usr_var;};
+            int foo(struct s a, struct s *b) {
+                /* usr_var */
+                // usr_var
+                char *c = "usr_var";
+                return a.usr_var + b->usr_var;
+            }
+        ''')
+        assert result.symbol_deps == set()
+
+    def test_initialiser(self, tmp_path):
+        result = scan(tmp_path, '''
+            #pragma FAB UsrIncludeStart
+            int usr_func(void);
+            #pragma FAB UsrIncludeEnd
+            int (*fp)(void) = usr_func;
+        ''')
+        assert result.symbol_defs == {'fp'}
+        assert result.symbol_deps == {'usr_func'}
+
+
+class TestIncludes(object):
+
+    def test_user_include(self, tmp_path):
+        (tmp_path / 'usr.h').write_text('#include "nested.h"\nint usr_func(void);\n')
+        (tmp_path / 'include').mkdir()
+        (tmp_path / 'include' / 'nested.h').write_text('int nested_var;\nint nested_def = 1;\n')
+
+        result = scan(tmp_path, '''
+            #include <stdio.h>
+            #include "usr.h"
+            #include "missing.h"
+            int foo(void) { return usr_func() + nested_var; }
+        ''', include_paths=[tmp_path / 'include'])
+
+        assert result.symbol_defs == {'foo', 'nested_def'}
+        assert result.symbol_deps == {'usr_func', 'nested_var'}
+        assert result.header_deps == {
+            tmp_path / 'usr.h': file_checksum(tmp_path / 'usr.h').file_hash,
+            tmp_path / 'include' / 'nested.h': file_checksum(tmp_path / 'include' / 'nested.h').file_hash,
+        }
+
+    def test_recursive_include(self, tmp_path):
+        # a header without an include guard, which includes itself
+        (tmp_path / 'usr.h').write_text('#include "usr.h"\nint usr_func(void);\n')
+        result = scan(tmp_path, '#include "usr.h"\nint foo(void) { return usr_func(); }\n')
+        assert result.symbol_deps == {'usr_func'}
@@ -195,16 +195,20 @@ class TestAnalysedFortran(object):
         assert hash(analysed_fortran) == hash(copy.deepcopy(analysed_fortran))
 
     def test_hash_different_module_defs(self, analysed_fortran, different_module_defs):
-        assert hash(analysed_fortran) != hash(different_module_defs)
+        assert analysed_fortran != different_module_defs
+        assert len({analysed_fortran, different_module_defs}) == 2
 
     def test_hash_different_module_deps(self, analysed_fortran, different_module_deps):
-        assert hash(analysed_fortran) != hash(different_module_deps)
+        assert analysed_fortran != different_module_deps
+        assert len({analysed_fortran, different_module_deps}) == 2
 
     def test_hash_different_mo_commented_file_deps(self, analysed_fortran, different_mo_commented_file_deps):
-        assert hash(analysed_fortran) != hash(different_mo_commented_file_deps)
+        assert analysed_fortran != different_mo_commented_file_deps
+        assert len({analysed_fortran, different_mo_commented_file_deps}) == 2
 
     def test_hash_different_psyclone_kernels(self, analysed_fortran, different_psyclone_kernels):
-        assert hash(analysed_fortran) != hash(different_psyclone_kernels)
+        assert analysed_fortran != different_psyclone_kernels
+        assert len({analysed_fortran, different_psyclone_kernels}) == 2
 
 
 # to/from dict should use vars(), and just be in the base class
@@ -7,6 +7,7 @@ from pathlib import Path
 
 import pytest
 from fab.parse.c import AnalysedC
+from fab.util import file_checksum
 
 
 class TestAnalysedC(object):
@@ -27,3 +28,24 @@ class TestAnalysedC(object):
         loaded = AnalysedC.load(fpath)
 
         assert loaded == analysed_c
+
+    def test_save_load_header_deps(self, analysed_c, tmp_path):
+        analysed_c.header_deps = {Path('foo.h'): 456}
+        fpath = tmp_path / 'analysed_c.an'
+
+        analysed_c.save(fpath)
+        loaded = AnalysedC.load(fpath)
+
+        assert loaded == analysed_c
+
+    def test_headers_changed(self, analysed_c, tmp_path):
+        header = tmp_path / 'foo.h'
+        header.write_text('int foo(void);\n')
+        analysed_c.header_deps = {header: file_checksum(header).file_hash}
+        assert not analysed_c.headers_changed()
+
+        header.write_text('int foo(int bar);\n')
+        assert analysed_c.headers_changed()
+
+        header.unlink()
+        assert analysed_c.headers_changed()
@@ -0,0 +1,65 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+"""
+Test finding the files included by a source file.
+
+"""
+from pathlib import Path
+
+from fab.parse.includes import find_includes, include_paths_from_flags, includes_hash
+from fab.util import file_checksum
+
+
+def checksums(*fpaths):
+    return {fpath: file_checksum(fpath).file_hash for fpath in fpaths}
+
+
+class TestFindIncludes(object):
+
+    def test_fortran(self, tmp_path):
+        (tmp_path / 'a.inc').write_text('integer :: a\n')
+        (tmp_path / 'inc').mkdir()
+        (tmp_path / 'inc' / 'b.inc').write_text('  INCLUDE "c.inc"\n')
+        (tmp_path / 'inc' / 'c.inc').write_text('integer :: c\n')
+        fpath = tmp_path / 'foo.f90'
+        fpath.write_text("program foo\n  include 'a.inc'\n  include 'b.inc'\n  include 'missing.inc'\n"
+                         "  ! include 'comment.inc'\nend program foo\n")
+
+        result = find_includes(fpath, include_paths=[tmp_path / 'inc'])
+        assert result == checksums(tmp_path / 'a.inc', tmp_path / 'inc' / 'b.inc', tmp_path / 'inc' / 'c.inc')
+
+    def test_cpp(self, tmp_path):
+        (tmp_path / 'a.h').write_text('#include "a.h"\n#define A 1\n')
+        (tmp_path / 'inc').mkdir()
+        (tmp_path / 'inc' / 'b.h').write_text('#define B 1\n')
+        fpath = tmp_path / 'foo.F90'
+        fpath.write_text('#include "a.h"\n# include <b.h>\n#include <stdio.h>\nprogram foo\nend program foo\n')
+
+        result = find_includes(fpath, include_paths=[tmp_path / 'inc'])
+        assert result == checksums(tmp_path / 'a.h', tmp_path / 'inc' / 'b.h')
+
+    def test_angle_brackets_not_local(self, tmp_path):
+        # angle bracket includes are only searched for in the include paths
+        (tmp_path / 'b.h').write_text('#define B 1\n')
+        fpath = tmp_path / 'foo.c'
+        fpath.write_text('#include <b.h>\n')
+        assert find_includes(fpath) == {}
+
+    def test_missing_file(self, tmp_path):
+        assert find_includes(tmp_path / 'missing.f90') == {}
+
+
+def test_includes_hash(tmp_path):
+    assert includes_hash({}) == 0
+    a_hash = includes_hash({tmp_path / 'a.inc': 1})
+    assert a_hash == includes_hash({Path('elsewhere/a.inc'): 1})
+    assert a_hash != includes_hash({tmp_path / 'a.inc': 2})
+    assert a_hash != includes_hash({tmp_path / 'b.inc': 1})
+
+
+def test_include_paths_from_flags():
+    flags = ['-I', 'a', '-Ib', '-iquote', 'c', '-iquoted', '-isystem', 'e', '-DFOO']
+    assert include_paths_from_flags(flags) == [Path('a'), Path('b'), Path('c'), Path('d')]
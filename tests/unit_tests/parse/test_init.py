@@ -8,7 +8,9 @@ Test contents of parse/__init__.py
 
 """
 import copy
+import pickle
 from pathlib import Path
+from unittest import mock
 
 import pytest
 from fab.parse import AnalysedFile
@@ -57,6 +59,57 @@ class TestAnalysedFile(object):
     def test_hash_different_file_hash(self, analysed_file, different_file_hash):
         assert hash(analysed_file) != hash(different_file_hash)
 
+    def test_hash_cached(self, analysed_file):
+        with mock.patch('fab.parse.hash', create=True, wraps=hash) as mock_hash:
+            hash(analysed_file)
+            hash(analysed_file)
+        mock_hash.assert_called_once()
+
+    def test_hash_not_pickled(self, analysed_file):
+        # hashes differ between processes, so the cached hash must not be sent to another one
+        hash(analysed_file)
+        assert '_hash' not in analysed_file.__getstate__()
+        unpickled = pickle.loads(pickle.dumps(analysed_file))
+        assert unpickled == analysed_file
+        assert unpickled._hash is None
+
+    def test_hash_fpath_changed(self, analysed_file, different_fpath):
+        hash(analysed_file)
+        analysed_file.fpath = Path('bar.f90')
+        assert hash(analysed_file) == hash(different_fpath)
+
+    def test_hash_file_hash_changed(self, analysed_file, different_file_hash):
+        hash(analysed_file)
+        analysed_file.file_hash = 456
+        assert hash(analysed_file) == hash(different_file_hash)
+
+    def test_slots(self, analysed_file):
+        # analysed files are kept small
+        assert not hasattr(analysed_file, '__dict__')
+        with pytest.raises(AttributeError):
+            analysed_file.foo = 1
+
+
+class TestUnslottedSubclass(object):
+    # a subclass outside fab, without __slots__, keeps its own attributes
+
+    class Mine(AnalysedFile):
+        def __init__(self, fpath, file_hash, extra):
+            super().__init__(fpath=fpath, file_hash=file_hash)
+            self.extra = extra
+
+    def test_eq(self):
+        assert self.Mine('foo.f90', 123, extra=1) == self.Mine('foo.f90', 123, extra=1)
+        assert self.Mine('foo.f90', 123, extra=1) != self.Mine('foo.f90', 123, extra=2)
+
+    def test_pickle(self):
+        mine = self.Mine('foo.f90', 123, extra=1)
+        hash(mine)
+        unpickled = pickle.loads(pickle.dumps(mine))
+        assert unpickled.extra == 1
+        assert unpickled == mine
+        assert unpickled._hash is None
+
 
 class TestAnalysedDependent(object):
 
@@ -115,6 +168,14 @@ class TestAnalysedDependent(object):
         analysed_dependent.add_symbol_dep('other_func3')
         assert analysed_dependent.symbol_deps == {'other_func1', 'other_func2', 'other_func3'}
 
+    def test_interned(self, analysed_dependent):
+        name = ''.join(['my_', 'func4'])
+        analysed_dependent.add_symbol_def(name.upper())
+        other = AnalysedDependent(fpath=Path('bar.f90'), symbol_deps=[name])
+
+        def_name = next(d for d in analysed_dependent.symbol_defs if d == name)
+        assert def_name is next(iter(other.symbol_deps))
+
     def test_add_file_dep(self, analysed_dependent):
         analysed_dependent.add_file_dep('other_file3.f90')
         assert analysed_dependent.file_deps == {
@@ -143,11 +204,18 @@ class TestAnalysedDependent(object):
     def test_hash(self, analysed_dependent):
         assert hash(analysed_dependent) == hash(copy.deepcopy(analysed_dependent))
 
+    def test_hash_path_and_checksum(self, analysed_dependent):
+        # the hash only depends on the path and file checksum, not the analysis results
+        assert hash(analysed_dependent) == hash((Path('foo.f90'), 123))
+
     def test_hash_different_symbol_defs(self, analysed_dependent, different_symbol_defs):
-        assert hash(analysed_dependent) != hash(different_symbol_defs)
+        assert analysed_dependent != different_symbol_defs
+        assert len({analysed_dependent, different_symbol_defs}) == 2
 
     def test_hash_different_symbol_deps(self, analysed_dependent, different_symbol_deps):
-        assert hash(analysed_dependent) != hash(different_symbol_deps)
+        assert analysed_dependent != different_symbol_deps
+        assert len({analysed_dependent, different_symbol_deps}) == 2
 
     def test_hash_different_file_deps(self, analysed_dependent, different_file_deps):
-        assert hash(analysed_dependent) != hash(different_file_deps)
+        assert analysed_dependent != different_file_deps
+        assert len({analysed_dependent, different_file_deps}) == 2
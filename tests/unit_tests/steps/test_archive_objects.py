@@ -7,6 +7,7 @@
 Test for the archive step.
 """
 
+from pathlib import Path
 from unittest import mock
 from unittest.mock import call
 
@@ -14,7 +15,7 @@ import pytest
 
 from fab.artefacts import ArtefactSet
 from fab.build_config import BuildConfig
-from fab.steps.archive_objects import archive_objects
+from fab.steps.archive_objects import _update_archive, archive_objects
 from fab.tools import Category, ToolBox
 
 
@@ -27,7 +28,7 @@ class TestArchiveObjects:
         '''
         targets = ['prog1', 'prog2']
 
-        config = BuildConfig('proj', ToolBox())
+        config = BuildConfig('proj', ToolBox(), multiprocessing=False)
         for target in targets:
             config.artefact_store.update_dict(
                 ArtefactSet.OBJECT_FILES, target,
@@ -77,6 +78,33 @@ class TestArchiveObjects:
         assert config.artefact_store[ArtefactSet.OBJECT_ARCHIVES] == {
             None: set([str(config.build_output / 'mylib.a')])}
 
+    def test_parallel(self):
+        '''Archives for several executables are created in parallel.
+        '''
+        config = BuildConfig('proj', ToolBox())
+        for target in ['prog1', 'prog2']:
+            config.artefact_store.update_dict(ArtefactSet.OBJECT_FILES, target, {f'{target}.o'})
+
+        with mock.patch('fab.steps.archive_objects.run_mp', return_value=[None, None]) as mock_run_mp, \
+                pytest.warns(UserWarning, match="_metric_send_conn not set"):
+            archive_objects(config=config, n_procs=3)
+
+        items = mock_run_mp.call_args[0][1]
+        assert [item[1:3] for item in items] == [
+            (str(config.build_output / f'{target}.a'), [f'{target}.o']) for target in ['prog1', 'prog2']]
+        assert mock_run_mp.call_args[1] == {'no_multiprocessing': False, 'n_procs': 3}
+
+    def test_error(self):
+        '''Archive errors from the workers are reported.
+        '''
+        config = BuildConfig('proj', ToolBox(), multiprocessing=False)
+        config.artefact_store.update_dict(ArtefactSet.OBJECT_FILES, None, {'util1.o'})
+
+        with mock.patch('fab.tools.tool.subprocess.run',
+                        return_value=mock.Mock(returncode=1, stderr=b'bad')), \
+                pytest.raises(RuntimeError, match="error creating object archive"):
+            archive_objects(config=config, output_fpath=config.build_output / 'mylib.a')
+
     def test_incorrect_tool(self):
         '''Test that an incorrect archive tool is detected
         '''
@@ -94,3 +122,78 @@ class TestArchiveObjects:
                             output_fpath=config.build_output / 'mylib.a')
         assert ("Unexpected tool 'gcc' of type '<class "
                 "'fab.tools.compiler.Gcc'>' instead of Ar" in str(err.value))
+
+
+class TestUpdateArchive:
+    '''Test the incremental update of an existing archive.
+    '''
+
+    @pytest.fixture
+    def ar(self):
+        '''An archiver which just creates the archive file.'''
+        ar = mock.Mock()
+        ar.create.side_effect = lambda output_fpath, members, thin: Path(output_fpath).write_text('archive')
+        return ar
+
+    @pytest.fixture
+    def objects(self, tmp_path):
+        objects = []
+        for name in ['a.o', 'b.o', 'c.o']:
+            (tmp_path / name).write_text(name)
+            objects.append(str(tmp_path / name))
+        return objects
+
+    def test_unchanged(self, tmp_path, ar, objects):
+        output_fpath = tmp_path / 'out.a'
+        _update_archive(ar, output_fpath, objects, thin=False)
+        ar.create.assert_called_once_with(output_fpath, objects, thin=False)
+        assert (tmp_path / 'out.a.manifest').exists()
+
+        ar.reset_mock()
+        _update_archive(ar, output_fpath, objects, thin=False)
+        ar.create.assert_not_called()
+        ar.replace.assert_not_called()
+        ar.delete.assert_not_called()
+
+    def test_changed(self, tmp_path, ar, objects):
+        output_fpath = tmp_path / 'out.a'
+        _update_archive(ar, output_fpath, objects, thin=False)
+        ar.reset_mock()
+
+        # a changes, b is no longer wanted and d is new
+        (tmp_path / 'a.o').write_text('new a.o')
+        (tmp_path / 'd.o').write_text('d.o')
+        new_objects = [objects[0], objects[2], str(tmp_path / 'd.o')]
+        _update_archive(ar, output_fpath, new_objects, thin=False)
+
+        ar.create.assert_not_called()
+        ar.delete.assert_called_once_with(output_fpath, ['b.o'])
+        ar.replace.assert_called_once_with(output_fpath, [objects[0], str(tmp_path / 'd.o')])
+
+        # and now it's up to date
+        ar.reset_mock()
+        _update_archive(ar, output_fpath, new_objects, thin=False)
+        assert not ar.method_calls
+
+    def test_thin(self, tmp_path, ar, objects):
+        # thin archives are recreated when anything changes, and switching type recreates the archive
+        output_fpath = tmp_path / 'out.a'
+        _update_archive(ar, output_fpath, objects, thin=True)
+        _update_archive(ar, output_fpath, objects, thin=True)
+        _update_archive(ar, output_fpath, objects[:2], thin=True)
+        _update_archive(ar, output_fpath, objects[:2], thin=False)
+        assert ar.create.call_args_list == [
+            call(output_fpath, objects, thin=True),
+            call(output_fpath, objects[:2], thin=True),
+            call(output_fpath, objects[:2], thin=False),
+        ]
+        ar.replace.assert_not_called()
+
+    def test_missing_object(self, tmp_path, ar, objects):
+        # no manifest is made, so the archive is always recreated
+        output_fpath = tmp_path / 'out.a'
+        objects.append(str(tmp_path / 'missing.o'))
+        _update_archive(ar, output_fpath, objects, thin=False)
+        _update_archive(ar, output_fpath, objects, thin=False)
+        assert ar.create.call_count == 2
+        assert not (tmp_path / 'out.a.manifest').exists()
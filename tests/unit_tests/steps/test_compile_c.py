@@ -14,9 +14,9 @@ from unittest import mock
 import pytest
 
 from fab.artefacts import ArtefactSet
-from fab.build_config import AddFlags, BuildConfig
+from fab.build_config import AddFlags, BuildConfig, FlagsConfig
 from fab.parse.c import AnalysedC
-from fab.steps.compile_c import _get_obj_combo_hash, _compile_file, compile_c
+from fab.steps.compile_c import _get_obj_combo_hash, _compile_batch, _compile_file, compile_c, MpCommonArgs
 from fab.tools import Category, Flags
 
 
@@ -94,6 +94,23 @@ class TestCompileC:
             None: {config.prebuild_folder / f'foo.{expect_hash:x}.o', }
         }
 
+    def test_shared_file(self, content):
+        '''A file in several build trees is only compiled once.'''
+        config, analysed_file, _ = content
+        config._artefact_store[ArtefactSet.BUILD_TREES] = {
+            'root1': {analysed_file.fpath: analysed_file},
+            'root2': {analysed_file.fpath: analysed_file},
+        }
+        compiler = config.tool_box[Category.C_COMPILER]
+        with mock.patch("fab.steps.compile_c.send_metric"), \
+                mock.patch('pathlib.Path.mkdir'):
+            compile_c(config=config)
+
+        compiler.run.assert_called_once()
+        object_files = config.artefact_store[ArtefactSet.OBJECT_FILES]
+        assert len(object_files['root1']) == 1
+        assert object_files['root1'] == object_files['root2']
+
     def test_exception_handling(self, content):
         '''Test exception handling if the compiler fails.'''
         config, _, _ = content
@@ -109,6 +126,46 @@ class TestCompileC:
         mock_send_metric.assert_not_called()
 
 
+class TestCompileBatch:
+    '''Test compiling several files in one compiler invocation.'''
+
+    @pytest.fixture
+    def files(self, content):
+        config = content[0]
+        return [AnalysedC(fpath=config.source_root / f'{name}.c', file_hash=i) for i, name in enumerate('abc')]
+
+    def test_vanilla(self, content, files):
+        '''The files without a prebuild are compiled together.'''
+        config = content[0]
+        compiler = config.tool_box[Category.C_COMPILER]
+        mp_payload = MpCommonArgs(config=config, flags=FlagsConfig(common_flags=['-O2']))
+
+        with mock.patch('fab.steps.compile_c.compile_batch', return_value=True) as mock_compile_batch, \
+                mock.patch('pathlib.Path.exists', side_effect=[False, False, True, True, True, True]), \
+                mock.patch('fab.steps.compile_c.send_metric'):
+            results = _compile_batch((files, mp_payload))
+
+        outputs = mock_compile_batch.call_args[0][1]
+        assert list(outputs) == [af.fpath for af in files[:2]]
+        assert [r.output_fpath for r in results[:2]] == list(outputs.values())
+        assert results[2].input_fpath == files[2].fpath
+        compiler.run.assert_not_called()
+
+    def test_failure(self, content, files):
+        '''Files are compiled individually when the batch fails.'''
+        config = content[0]
+        compiler = config.tool_box[Category.C_COMPILER]
+        mp_payload = MpCommonArgs(config=config, flags=FlagsConfig())
+
+        with mock.patch('fab.steps.compile_c.compile_batch', return_value=False), \
+                mock.patch('fab.steps.compile_c.send_metric'), \
+                mock.patch('pathlib.Path.mkdir'):
+            results = _compile_batch((files, mp_payload))
+
+        assert compiler.run.call_count == 3
+        assert [r.input_fpath for r in results] == [af.fpath for af in files]
+
+
 class TestGetObjComboHash:
     '''Tests the object combo hash functionality.'''
 
@@ -141,6 +198,23 @@ class TestGetObjComboHash:
         result = _get_obj_combo_hash(compiler, analysed_file, flags)
         assert result != expect_hash
 
+    def test_change_header(self, content, flags):
+        '''Test that a change in an included user header changes
+        the hash.'''
+        config, analysed_file, expect_hash = content
+        compiler = config.tool_box[Category.C_COMPILER]
+        analysed_file.header_deps = {Path('foo.h'): 123}
+        with_header = _get_obj_combo_hash(compiler, analysed_file, flags)
+        assert with_header != expect_hash
+
+        analysed_file.header_deps = {Path('foo.h'): 124}
+        result = _get_obj_combo_hash(compiler, analysed_file, flags)
+        assert result not in (expect_hash, with_header)
+
+        analysed_file.header_deps = {Path('bar.h'): 123}
+        result = _get_obj_combo_hash(compiler, analysed_file, flags)
+        assert result not in (expect_hash, with_header)
+
     def test_change_compiler(self, content, flags):
         '''Test that a change in the name of the compiler changes
         the hash.'''
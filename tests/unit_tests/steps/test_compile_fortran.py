@@ -7,11 +7,12 @@ import pytest
 
 from fab.artefacts import ArtefactSet, ArtefactStore
 from fab.build_config import BuildConfig, FlagsConfig
+from fab.compile_prediction import Prediction
 from fab.parse.fortran import AnalysedFortran
 from fab.steps.compile_fortran import (
-    compile_pass, get_compile_next,
-    get_mod_hashes, handle_compiler_args, MpCommonArgs, process_file,
-    store_artefacts)
+    compile_file, compile_fortran, compile_pass, compile_two_stage, CompileQueue,
+    get_mod_hashes, handle_compiler_args, MpCommonArgs, process_batch, process_file,
+    store_artefacts, _read_mod_hashes, _write_mod_hashes)
 from fab.tools import Category, ToolBox
 from fab.util import CompiledFile
 
@@ -63,13 +64,14 @@ class TestCompilePass:
     def test_vanilla(self, analysed_files, tool_box: ToolBox):
         # make sure it compiles b only
         a, b, c = analysed_files
-        uncompiled = {a, b}
+        compile_queue = CompileQueue([a, b], compiled=[c.fpath])
         compiled: Dict[Path, CompiledFile] = {c.fpath: mock.Mock(input_fpath=c.fpath)}
 
         run_mp_results = [
             (
                 mock.Mock(spec=CompiledFile, input_fpath=Path('b.f90')),
-                [Path('/prebuild/b.123.o')]
+                [Path('/prebuild/b.123.o')],
+                {'mod_b': 123},
             )
         ]
 
@@ -78,35 +80,158 @@ class TestCompilePass:
 
         config = BuildConfig('proj', tool_box)
         mp_common_args = MpCommonArgs(config, FlagsConfig(), {}, True)
-        with mock.patch('fab.steps.compile_fortran.run_mp', return_value=run_mp_results):
-            with mock.patch('fab.steps.compile_fortran.get_mod_hashes'):
-                uncompiled_result = compile_pass(config=config, compiled=compiled, uncompiled=uncompiled,
-                                                 mod_hashes=mod_hashes, mp_common_args=mp_common_args)
+        with mock.patch('fab.steps.compile_fortran.run_mp', return_value=run_mp_results) as mock_run_mp:
+            compile_pass(config=config, compiled=compiled, compile_queue=compile_queue,
+                         mod_hashes=mod_hashes, mp_common_args=mp_common_args)
 
+        assert [af for af, _ in mock_run_mp.call_args[1]['items']] == [b]
         assert Path('a.f90') not in compiled
         assert Path('b.f90') in compiled
-        assert list(uncompiled_result)[0].fpath == Path('a.f90')
+        assert len(compile_queue) == 1
+        assert compile_queue.next_pass() == [a]
+        assert mod_hashes == {'mod_b': 123}
+
+
+class TestCompileTwoStage:
+
+    @pytest.fixture
+    def chain_files(self):
+        # a program which uses mod_b, which uses mod_c
+        a = AnalysedFortran(fpath=Path('a.f90'), file_deps={Path('b.f90')}, file_hash=0)
+        a.add_module_dep('mod_b')
+        b = AnalysedFortran(fpath=Path('b.f90'), file_deps={Path('c.f90')}, file_hash=0)
+        b.add_module_def('mod_b')
+        b.add_module_dep('mod_c')
+        c = AnalysedFortran(fpath=Path('c.f90'), file_hash=0)
+        c.add_module_def('mod_c')
+        return a, b, c
+
+    @staticmethod
+    def fake_process_file(arg, batch_time=None):
+        af, mp_common_args = arg
+        if mp_common_args.syntax_only:
+            return (CompiledFile(af.fpath, Path(f'{af.fpath.stem}.o')), [Path(f'{af.fpath.stem}.mod')],
+                    {mod: 1 for mod in af.module_defs})
+        return CompiledFile(af.fpath, Path(f'{af.fpath.stem}.o')), [Path(f'{af.fpath.stem}.o')], {}
+
+    def test_pipelined(self, chain_files, tool_box: ToolBox):
+        # object compiles start as soon as a file's mods exist, and files without modules skip the first stage
+        a, b, c = chain_files
+        config = BuildConfig('proj', tool_box, multiprocessing=False)
+        mp_common_args = MpCommonArgs(config, FlagsConfig(), {}, True)
+        compiled: Dict[Path, CompiledFile] = {}
+
+        with mock.patch('fab.steps.compile_fortran.process_file', side_effect=self.fake_process_file) as mock_process, \
+                mock.patch.object(config, 'add_current_prebuilds') as mock_add_prebuilds:
+            compile_two_stage(config, compiled=compiled, compile_queue=CompileQueue([a, b, c]),
+                              mp_common_args=mp_common_args)
+
+        process_args = [process_call[0][0] for process_call in mock_process.call_args_list]
+        calls = [(af.fpath.name, args.syntax_only) for af, args in process_args]
+        assert calls == [
+            ('c.f90', True), ('b.f90', True), ('c.f90', False), ('b.f90', False), ('a.f90', False)]
+
+        # the object compiles are given the hashes of the mods they use
+        stage2_args = {af.fpath.name: args for af, args in process_args if not args.syntax_only}
+        assert stage2_args['b.f90'].mod_hashes == {'mod_c': 1}
+        assert stage2_args['a.f90'].mod_hashes == {'mod_b': 1}
+        assert all(args.two_stage for args in stage2_args.values())
+
+        assert set(compiled) == {a.fpath, b.fpath, c.fpath}
+        assert mp_common_args.mod_hashes == {'mod_b': 1, 'mod_c': 1}
+        assert sorted(mock_add_prebuilds.call_args[0][0]) == [
+            Path('a.o'), Path('b.mod'), Path('b.o'), Path('c.mod'), Path('c.o')]
+
+    def test_error(self, chain_files, tool_box):
+        # nothing new is started after an error
+        a, b, c = chain_files
+        config = BuildConfig('proj', tool_box, multiprocessing=False)
+        mp_common_args = MpCommonArgs(config, FlagsConfig(), {}, True)
+
+        with mock.patch('fab.steps.compile_fortran.process_file',
+                        return_value=(Exception('bad c'), None, None)) as mock_process, \
+                pytest.raises(RuntimeError, match='bad c'):
+            compile_two_stage(config, compiled={}, compile_queue=CompileQueue([a, b, c]),
+                              mp_common_args=mp_common_args)
+        mock_process.assert_called_once()
+
+
+class TestTwoStageAuto:
+
+    @pytest.mark.parametrize('prediction, two_stage', [
+        (Prediction(single_stage=1.0, two_stage=2.0), False),
+        (Prediction(single_stage=2.0, two_stage=1.0), True),
+    ])
+    def test_choice(self, tool_box, prediction, two_stage):
+        # the strategy predicted to be faster is used
+        tool_box[Category.FORTRAN_COMPILER]._syntax_only_flag = '-fsyntax-only'
+        config = BuildConfig('proj', tool_box, two_stage='auto', multiprocessing=False)
+        config.artefact_store[ArtefactSet.BUILD_TREES] = {None: {}}
+
+        with mock.patch('fab.steps.compile_fortran.predict_two_stage', return_value=prediction), \
+                mock.patch('fab.steps.compile_fortran.compile_two_stage') as mock_two_stage, \
+                mock.patch('fab.steps.compile_fortran.send_metric') as mock_send_metric, \
+                pytest.warns(UserWarning, match="_metric_send_conn not set"):
+            compile_fortran(config)
+
+        assert mock_two_stage.called == two_stage
+        assert mock_send_metric.call_args[1]['value']['chosen'] == ('two_stage' if two_stage else 'single_stage')
 
+    def test_no_syntax_only(self, tool_box):
+        # there's nothing to predict if the compiler can't do it
+        config = BuildConfig('proj', tool_box, two_stage='auto', multiprocessing=False)
+        config.artefact_store[ArtefactSet.BUILD_TREES] = {None: {}}
 
-class TestGetCompileNext:
+        with mock.patch('fab.steps.compile_fortran.predict_two_stage') as mock_predict, \
+                pytest.warns(UserWarning, match="_metric_send_conn not set"):
+            compile_fortran(config)
+        mock_predict.assert_not_called()
+
+
+class TestCompileQueue:
 
     def test_vanilla(self, analysed_files):
         a, b, c = analysed_files
-        uncompiled = {a, b}
-        compiled = {c.fpath: mock.Mock(input_fpath=c.fpath)}
+        compile_queue = CompileQueue([a, b], compiled=[c.fpath])
 
-        compile_next = get_compile_next(compiled, uncompiled)
+        assert len(compile_queue) == 2
+        assert compile_queue.next_pass() == [b]
+        assert compile_queue.next_pass() == []
+
+    def test_passes(self, analysed_files):
+        a, b, c = analysed_files
+        d = AnalysedFortran(fpath=Path('d.f90'), file_deps={Path('b.f90'), Path('c.f90')}, file_hash=0)
+        compile_queue = CompileQueue([a, b, c, d])
 
-        assert compile_next == {b}
+        passes = []
+        while compile_queue:
+            compile_next = compile_queue.next_pass()
+            passes.append({af.fpath for af in compile_next})
+            compile_queue.done(af.fpath for af in compile_next)
+
+        assert passes == [{c.fpath}, {b.fpath}, {a.fpath, d.fpath}]
 
     def test_unable_to_compile_anything(self, analysed_files):
         # like vanilla, except c hasn't been compiled
         a, b, _ = analysed_files
-        to_compile = {a, b}
-        already_compiled_files = {}
 
         with pytest.raises(ValueError):
-            get_compile_next(already_compiled_files, to_compile)
+            CompileQueue([a, b])
+
+    def test_cycle(self, analysed_files):
+        # c is fine, but a and b depend on each other
+        a, b, c = analysed_files
+        a = AnalysedFortran(fpath=Path('a.f90'), file_deps={Path('b.f90'), Path('c.f90')}, file_hash=0)
+        b = AnalysedFortran(fpath=Path('b.f90'), file_deps={Path('a.f90')}, file_hash=0)
+
+        with pytest.raises(ValueError) as err:
+            CompileQueue([a, b, c])
+        assert 'circular' in str(err.value)
+        assert 'c.f90' not in str(err.value)
+
+    def test_ignores_other_languages(self):
+        af = AnalysedFortran(fpath=Path('a.f90'), file_deps={Path('b.c')}, file_hash=0)
+        assert CompileQueue([af]).next_pass() == [af]
 
 
 class TestStoreArtefacts:
@@ -173,6 +298,15 @@ def fixture_content(tool_box):
 
 class TestProcessFile:
 
+    @pytest.fixture(autouse=True)
+    def mock_mod_hashes(self):
+        # the mod files aren't really created, so we can't hash them
+        mod_hashes = {'mod_def_1': 1, 'mod_def_2': 2}
+        with mock.patch('fab.steps.compile_fortran.get_mod_hashes', return_value=mod_hashes), \
+             mock.patch('fab.steps.compile_fortran._read_mod_hashes', return_value=mod_hashes), \
+             mock.patch('fab.steps.compile_fortran._write_mod_hashes'):
+            yield
+
     # Developer's note: If the "mods combo hash" changes you'll get an unhelpful message from pytest.
     # It'll come from this function but pytest won't tell you that.
     # You'll have to set a breakpoint here to see the changed hash in calls to mock_copy.
@@ -211,7 +345,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         # check we got the expected compilation result
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
@@ -229,8 +363,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_with_prebuild(self, content):
         # If the mods and obj are prebuilt, don't compile.
@@ -240,7 +376,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -252,8 +388,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_file_hash(self, content):
         # Changing the source hash must change the combo hash for the mods and obj.
@@ -269,7 +407,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -282,8 +420,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_flags_hash(self, content):
         # changing the flags must change the object combo hash, but not the mods combo hash
@@ -296,7 +436,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -309,8 +449,26 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
+
+    def test_include_hash(self, content):
+        # Changing a file included by the source must change both the mods and object combo hashes.
+        mp_common_args, flags, analysed_file, obj_combo_hash, mods_combo_hash = content
+
+        with mock.patch('fab.steps.compile_fortran.find_includes', return_value={Path('foo.inc'): 1}) as mock_find, \
+             mock.patch('pathlib.Path.exists', return_value=False), \
+             mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file, \
+             mock.patch('shutil.copy2'), \
+             pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
+            res, artefacts, _ = process_file((analysed_file, mp_common_args))
+
+        mock_find.assert_called_once_with(analysed_file.fpath, [])
+        mock_compile_file.assert_called_once()
+        assert res.output_fpath.name != f'foofile.{obj_combo_hash}.o'
+        assert mp_common_args.config.prebuild_folder / f'mod_def_1.{mods_combo_hash}.mod' not in artefacts
 
     def test_deps_hash(self, content):
         # Changing the checksums of any mod dependency must change the object combo hash but not the mods combo hash.
@@ -325,7 +483,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         mock_compile_file.assert_called_once_with(
@@ -338,8 +496,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_compiler_hash(self, content):
         # changing the compiler must change the combo hash for the mods and obj
@@ -356,7 +516,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -369,8 +529,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_compiler_version_hash(self, content):
         # changing the compiler version must change the combo hash for the mods and obj
@@ -387,7 +549,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -400,8 +562,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_mod_missing(self, content):
         # if one of the mods we define is not present, we must recompile
@@ -411,7 +575,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -424,8 +588,10 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
 
     def test_obj_missing(self, content):
         # the object file we define is not present, so we must recompile
@@ -435,7 +601,7 @@ class TestProcessFile:
             with mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file:
                 with mock.patch('shutil.copy2') as mock_copy, \
                      pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
-                    res, artefacts = process_file((analysed_file, mp_common_args))
+                    res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
 
         expect_object_fpath = Path(f'/fab/proj/build_output/_prebuild/foofile.{obj_combo_hash}.o')
         assert res == CompiledFile(input_fpath=analysed_file.fpath, output_fpath=expect_object_fpath)
@@ -448,8 +614,138 @@ class TestProcessFile:
         assert set(artefacts) == {
             pb / f'foofile.{obj_combo_hash}.o',
             pb / f'mod_def_2.{mods_combo_hash}.mod',
-            pb / f'mod_def_1.{mods_combo_hash}.mod'
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
+        }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
+
+
+class TestProcessFileTwoStage:
+    '''Each stage of a two-stage compile has its own prebuilds.'''
+
+    @pytest.fixture(autouse=True)
+    def mock_mod_hashes(self):
+        mod_hashes = {'mod_def_1': 1, 'mod_def_2': 2}
+        with mock.patch('fab.steps.compile_fortran.get_mod_hashes', return_value=mod_hashes), \
+             mock.patch('fab.steps.compile_fortran._read_mod_hashes', return_value=mod_hashes), \
+             mock.patch('fab.steps.compile_fortran._write_mod_hashes'):
+            yield
+
+    def test_stage1_prebuild(self, content):
+        # the mod files exist, so there's no need for the object file
+        mp_common_args, _, analysed_file, _, mods_combo_hash = content
+        mp_common_args.syntax_only = mp_common_args.two_stage = True
+
+        with mock.patch('pathlib.Path.exists', side_effect=[True, True]) as mock_exists, \
+                mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file, \
+                mock.patch('shutil.copy2'), \
+                pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
+            _, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
+
+        assert mock_exists.call_count == 2
+        mock_compile_file.assert_not_called()
+        pb = mp_common_args.config.prebuild_folder
+        assert set(artefacts) == {
+            pb / f'mod_def_1.{mods_combo_hash}.mod',
+            pb / f'mod_def_2.{mods_combo_hash}.mod',
+            pb / f'foofile.{mods_combo_hash}.modhash',
         }
+        assert mod_hashes == {'mod_def_1': 1, 'mod_def_2': 2}
+
+    @pytest.mark.parametrize('exists', [False, True])
+    def test_stage2(self, content, exists):
+        # only the object file matters, and the mod files are left alone
+        mp_common_args, flags, analysed_file, obj_combo_hash, _ = content
+        mp_common_args.two_stage = True
+
+        with mock.patch('pathlib.Path.exists', side_effect=[exists]), \
+                mock.patch('fab.steps.compile_fortran.compile_file') as mock_compile_file, \
+                mock.patch('shutil.copy2') as mock_copy, \
+                pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
+            res, artefacts, mod_hashes = process_file((analysed_file, mp_common_args))
+
+        assert mock_compile_file.called != exists
+        mock_copy.assert_not_called()
+        expect_object_fpath = mp_common_args.config.prebuild_folder / f'foofile.{obj_combo_hash}.o'
+        assert res.output_fpath == expect_object_fpath
+        assert artefacts == [expect_object_fpath]
+        assert mod_hashes == {}
+
+
+class TestCompileFileModuleFolder:
+    '''The object compile of a two-stage build doesn't write to the module folder.'''
+
+    @pytest.fixture
+    def mp_common_args(self, tool_box):
+        config = BuildConfig('proj', tool_box, fab_workspace=Path('/fab'))
+        return MpCommonArgs(config=config, flags=FlagsConfig(), mod_hashes={}, syntax_only=False, two_stage=True)
+
+    def compile(self, mp_common_args, tmp_path):
+        compiler = mp_common_args.config.tool_box[Category.FORTRAN_COMPILER]
+        with mock.patch.object(compiler, 'compile_file') as mock_compile_file:
+            compile_file(Path('foo.f90'), [], output_fpath=tmp_path / 'foo.o', mp_common_args=mp_common_args)
+        return mock_compile_file.call_args[1]['module_folder']
+
+    def test_stage1(self, mp_common_args, tmp_path):
+        mp_common_args.syntax_only = True
+        assert self.compile(mp_common_args, tmp_path) is None
+
+    def test_stage2(self, mp_common_args, tmp_path):
+        module_folder = self.compile(mp_common_args, tmp_path)
+        assert module_folder is not None
+        assert module_folder != mp_common_args.config.build_output
+        # the throwaway folder is removed after the compile
+        assert not module_folder.exists()
+
+    def test_single_stage(self, mp_common_args, tmp_path):
+        mp_common_args.two_stage = False
+        assert self.compile(mp_common_args, tmp_path) is None
+
+
+class TestProcessBatch:
+
+    @pytest.fixture
+    def mp_common_args(self, tool_box):
+        config = BuildConfig('proj', tool_box, fab_workspace=Path('/fab'))
+        return MpCommonArgs(config=config, flags=FlagsConfig(), mod_hashes={}, syntax_only=False)
+
+    def test_vanilla(self, analysed_files, mp_common_args):
+        # a and b have no prebuild, so they're compiled together
+        a, b, c = analysed_files
+        with mock.patch('pathlib.Path.exists', side_effect=[False, False, True, True, True]), \
+                mock.patch('fab.steps.compile_fortran.compile_batch', return_value=True) as mock_compile_batch, \
+                mock.patch('fab.steps.compile_fortran.process_file') as mock_process_file:
+            process_batch(([a, b, c], mp_common_args))
+
+        assert list(mock_compile_batch.call_args[0][1]) == [a.fpath, b.fpath]
+        batch_times = [call[1]['batch_time'] for call in mock_process_file.call_args_list]
+        assert batch_times[0] is not None and batch_times[1] is not None
+        assert batch_times[2] is None
+
+    def test_failure(self, analysed_files, mp_common_args):
+        # the files are compiled individually when the batch fails
+        a, b, _ = analysed_files
+        with mock.patch('pathlib.Path.exists', return_value=False), \
+                mock.patch('fab.steps.compile_fortran.compile_batch', return_value=False), \
+                mock.patch('fab.steps.compile_fortran.process_file') as mock_process_file:
+            process_batch(([a, b], mp_common_args))
+
+        assert [c.args for c in mock_process_file.call_args_list] == [((a, mp_common_args),), ((b, mp_common_args),)]
+        assert [c.kwargs['batch_time'] for c in mock_process_file.call_args_list] == [None, None]
+
+    def test_prebuild_paths_once(self, analysed_files, mp_common_args):
+        # finding the prebuild paths reads the file and its includes, so it's only done once per file
+        a, b, _ = analysed_files
+        with mock.patch('pathlib.Path.exists', return_value=False), \
+                mock.patch('fab.steps.compile_fortran.compile_batch', return_value=False), \
+                mock.patch('fab.steps.compile_fortran.find_includes', return_value={}) as mock_find_includes, \
+                mock.patch('fab.steps.compile_fortran.compile_file'), \
+                mock.patch('fab.steps.compile_fortran.get_mod_hashes', return_value={}), \
+                mock.patch('fab.steps.compile_fortran.send_metric'):
+            results = process_batch(([a, b], mp_common_args))
+
+        assert mock_find_includes.call_count == 2
+        assert [result[0].input_fpath for result in results] == [a.fpath, b.fpath]
 
 
 class TestGetModHashes:
@@ -472,3 +768,28 @@ class TestGetModHashes:
                 result = get_mod_hashes(analysed_files=analysed_files, config=config)
 
         assert result == {'foo': 123, 'bar': 456}
+
+
+class TestStoredModHashes:
+
+    def test_round_trip(self, tmp_path):
+        analysed_file = AnalysedFortran(fpath=Path('foo.f90'), module_defs={'foo', 'bar'}, symbol_defs={'foo', 'bar'},
+                                        file_hash=0)
+        fpath = tmp_path / 'foo.123.modhash'
+        _write_mod_hashes({'foo': 1, 'bar': 2}, fpath)
+        assert _read_mod_hashes(fpath, analysed_file) == {'foo': 1, 'bar': 2}
+
+    def test_missing(self, tmp_path):
+        analysed_file = AnalysedFortran(fpath=Path('foo.f90'), module_defs={'foo'}, symbol_defs={'foo'}, file_hash=0)
+        assert _read_mod_hashes(tmp_path / 'foo.123.modhash', analysed_file) is None
+
+    def test_incomplete(self, tmp_path):
+        analysed_file = AnalysedFortran(fpath=Path('foo.f90'), module_defs={'foo', 'bar'}, symbol_defs={'foo', 'bar'},
+                                        file_hash=0)
+        fpath = tmp_path / 'foo.123.modhash'
+        _write_mod_hashes({'foo': 1}, fpath)
+        assert _read_mod_hashes(fpath, analysed_file) is None
+
+    def test_no_modules(self, tmp_path):
+        analysed_file = AnalysedFortran(fpath=Path('foo.f90'), file_hash=0)
+        assert _read_mod_hashes(tmp_path / 'foo.123.modhash', analysed_file) == {}
@@ -9,7 +9,7 @@ from unittest import mock
 
 from fab.artefacts import ArtefactSet, ArtefactStore
 from fab.steps.link import link_exe
-from fab.tools import Linker
+from fab.tools import Category, Linker
 
 import pytest
 
@@ -43,3 +43,131 @@ class TestLinkExe:
             ['mock_link.exe', '-L/foo1/lib', '-L/foo2/lib', 'bar.o', 'foo.o',
              '-fooflag', '-barflag', '-o', 'workspace/foo'],
             capture_output=True, env=None, cwd=None, check=False)
+
+
+class TestLinkPrebuild:
+
+    @pytest.fixture
+    def config(self, tmp_path, tool_box):
+        (tmp_path / 'foo.o').write_text('foo')
+        (tmp_path / 'bar.o').write_text('bar')
+        config = SimpleNamespace(
+            project_workspace=tmp_path,
+            prebuild_folder=tmp_path / '_prebuild',
+            artefact_store=ArtefactStore(),
+            tool_box=tool_box,
+            add_current_prebuilds=mock.Mock(),
+        )
+        config.artefact_store[ArtefactSet.OBJECT_FILES] = {
+            'foo': {tmp_path / 'foo.o', tmp_path / 'bar.o'}}
+        return config
+
+    def _link(self, config, flags=None):
+        # the mock linker writes the executable
+        def fake_link(objects, output_fpath, add_libs):
+            output_fpath.write_text(' '.join(sorted(map(str, objects))))
+
+        linker = config.tool_box.get_tool(Category.LINKER)
+        with mock.patch.object(linker, 'link', side_effect=fake_link) as mock_link, \
+                mock.patch('fab.steps.link.send_metric') as mock_send_metric:
+            link_exe(config, flags=flags or [])
+        return mock_link, mock_send_metric
+
+    def test_relink_skipped(self, config):
+        mock_link, mock_send_metric = self._link(config)
+        mock_link.assert_called_once()
+        assert mock_send_metric.call_args[1]['value']['prebuild'] is False
+        prebuild_fpaths = list(config.prebuild_folder.iterdir())
+        assert len(prebuild_fpaths) == 1
+        assert prebuild_fpaths[0].name.startswith('foo.')
+        assert prebuild_fpaths[0].suffix == '.exe'
+        config.add_current_prebuilds.assert_called_with(prebuild_fpaths)
+
+        # the executable is restored from the prebuild
+        exe_fpath = config.project_workspace / 'foo'
+        exe_fpath.unlink()
+        mock_link, mock_send_metric = self._link(config)
+        mock_link.assert_not_called()
+        assert mock_send_metric.call_args[1]['value']['prebuild'] is True
+        assert exe_fpath.read_text() == prebuild_fpaths[0].read_text()
+
+    def test_changed_input(self, config):
+        self._link(config)
+        (config.project_workspace / 'bar.o').write_text('changed')
+        mock_link, _ = self._link(config)
+        mock_link.assert_called_once()
+        assert len(list(config.prebuild_folder.iterdir())) == 2
+
+    def test_changed_flags(self, config):
+        self._link(config)
+        mock_link, _ = self._link(config, flags=['-g'])
+        mock_link.assert_called_once()
+        assert len(list(config.prebuild_folder.iterdir())) == 2
+
+    def test_changed_library(self, config):
+        # rebuilding an external library forces a relink
+        lib_dir = config.project_workspace / 'lib'
+        lib_dir.mkdir()
+        (lib_dir / 'libfoo.a').write_text('foo')
+        flags = [f'-L{lib_dir}', '-lfoo']
+        self._link(config, flags=flags)
+        mock_link, _ = self._link(config, flags=flags)
+        mock_link.assert_not_called()
+
+        (lib_dir / 'libfoo.a').write_text('changed')
+        mock_link, _ = self._link(config, flags=flags)
+        mock_link.assert_called_once()
+        assert len(list(config.prebuild_folder.iterdir())) == 2
+
+    def test_changed_library_path(self, config):
+        lib_fpath = config.project_workspace / 'libbar.a'
+        lib_fpath.write_text('bar')
+        self._link(config, flags=[str(lib_fpath)])
+        lib_fpath.write_text('changed')
+        mock_link, _ = self._link(config, flags=[str(lib_fpath)])
+        mock_link.assert_called_once()
+        assert len(list(config.prebuild_folder.iterdir())) == 2
+
+    def test_missing_library(self, config):
+        # we can't tell if an unknown library has changed, so we always link
+        mock_link, mock_send_metric = self._link(config, flags=['-lno_such_lib_for_fab'])
+        mock_link.assert_called_once()
+        assert mock_send_metric.call_args[1]['value']['prebuild'] is False
+        assert not config.prebuild_folder.exists()
+        config.add_current_prebuilds.assert_not_called()
+
+
+class TestLinkParallel:
+
+    def test_targets(self, tool_box):
+        # independent executables are linked together, with the link step's own process limit
+        config = SimpleNamespace(
+            project_workspace=Path('workspace'),
+            artefact_store=ArtefactStore(),
+            tool_box=tool_box,
+            add_current_prebuilds=mock.Mock(),
+        )
+        config.artefact_store[ArtefactSet.OBJECT_FILES] = {'foo': {'foo.o'}, 'bar': {'bar.o'}}
+
+        with mock.patch('fab.steps.link.run_mp', return_value=[None, None]) as mock_run_mp, \
+                pytest.warns(UserWarning, match="_metric_send_conn not set"):
+            link_exe(config, n_procs=2)
+
+        mock_run_mp.assert_called_once()
+        items = mock_run_mp.call_args[0][1]
+        assert sorted(item[3] for item in items) == [Path('workspace/bar'), Path('workspace/foo')]
+        assert mock_run_mp.call_args[1] == {'no_multiprocessing': False, 'n_procs': 2}
+        assert config.artefact_store[ArtefactSet.EXECUTABLES] == {Path('workspace/bar'), Path('workspace/foo')}
+        config.add_current_prebuilds.assert_not_called()
+
+    def test_error(self, tool_box):
+        config = SimpleNamespace(
+            project_workspace=Path('workspace'),
+            artefact_store=ArtefactStore(),
+            tool_box=tool_box,
+        )
+        config.artefact_store[ArtefactSet.OBJECT_FILES] = {'foo': {'foo.o'}, 'bar': {'bar.o'}}
+
+        with mock.patch('fab.steps.link.run_mp', return_value=[None, RuntimeError('link failed')]), \
+                pytest.raises(RuntimeError, match='link failed'):
+            link_exe(config)
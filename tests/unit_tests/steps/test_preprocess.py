@@ -8,9 +8,11 @@ from unittest import mock
 
 import pytest
 
-from fab.build_config import BuildConfig
-from fab.steps.preprocess import preprocess_fortran
+from fab.build_config import BuildConfig, FlagsConfig
+from fab.steps.preprocess import MpCommonArgs, _copy_f90, preprocess_fortran, process_artefact
+from fab.artefacts import ArtefactSet
 from fab.tools import Category, ToolBox
+from fab.tools.cpp_engine import CppEngine, UnsupportedPreprocessing
 
 
 class Test_preprocess_fortran:
@@ -26,7 +28,7 @@ class Test_preprocess_fortran:
             return [big_f90, little_f90]
 
         with mock.patch('fab.steps.preprocess.pre_processor') as mock_pp:
-            with mock.patch('shutil.copyfile') as mock_copy:
+            with mock.patch('fab.steps.preprocess._copy_f90', return_value=0) as mock_copy:
                 with config:
                     preprocess_fortran(config=config, source=source_getter)
 
@@ -38,9 +40,10 @@ class Test_preprocess_fortran:
             output_collection=mock.ANY,
             output_suffix='.f90',
             name='preprocess fortran',
+            engine=None,
         )
 
-        mock_copy.assert_called_once_with(str(little_f90), mock.ANY)
+        mock_copy.assert_called_once_with((little_f90, mock.ANY, 'copy'))
 
         # Now test that an incorrect preprocessor is detected:
         tool_box = config.tool_box
@@ -57,3 +60,148 @@ class Test_preprocess_fortran:
         assert ("Unexpected tool 'cpp' of type '<class "
                 "'fab.tools.preprocessor.Cpp'>' instead of CppFortran"
                 in str(err.value))
+
+    def test_little_f90s(self, tmp_path):
+        # little f90s are copied in parallel, and the bytes copied are reported
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path, n_procs=2)
+        config.source_root.mkdir(parents=True)
+        little_f90s = [config.source_root / f'little{i}.f90' for i in range(3)]
+        for little_f90 in little_f90s:
+            little_f90.write_text('program little\nend program little\n')
+
+        with mock.patch('fab.steps.preprocess.pre_processor'), \
+                mock.patch('fab.steps.preprocess.send_metric') as mock_send_metric:
+            with config:
+                preprocess_fortran(config=config, source=lambda artefact_store: little_f90s)
+                preprocess_fortran(config=config, source=lambda artefact_store: little_f90s)
+
+        assert [call[0][2]['bytes_copied'] for call in mock_send_metric.call_args_list] == [3 * 34, 0]
+        assert config.artefact_store[ArtefactSet.FORTRAN_BUILD_FILES] == {
+            config.build_output / f'little{i}.f90' for i in range(3)}
+
+    def test_unknown_copy_method(self, tmp_path):
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+        with pytest.raises(ValueError, match="unknown copy method 'rsync'"):
+            preprocess_fortran(config=config, copy_method='rsync')
+
+    def test_unknown_engine(self, tmp_path):
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path)
+        with pytest.raises(ValueError, match="unknown preprocessor engine 'fpp'"):
+            preprocess_fortran(config=config, engine='fpp')
+
+
+class TestProcessArtefactPrebuild:
+
+    @pytest.fixture
+    def args(self, tmp_path):
+        config = BuildConfig('proj', ToolBox(), fab_workspace=tmp_path, multiprocessing=False)
+        config.source_root.mkdir(parents=True)
+        (config.source_root / 'foo.inc').write_text('integer :: a\n')
+        (config.source_root / 'foo.F90').write_text('#include "foo.inc"\n')
+
+        def fake_preprocess(input_fpath, output_fpath, params):
+            output_fpath.write_text(input_fpath.read_text().upper())
+
+        preprocessor = mock.Mock(preprocess=mock.Mock(side_effect=fake_preprocess))
+        return MpCommonArgs(config=config, output_suffix='.f90', preprocessor=preprocessor,
+                            flags=FlagsConfig(), name='preprocess fortran', preprocessor_hash=123)
+
+    def run(self, args):
+        with pytest.warns(UserWarning, match="_metric_send_conn not set, cannot send metrics"):
+            return process_artefact((args.config.source_root / 'foo.F90', args))
+
+    def test_reuse(self, args):
+        # the second run restores the output from the prebuild
+        output_fpath, prebuild_fpath = self.run(args)
+        assert output_fpath == args.config.build_output / 'foo.f90'
+        assert prebuild_fpath.parent == args.config.prebuild_folder
+        assert prebuild_fpath.read_text() == output_fpath.read_text() == '#INCLUDE "FOO.INC"\n'
+
+        output_fpath.unlink()
+        assert self.run(args) == (output_fpath, prebuild_fpath)
+        assert output_fpath.read_text() == '#INCLUDE "FOO.INC"\n'
+        args.preprocessor.preprocess.assert_called_once()
+
+    def test_include_changed(self, args):
+        _, prebuild_fpath = self.run(args)
+        (args.config.source_root / 'foo.inc').write_text('integer :: b\n')
+        _, new_prebuild_fpath = self.run(args)
+        assert new_prebuild_fpath != prebuild_fpath
+        assert args.preprocessor.preprocess.call_count == 2
+
+    def test_preprocessor_changed(self, args):
+        _, prebuild_fpath = self.run(args)
+        args.preprocessor_hash += 1
+        _, new_prebuild_fpath = self.run(args)
+        assert new_prebuild_fpath != prebuild_fpath
+        assert args.preprocessor.preprocess.call_count == 2
+
+    def test_engine(self, args):
+        # the engine is used instead of the preprocessor
+        args.engine = mock.Mock(spec=CppEngine)
+        args.engine.preprocess.side_effect = lambda input_fpath, output_fpath, params: output_fpath.write_text('')
+        self.run(args)
+        args.engine.preprocess.assert_called_once()
+        args.preprocessor.preprocess.assert_not_called()
+
+    def test_engine_fallback(self, args):
+        # the preprocessor is used for files the engine can't do
+        args.engine = mock.Mock(spec=CppEngine)
+        args.engine.preprocess.side_effect = UnsupportedPreprocessing('function-like macro')
+        output_fpath, _ = self.run(args)
+        args.preprocessor.preprocess.assert_called_once()
+        assert output_fpath.read_text() == '#INCLUDE "FOO.INC"\n'
+
+    def test_unchanged_output(self, args):
+        # an output with the same content is not replaced, when restored or preprocessed again
+        output_fpath, _ = self.run(args)
+        inode = output_fpath.stat().st_ino
+        self.run(args)
+        args.preprocessor_hash += 1
+        self.run(args)
+        assert output_fpath.stat().st_ino == inode
+        assert args.preprocessor.preprocess.call_count == 2
+
+
+class TestCopyF90:
+
+    @pytest.fixture
+    def f90(self, tmp_path):
+        f90 = tmp_path / 'source' / 'little.f90'
+        f90.parent.mkdir()
+        f90.write_text('program little\nend program little\n')
+        return f90
+
+    def test_copy(self, tmp_path, f90):
+        output_path = tmp_path / 'build_output' / 'little.f90'
+        assert _copy_f90((f90, output_path, 'copy')) == 34
+        assert output_path.read_text() == f90.read_text()
+        # unchanged, so not copied again
+        assert _copy_f90((f90, output_path, 'copy')) == 0
+
+    def test_hardlink(self, tmp_path, f90):
+        output_path = tmp_path / 'build_output' / 'little.f90'
+        assert _copy_f90((f90, output_path, 'hardlink')) == 0
+        assert output_path.samefile(f90)
+
+    def test_hardlink_fails(self, tmp_path, f90):
+        # e.g. when the build output is on a different file system
+        output_path = tmp_path / 'build_output' / 'little.f90'
+        with mock.patch('os.link', side_effect=OSError('cross-device link')):
+            assert _copy_f90((f90, output_path, 'hardlink')) == 34
+        assert not output_path.samefile(f90)
+
+    def test_symlink(self, tmp_path, f90):
+        output_path = tmp_path / 'build_output' / 'little.f90'
+        assert _copy_f90((f90, output_path, 'symlink')) == 0
+        assert output_path.is_symlink()
+        assert output_path.resolve() == f90.resolve()
+
+    @pytest.mark.parametrize('copy_method', ['hardlink', 'symlink'])
+    def test_replace_link(self, tmp_path, f90, copy_method):
+        # a link from a previous build is replaced by a copy, so the copy can't change the source
+        output_path = tmp_path / 'build_output' / 'little.f90'
+        _copy_f90((f90, output_path, copy_method))
+        assert _copy_f90((f90, output_path, 'copy')) == 34
+        assert not output_path.is_symlink()
+        assert not output_path.samefile(f90)
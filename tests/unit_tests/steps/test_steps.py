@@ -1,6 +1,50 @@
+from unittest import mock
+
 import pytest
 
-from fab.steps import check_for_errors
+from fab.steps import check_for_errors, run_mp, run_mp_dynamic
+
+
+class Test_run_mp(object):
+
+    @pytest.mark.parametrize('n_procs, expected', [(None, 8), (2, 2), (16, 8)])
+    def test_n_procs(self, n_procs, expected):
+        # the pool size can be limited, but not raised above the config's n_procs
+        config = mock.Mock(multiprocessing=True, n_procs=8)
+        with mock.patch('fab.steps.multiprocessing.Pool') as mock_pool:
+            mock_pool.return_value.__enter__.return_value.map.return_value = ['result']
+            assert run_mp(config, ['item'], str, n_procs=n_procs) == ['result']
+        mock_pool.assert_called_once_with(expected)
+
+    def test_no_multiprocessing(self):
+        config = mock.Mock(multiprocessing=True, n_procs=8)
+        with mock.patch('fab.steps.multiprocessing.Pool') as mock_pool:
+            assert run_mp(config, [1, 2], str, no_multiprocessing=True) == ['1', '2']
+        mock_pool.assert_not_called()
+
+
+class Test_run_mp_dynamic(object):
+
+    @pytest.mark.parametrize('multiprocessing', [False, True])
+    def test_new_items(self, multiprocessing):
+        # each result makes the next item, until we've done enough
+        config = mock.Mock(multiprocessing=multiprocessing, n_procs=2)
+        results = []
+
+        def handler(result):
+            results.append(result)
+            return [-(abs(result) + 1)] if abs(result) < 3 else []
+
+        run_mp_dynamic(config, [-1, -10], abs, handler)
+        assert sorted(results) == [1, 2, 3, 10]
+
+    def test_exception(self):
+        # exceptions in the workers are passed to the handler
+        config = mock.Mock(multiprocessing=True, n_procs=2)
+        results = []
+        run_mp_dynamic(config, ['x'], int, lambda result: results.append(result) or [])
+        assert len(results) == 1
+        assert isinstance(results[0], ValueError)
 
 
 class Test_check_for_errors(object):
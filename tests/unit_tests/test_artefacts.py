@@ -7,8 +7,9 @@ from pathlib import Path
 import pytest
 
 from fab.artefacts import (ArtefactSet, ArtefactStore, ArtefactsGetter,
-                           CollectionConcat, CollectionGetter,
+                           BuildPlan, CollectionConcat, CollectionGetter,
                            FilterBuildTrees, SuffixFilter)
+from fab.dep_tree import AnalysedDependent
 
 
 def test_artefact_store() -> None:
@@ -177,6 +178,51 @@ class TestFilterBuildTrees():
         ])
 
 
+class TestBuildPlan():
+    '''Tests for BuildPlan.'''
+
+    @pytest.fixture
+    def build_lists(self):
+        '''Two targets which share a file.'''
+        shared = AnalysedDependent(fpath=Path('shared.f90'), file_hash=0)
+        return {
+            'root1': [AnalysedDependent(fpath=Path('root1.f90'), file_hash=0), shared],
+            'root2': [AnalysedDependent(fpath=Path('root2.f90'), file_hash=0), shared],
+        }
+
+    def test_unique_units(self, build_lists) -> None:
+        '''Files shared between targets are held once.'''
+        build_plan = BuildPlan(build_lists)
+        assert [u.fpath for u in build_plan.units] == [
+            Path('root1.f90'), Path('shared.f90'), Path('root2.f90')]
+        assert len(build_plan) == 3
+        assert build_plan.targets == ['root1', 'root2']
+
+    def test_membership(self, build_lists) -> None:
+        '''Each target knows its files, and each file its targets.'''
+        build_plan = BuildPlan(build_lists)
+        assert build_plan.target_units('root1') == build_lists['root1']
+        assert set(build_plan.target_units('root2')) == set(build_lists['root2'])
+        assert build_plan.unit_targets(Path('shared.f90')) == ['root1', 'root2']
+        assert build_plan.unit_targets(Path('root1.f90')) == ['root1']
+
+    def test_target_outputs(self, build_lists) -> None:
+        '''Outputs are distributed to the targets which need them.'''
+        build_plan = BuildPlan(build_lists)
+        outputs = {Path('root1.f90'): Path('root1.o'), Path('root2.f90'): Path('root2.o'),
+                   Path('shared.f90'): Path('shared.o')}
+        assert build_plan.target_outputs(outputs) == {
+            'root1': [Path('root1.o'), Path('shared.o')],
+            'root2': [Path('shared.o'), Path('root2.o')],
+        }
+
+    def test_from_build_lists(self, build_lists) -> None:
+        '''An existing plan is passed through.'''
+        build_plan = BuildPlan(build_lists)
+        assert BuildPlan.from_build_lists(build_plan) is build_plan
+        assert len(BuildPlan.from_build_lists(build_lists)) == 3
+
+
 def test_collection_getter() -> None:
     '''Test CollectionGetter.'''
     artefact_store = ArtefactStore()
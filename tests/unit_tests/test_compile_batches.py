@@ -0,0 +1,90 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from fab.compile_batches import compile_batch, make_compile_batches
+
+
+class Test_make_compile_batches(object):
+
+    @pytest.fixture
+    def files(self):
+        return [mock.Mock(fpath=Path(f'/src/{name}')) for name in ['a.f90', 'b.f90', 'c.f90', 'd.f90', 'e.f90']]
+
+    def test_batch_size(self, files):
+        batches = make_compile_batches(files, flags_for=lambda af: [], batch_size=2)
+        assert [len(b) for b in batches] == [2, 2, 1]
+
+    def test_n_procs(self, files):
+        # keep all the processes busy
+        batches = make_compile_batches(files, flags_for=lambda af: [], batch_size=10, n_procs=2)
+        assert [len(b) for b in batches] == [3, 2]
+
+    def test_flags(self, files):
+        # only files with the same flags are batched together
+        batches = make_compile_batches(
+            files, flags_for=lambda af: ['-O2'] if af.fpath.name < 'c' else ['-O3'], batch_size=10)
+        assert [[af.fpath.name for af in b] for b in batches] == [['a.f90', 'b.f90'], ['c.f90', 'd.f90', 'e.f90']]
+
+    def test_folders(self):
+        # only files in the same folder are batched together, as they're compiled in that folder
+        files = [mock.Mock(fpath=Path(fpath)) for fpath in ['/a/foo.c', '/b/foo.c', '/a/bar.c']]
+        batches = make_compile_batches(files, flags_for=lambda af: [], batch_size=10)
+        assert [[str(af.fpath) for af in b] for b in batches] == [['/a/foo.c', '/a/bar.c'], ['/b/foo.c']]
+
+    def test_object_names(self):
+        # files which would create the same object file are not batched
+        files = [mock.Mock(fpath=Path(fpath)) for fpath in ['/a/foo.f90', '/a/foo.F90', '/a/bar.f90', '/a/baz.f90']]
+        batches = make_compile_batches(files, flags_for=lambda af: [], batch_size=10)
+        assert [[str(af.fpath) for af in b] for b in batches] == [
+            ['/a/foo.f90'], ['/a/foo.F90'], ['/a/bar.f90', '/a/baz.f90']]
+
+
+class Test_compile_batch(object):
+
+    @pytest.fixture
+    def outputs(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        return {tmp_path / 'src/a.c': tmp_path / 'prebuild/a.123.o',
+                tmp_path / 'src/b.c': tmp_path / 'prebuild/b.456.o'}
+
+    def test_vanilla(self, tmp_path, outputs):
+        def compile_files(input_files, add_flags):
+            # the objects are created in the source folder
+            for fpath in input_files:
+                fpath.with_suffix('.o').write_text(str(add_flags))
+
+        compiler = mock.Mock(compile_files=compile_files)
+
+        assert compile_batch(compiler, outputs, ['-O2'])
+        assert (tmp_path / 'prebuild/a.123.o').read_text() == "['-O2']"
+        assert (tmp_path / 'prebuild/b.456.o').read_text() == "['-O2']"
+        assert not list((tmp_path / 'src').iterdir())
+
+    def test_error(self, tmp_path, outputs):
+        # any objects which were created are removed
+        def compile_files(input_files, add_flags):
+            input_files[0].with_suffix('.o').write_text('')
+            raise RuntimeError('bad')
+
+        compiler = mock.Mock(compile_files=compile_files)
+        assert not compile_batch(compiler, outputs, [])
+        assert not list((tmp_path / 'src').iterdir())
+
+    def test_existing_object(self, tmp_path, outputs):
+        # objects which are already in the source folder are not overwritten
+        (tmp_path / 'src/b.o').write_text('mine')
+        compiler = mock.Mock()
+        assert not compile_batch(compiler, outputs, [])
+        compiler.compile_files.assert_not_called()
+        assert (tmp_path / 'src/b.o').read_text() == 'mine'
+
+    def test_folders(self):
+        with pytest.raises(ValueError):
+            compile_batch(mock.Mock(), {Path('/a/foo.c'): Path('foo.o'), Path('/b/bar.c'): Path('bar.o')}, [])
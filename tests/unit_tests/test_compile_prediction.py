@@ -0,0 +1,163 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+import json
+from pathlib import Path
+
+import pytest
+
+from fab.compile_prediction import (CompileTimes, DEFAULT_SECONDS_PER_BYTE, DEFAULT_SYNTAX_ONLY_RATIO,
+                                    HISTORY_FILENAME, estimate_compile_times, load_compile_history, predict,
+                                    simulate_single_stage, simulate_two_stage, update_compile_history)
+from fab.metrics import JSON_FILENAME
+from fab.parse.fortran import AnalysedFortran
+
+
+def analysed_file(name, deps=(), mods=True):
+    af = AnalysedFortran(fpath=Path(f'{name}.f90'), file_deps={Path(f'{dep}.f90') for dep in deps}, file_hash=0)
+    if mods:
+        af.add_module_def(f'{name}_mod')
+    return af
+
+
+def times_for(analysed_files, full, syntax_only):
+    return CompileTimes(full={af.fpath: full for af in analysed_files},
+                        syntax_only={af.fpath: syntax_only for af in analysed_files})
+
+
+@pytest.fixture
+def deep():
+    # a program using a chain of modules
+    return [
+        analysed_file('m1'),
+        analysed_file('m2', deps=['m1']),
+        analysed_file('m3', deps=['m2']),
+        analysed_file('prog', deps=['m3'], mods=False),
+    ]
+
+
+@pytest.fixture
+def wide():
+    # independent modules
+    return [analysed_file(f'm{i}') for i in range(4)]
+
+
+class TestSimulate:
+
+    def test_deep_single_stage(self, deep):
+        # a pass for each file
+        assert simulate_single_stage(deep, times_for(deep, 10, 1), n_procs=4) == 40
+
+    def test_deep_two_stage(self, deep):
+        # the mod files are made by 3s, and the last object compiles start then
+        assert simulate_two_stage(deep, times_for(deep, 10, 1), n_procs=4) == 13
+
+    def test_wide_single_stage(self, wide):
+        assert simulate_single_stage(wide, times_for(wide, 10, 5), n_procs=2) == 20
+
+    def test_wide_two_stage(self, wide):
+        # all the work is done twice, sharing the processes
+        assert simulate_two_stage(wide, times_for(wide, 10, 5), n_procs=2) == 30
+
+    def test_predict(self, deep, wide):
+        prediction = predict(deep, times_for(deep, 10, 1), n_procs=4)
+        assert prediction.two_stage < prediction.single_stage
+
+        prediction = predict(wide, times_for(wide, 10, 5), n_procs=2)
+        assert prediction.two_stage > prediction.single_stage
+
+    def test_no_files(self):
+        assert predict([], CompileTimes({}, {}), n_procs=0) == (0, 0)
+
+    def test_single_stage_passes(self):
+        # a diamond, plus a file with a circular dependency which never compiles
+        files = [
+            analysed_file('a'),
+            analysed_file('b', deps=['a']),
+            analysed_file('c', deps=['a']),
+            analysed_file('d', deps=['b', 'c']),
+            analysed_file('e', deps=['e']),
+        ]
+        times = times_for(files, 10, 1)
+        times.full[Path('c.f90')] = 30
+        assert simulate_single_stage(files, times, n_procs=2) == 50
+
+
+class TestHistory:
+
+    @pytest.fixture
+    def metrics(self):
+        return {
+            'compile fortran': {
+                'a.f90': {'time_taken': 2.0, 'start': 0},
+                'b.f90': {'time_taken': 0.01, 'start': 0, 'prebuild': True},
+            },
+            'compile fortran syntax-only': {
+                'a.f90': {'time_taken': 0.5, 'start': 0, 'prebuild': False},
+            },
+        }
+
+    def test_load(self, tmp_path, metrics):
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+
+        history = load_compile_history(tmp_path)
+        assert history.full == {Path('a.f90'): 2.0}
+        assert history.syntax_only == {Path('a.f90'): 0.5}
+
+    def test_no_metrics(self, tmp_path):
+        assert load_compile_history(tmp_path) == ({}, {})
+
+    def test_merge(self, tmp_path, metrics):
+        # the latest times replace the history, and files which used a prebuild keep their old time
+        (tmp_path / HISTORY_FILENAME).write_text(json.dumps({
+            'compile fortran': {'a.f90': 3.0, 'b.f90': 1.0, 'c.f90': 4.0},
+            'compile fortran syntax-only': {},
+        }))
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+
+        history = load_compile_history(tmp_path)
+        assert history.full == {Path('a.f90'): 2.0, Path('b.f90'): 1.0, Path('c.f90'): 4.0}
+        assert history.syntax_only == {Path('a.f90'): 0.5}
+
+    def test_update(self, tmp_path, metrics):
+        # each build's times are added to the history
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+        update_compile_history(tmp_path)
+
+        metrics['compile fortran'] = {'c.f90': {'time_taken': 4.0, 'start': 0}}
+        metrics['compile fortran syntax-only'] = {}
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+        update_compile_history(tmp_path)
+
+        (tmp_path / JSON_FILENAME).unlink()
+        history = load_compile_history(tmp_path)
+        assert history.full == {Path('a.f90'): 2.0, Path('c.f90'): 4.0}
+        assert history.syntax_only == {Path('a.f90'): 0.5}
+
+    def test_update_no_metrics(self, tmp_path):
+        update_compile_history(tmp_path)
+        assert not (tmp_path / HISTORY_FILENAME).exists()
+
+
+class TestEstimate:
+
+    @pytest.fixture
+    def files(self, tmp_path):
+        # a has a history, b is twice the size of a and is new
+        (tmp_path / 'a.f90').write_text('a' * 100)
+        (tmp_path / 'b.f90').write_text('b' * 200)
+        return [AnalysedFortran(fpath=tmp_path / name, file_hash=0) for name in ['a.f90', 'b.f90']]
+
+    def test_from_history(self, tmp_path, files):
+        history = CompileTimes(full={tmp_path / 'a.f90': 2.0}, syntax_only={tmp_path / 'a.f90': 0.5})
+        times = estimate_compile_times(files, history)
+        assert times.full == {tmp_path / 'a.f90': 2.0, tmp_path / 'b.f90': 4.0}
+        assert times.syntax_only == {tmp_path / 'a.f90': 0.5, tmp_path / 'b.f90': 1.0}
+
+    def test_defaults(self, tmp_path, files):
+        times = estimate_compile_times(files, CompileTimes({}, {}))
+        assert times.full[tmp_path / 'b.f90'] == pytest.approx(200 * DEFAULT_SECONDS_PER_BYTE)
+        assert times.syntax_only[tmp_path / 'b.f90'] == pytest.approx(
+            200 * DEFAULT_SECONDS_PER_BYTE * DEFAULT_SYNTAX_ONLY_RATIO)
@@ -1,10 +1,24 @@
 from pathlib import Path
 
-from fab.build_config import AddFlags, BuildConfig
+import pytest
+
+from fab.build_config import AddFlags, BuildConfig, FlagsConfig
 from fab.constants import SOURCE_ROOT
 from fab.tools import ToolBox
 
 
+class TestBuildConfig:
+
+    @pytest.mark.parametrize('two_stage, label', [(False, '1stage'), (True, '2stage'), ('auto', 'autostage')])
+    def test_two_stage_label(self, two_stage, label):
+        config = BuildConfig('proj_$two_stage', ToolBox(), two_stage=two_stage, fab_workspace=Path('/fab'))
+        assert config.project_label == f'proj_{label}'
+
+    def test_two_stage_invalid(self):
+        with pytest.raises(ValueError):
+            BuildConfig('proj', ToolBox(), two_stage='sometimes')
+
+
 class TestAddFlags:
 
     def test_run(self):
@@ -27,3 +41,70 @@ class TestAddFlags:
             input_flags=my_flags,
             config=config)
         assert my_flags == ['-foo']
+
+
+class TestFlagsConfig:
+
+    @pytest.fixture
+    def config(self):
+        return BuildConfig('proj', ToolBox(), fab_workspace=Path("/fab_workspace"))
+
+    @pytest.fixture
+    def path_flags(self):
+        return [
+            AddFlags(match="$source/foo/*", flags=['-I', '$relative/include']),
+            AddFlags(match="", flags=['-all']),
+            AddFlags(match="$source/*/bar.c", flags=['-bar']),
+            AddFlags(match="$relative/baz.c", flags=['-baz']),
+            AddFlags(match="$source/foo/*", flags=['-O$output']),
+        ]
+
+    @pytest.mark.parametrize('fpath', [
+        Path(f"/fab_workspace/proj/{SOURCE_ROOT}/foo/bar.c"),
+        Path(f"/fab_workspace/proj/{SOURCE_ROOT}/foo/baz.c"),
+        Path(f"/fab_workspace/proj/{SOURCE_ROOT}/foo/sub/bar.c"),
+        Path(f"/fab_workspace/proj/{SOURCE_ROOT}/other/bar.c"),
+        Path(f"/fab_workspace/proj/{SOURCE_ROOT}/other/qux.c"),
+        Path("/elsewhere/bar.c"),
+    ])
+    def test_matches_add_flags(self, config, path_flags, fpath):
+        # the precompiled rules must give the same flags as running each AddFlags in turn
+        flags_config = FlagsConfig(common_flags=['-common', '-I$source/include'], path_flags=path_flags)
+
+        expect = ['-common', f'-I{config.source_root}/include']
+        for add_flags in path_flags:
+            add_flags.run(fpath, expect, config)
+
+        assert flags_config.flags_for_path(fpath, config) == expect
+        # and again, from the memo
+        assert flags_config.flags_for_path(fpath, config) == expect
+
+    def test_relative(self, config, path_flags):
+        flags_config = FlagsConfig(path_flags=path_flags)
+        assert flags_config.flags_for_path(config.source_root / 'foo/bar.c', config) == [
+            '-I', f'{config.source_root}/foo/include', '-all', '-bar', f'-O{config.build_output}']
+
+    def test_copy(self, config):
+        # callers can modify the flags they're given
+        flags_config = FlagsConfig(common_flags=['-a'])
+        flags_config.flags_for_path(Path('/foo.c'), config).append('-b')
+        assert flags_config.flags_for_path(Path('/bar.c'), config) == ['-a']
+
+    def test_changed_rules(self, config):
+        # changes to the rules after first use are picked up
+        flags_config = FlagsConfig(common_flags=['-a'])
+        assert flags_config.flags_for_path(Path('/foo.c'), config) == ['-a']
+        flags_config.path_flags.append(AddFlags(match='*', flags=['-b']))
+        assert flags_config.flags_for_path(Path('/foo.c'), config) == ['-a', '-b']
+
+    def test_add_flags_subclass(self, config, path_flags):
+        # a subclass's own run() is used, in order with the other rules
+        class RemoveAll(AddFlags):
+            def run(self, fpath, input_flags, config):
+                if '-all' in input_flags:
+                    input_flags.remove('-all')
+                input_flags.append('-removed')
+
+        flags_config = FlagsConfig(path_flags=path_flags[:2] + [RemoveAll(match='', flags=[])] + path_flags[2:])
+        assert flags_config.flags_for_path(config.source_root / 'foo/bar.c', config) == [
+            '-I', f'{config.source_root}/foo/include', '-removed', '-bar', f'-O{config.build_output}']
@@ -1,8 +1,9 @@
+import pickle
 from pathlib import Path
 
 import pytest
 
-from fab.dep_tree import extract_sub_tree, AnalysedDependent
+from fab.dep_tree import extract_sub_tree, AnalysedDependent, SourceGraph
 
 
 @pytest.fixture
@@ -29,3 +30,144 @@ class Test_extract_sub_tree(object):
         assert result == expect
 
     # todo: check missing deps raise a message
+
+
+class TestSourceGraph(object):
+
+    def test_csr(self, src_tree):
+        graph = SourceGraph(src_tree)
+        assert graph.paths == list(src_tree)
+        ids = graph.ids
+        assert list(graph.deps(ids[Path('root.f90')])) == sorted([ids[Path('a.f90')], ids[Path('b.f90')]])
+        assert list(graph.deps(ids[Path('c.f90')])) == []
+
+    def test_sub_tree(self, src_tree):
+        result = SourceGraph(src_tree).sub_tree(root=Path('root.f90'))
+        expect = src_tree.copy()
+        del expect[Path('foo.f90')]
+        assert result == expect
+        assert len(result) == 4
+        assert Path('foo.f90') not in result
+
+    def test_missing_deps(self, src_tree, caplog):
+        src_tree[Path('c.f90')].file_deps.add(Path('missing.f90'))
+        result = SourceGraph(src_tree).sub_tree(root=Path('root.f90'))
+        assert len(result) == 4
+        assert 'missing.f90' in caplog.text
+
+    def test_full_tree(self, src_tree):
+        assert SourceGraph(src_tree).full_tree() == src_tree
+
+
+class TestBuildTree(object):
+
+    def test_shared_graph(self, src_tree):
+        graph = SourceGraph(src_tree)
+        a_tree = graph.sub_tree(Path('a.f90'))
+        b_tree = graph.sub_tree(Path('b.f90'))
+        assert a_tree.graph is b_tree.graph
+        assert a_tree[Path('c.f90')] is b_tree[Path('c.f90')]
+
+    def test_update(self, src_tree):
+        graph = SourceGraph(src_tree)
+        tree = graph.sub_tree(Path('a.f90'))
+        tree.update(graph.sub_tree(Path('foo.f90')))
+        tree.update({Path('b.f90'): src_tree[Path('b.f90')]})
+        assert set(tree) == {Path('a.f90'), Path('b.f90'), Path('c.f90'), Path('foo.f90')}
+
+    def test_not_in_graph(self, src_tree):
+        tree = SourceGraph(src_tree).sub_tree(Path('a.f90'))
+        with pytest.raises(ValueError):
+            tree[Path('new.f90')] = AnalysedDependent(fpath=Path('new.f90'))
+        with pytest.raises(KeyError):
+            tree[Path('foo.f90')]
+
+    def test_delete(self, src_tree):
+        tree = SourceGraph(src_tree).sub_tree(Path('a.f90'))
+        del tree[Path('c.f90')]
+        assert list(tree) == [Path('a.f90')]
+        assert len(tree) == 1
+
+    def test_pickle(self, src_tree):
+        # the graph is pickled once, however many trees use it
+        graph = SourceGraph(src_tree)
+        trees = {'a': graph.sub_tree(Path('a.f90')), 'root': graph.sub_tree(Path('root.f90'))}
+        result = pickle.loads(pickle.dumps(trees))
+        assert result == trees
+        assert result['a'].graph is result['root'].graph
+
+
+def chain_tree(length):
+    # like Experimental/BigTestProject, each file depends on the next
+    return {
+        Path(f'f{i}.f90'): AnalysedDependent(
+            fpath=Path(f'f{i}.f90'), file_deps={Path(f'f{i + 1}.f90')} if i + 1 < length else set(), file_hash=0)
+        for i in range(length)
+    }
+
+
+class TestDeepChains(object):
+    # deeper than the recursion limit
+
+    def test_extract_sub_tree(self):
+        result = extract_sub_tree(source_tree=chain_tree(5000), root=Path('f0.f90'))
+        assert len(result) == 5000
+
+    def test_sub_trees(self):
+        result = SourceGraph(chain_tree(5000)).sub_trees({'a': Path('f0.f90'), 'b': Path('f4000.f90')})
+        assert len(result['a']) == 5000
+        assert len(result['b']) == 1000
+
+
+class TestSubTrees(object):
+
+    def test_matches_sub_tree(self, src_tree):
+        graph = SourceGraph(src_tree)
+        roots = {'root': Path('root.f90'), 'a': Path('a.f90'), 'foo': Path('foo.f90')}
+        result = graph.sub_trees(roots)
+        assert list(result) == ['root', 'a', 'foo']
+        for name, root in roots.items():
+            assert result[name] == graph.sub_tree(root)
+
+    def test_cycle(self, src_tree):
+        # c depends on root, making a cycle
+        src_tree[Path('c.f90')].file_deps.add(Path('root.f90'))
+        result = SourceGraph(src_tree).sub_trees({'a': Path('a.f90'), 'c': Path('c.f90')})
+        expect = {Path('root.f90'), Path('a.f90'), Path('b.f90'), Path('c.f90')}
+        assert set(result['a']) == expect
+        assert set(result['c']) == expect
+
+    def test_missing_deps(self, src_tree, caplog):
+        src_tree[Path('b.f90')].file_deps.add(Path('missing.f90'))
+        SourceGraph(src_tree).sub_trees({'root': Path('root.f90'), 'a': Path('a.f90')})
+        assert caplog.text.count('missing.f90') == 1
+        assert 'root.f90 has missing deps' in caplog.text
+
+
+class TestReachable(object):
+
+    def test_many_roots(self, src_tree):
+        result = SourceGraph(src_tree).reachable([Path('a.f90'), Path('foo.f90')])
+        assert set(result) == {Path('a.f90'), Path('c.f90'), Path('foo.f90')}
+
+
+class TestDependents(object):
+
+    def test_dependents(self, src_tree):
+        graph = SourceGraph(src_tree)
+        ids = graph.ids
+        assert sorted(graph.dependents(ids[Path('c.f90')])) == sorted([ids[Path('a.f90')], ids[Path('b.f90')]])
+        assert list(graph.dependents(ids[Path('root.f90')])) == []
+
+    def test_transitive_dependents(self, src_tree):
+        graph = SourceGraph(src_tree)
+        assert graph.transitive_dependents(Path('c.f90')) == {Path('a.f90'), Path('b.f90'), Path('root.f90')}
+        assert graph.transitive_dependents(Path('foo.f90')) == set()
+
+    def test_dependents_index(self, src_tree):
+        index = SourceGraph(src_tree).dependents_index()
+        assert {k: sorted(v) for k, v in index.items()} == {
+            Path('a.f90'): [Path('root.f90')],
+            Path('b.f90'): [Path('root.f90')],
+            Path('c.f90'): [Path('a.f90'), Path('b.f90')],
+        }
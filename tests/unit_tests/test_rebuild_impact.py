@@ -0,0 +1,105 @@
+# ##############################################################################
+#  (c) Crown copyright Met Office. All rights reserved.
+#  For further details please refer to the file COPYRIGHT
+#  which you should have received as part of this distribution
+# ##############################################################################
+import json
+from pathlib import Path
+
+import pytest
+
+from fab.cli import cli_impact
+from fab.compile_prediction import HISTORY_FILENAME
+from fab.metrics import JSON_FILENAME
+from fab.rebuild_impact import (DEPENDENTS_FILENAME, RebuildImpact, compile_times, impact_report, load_dependents,
+                                rebuild_impact, save_dependents)
+
+
+@pytest.fixture
+def dependents():
+    # c is used by a and b, which are used by root
+    return {
+        Path('a.f90'): [Path('root.f90')],
+        Path('b.f90'): [Path('root.f90')],
+        Path('c.f90'): [Path('a.f90'), Path('b.f90')],
+    }
+
+
+@pytest.fixture
+def metrics():
+    return {
+        'compile fortran': {
+            'a.f90': {'time_taken': 1.0, 'start': 0},
+            'b.f90': {'time_taken': 5.0, 'start': 0},
+            'c.f90': {'time_taken': 0.5, 'start': 0},
+            'root.f90': {'time_taken': 2.0, 'start': 0},
+        },
+        'compile fortran syntax-only': {
+            'root.f90': {'time_taken': 0.5, 'start': 0},
+        },
+        'steps': {'compile fortran': 10},
+    }
+
+
+def test_save_load(tmp_path, dependents):
+    fpath = tmp_path / 'metrics' / DEPENDENTS_FILENAME
+    save_dependents(dependents, fpath)
+    assert load_dependents(fpath) == dependents
+
+
+def test_compile_times(metrics):
+    assert compile_times(metrics) == {
+        Path('a.f90'): 1.0, Path('b.f90'): 5.0, Path('c.f90'): 0.5, Path('root.f90'): 2.5}
+
+
+def test_compile_times_prebuild(metrics):
+    # a file which used a prebuild wasn't compiled, so has no time
+    metrics['compile fortran']['c.f90'] = {'time_taken': 0.01, 'start': 0, 'prebuild': True}
+    assert Path('c.f90') not in compile_times(metrics)
+
+
+def test_rebuild_impact(dependents, metrics):
+    result = rebuild_impact(dependents, compile_times(metrics))
+    assert result == [
+        RebuildImpact(fpath=Path('c.f90'), fan_in=3, rebuild_time=9.0),
+        RebuildImpact(fpath=Path('b.f90'), fan_in=1, rebuild_time=7.5),
+        RebuildImpact(fpath=Path('a.f90'), fan_in=1, rebuild_time=3.5),
+    ]
+
+
+def test_rebuild_impact_cycle():
+    dependents = {Path('a.f90'): [Path('b.f90')], Path('b.f90'): [Path('a.f90')]}
+    result = rebuild_impact(dependents, {}, fpaths=[Path('a.f90')])
+    assert result == [RebuildImpact(fpath=Path('a.f90'), fan_in=1, rebuild_time=0.0)]
+
+
+class TestReport(object):
+
+    def test_report(self, tmp_path, dependents, metrics):
+        save_dependents(dependents, tmp_path / DEPENDENTS_FILENAME)
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+
+        lines = impact_report(tmp_path, top=2).splitlines()
+        assert len(lines) == 3
+        assert lines[1].split() == ['9.00', '3', 'c.f90']
+        assert lines[2].split() == ['7.50', '1', 'b.f90']
+
+    def test_prebuild(self, tmp_path, dependents, metrics):
+        # a prebuilt file keeps its real compile time from the history
+        save_dependents(dependents, tmp_path / DEPENDENTS_FILENAME)
+        (tmp_path / HISTORY_FILENAME).write_text(json.dumps({'compile fortran': {'c.f90': 3.0}}))
+        metrics['compile fortran']['c.f90'] = {'time_taken': 0.01, 'start': 0, 'prebuild': True}
+        (tmp_path / JSON_FILENAME).write_text(json.dumps(metrics))
+
+        lines = impact_report(tmp_path, top=1).splitlines()
+        assert lines[1].split() == ['11.50', '3', 'c.f90']
+
+    def test_no_metrics(self, tmp_path, dependents):
+        save_dependents(dependents, tmp_path / DEPENDENTS_FILENAME)
+        lines = impact_report(tmp_path).splitlines()
+        assert lines[1].split() == ['0.00', '3', 'c.f90']
+
+    def test_cli(self, tmp_path, dependents, capsys):
+        save_dependents(dependents, tmp_path / DEPENDENTS_FILENAME)
+        cli_impact([str(tmp_path), '--top', '1'])
+        assert capsys.readouterr().out.splitlines()[1].split() == ['0.00', '3', 'c.f90']
@@ -1,10 +1,12 @@
+import os
+import stat
 from pathlib import Path
 from unittest import mock
 
 import pytest
 
 from fab.artefacts import SuffixFilter
-from fab.util import input_to_output_fpath, suffix_filter, file_walk
+from fab.util import copy_if_changed, input_to_output_fpath, suffix_filter, file_walk, write_if_changed
 
 
 @pytest.fixture
@@ -78,3 +80,58 @@ class Test_input_to_output_fpath(object):
         input_path = Path('/other/folder/file.txt')
         result = input_to_output_fpath(config, input_path)
         assert result == Path(config.build_output / 'other/folder/file.txt')
+
+
+class Test_write_if_changed():
+
+    def test_new(self, tmp_path):
+        assert write_if_changed(tmp_path / 'foo.f90', 'foo\n')
+        assert (tmp_path / 'foo.f90').read_text() == 'foo\n'
+        # no temporary files are left behind
+        assert list(tmp_path.iterdir()) == [tmp_path / 'foo.f90']
+
+    def test_unchanged(self, tmp_path):
+        fpath = tmp_path / 'foo.f90'
+        fpath.write_text('foo\n')
+        with mock.patch('os.replace') as mock_replace:
+            assert not write_if_changed(fpath, b'foo\n')
+        mock_replace.assert_not_called()
+
+    def test_changed(self, tmp_path):
+        fpath = tmp_path / 'foo.f90'
+        fpath.write_text('foo\n')
+        assert write_if_changed(fpath, 'bar\n')
+        assert fpath.read_text() == 'bar\n'
+        assert list(tmp_path.iterdir()) == [fpath]
+
+    def test_error(self, tmp_path):
+        # the target and no temporary file remains
+        fpath = tmp_path / 'foo.f90'
+        fpath.write_text('foo\n')
+        with mock.patch('os.replace', side_effect=OSError('disk full')):
+            with pytest.raises(OSError):
+                write_if_changed(fpath, 'bar\n')
+        assert list(tmp_path.iterdir()) == [fpath]
+        assert fpath.read_text() == 'foo\n'
+
+    def test_keeps_mode(self, tmp_path):
+        fpath = tmp_path / 'foo.sh'
+        fpath.write_text('foo\n')
+        fpath.chmod(0o750)
+        assert write_if_changed(fpath, 'bar\n')
+        assert stat.S_IMODE(fpath.stat().st_mode) == 0o750
+
+    def test_umask(self, tmp_path):
+        # a new file gets the permissions allowed by the current umask
+        old_umask = os.umask(0o027)
+        try:
+            assert write_if_changed(tmp_path / 'foo.f90', 'foo\n')
+        finally:
+            os.umask(old_umask)
+        assert stat.S_IMODE((tmp_path / 'foo.f90').stat().st_mode) == 0o640
+
+    def test_copy(self, tmp_path):
+        (tmp_path / 'src.f90').write_text('foo\n')
+        assert copy_if_changed(tmp_path / 'src.f90', tmp_path / 'dst.f90')
+        assert not copy_if_changed(tmp_path / 'src.f90', tmp_path / 'dst.f90')
+        assert (tmp_path / 'dst.f90').read_text() == 'foo\n'
@@ -49,3 +49,41 @@ def test_ar_create():
     tool_run.assert_called_with(['ar', 'cr', 'out.a', 'a.o', 'b.o'],
                                 capture_output=True, env=None, cwd=None,
                                 check=False)
+
+
+def test_ar_create_thin():
+    '''Test creating a thin archive.'''
+    ar = Ar()
+    with mock.patch('fab.tools.tool.subprocess.run',
+                    return_value=mock.Mock(returncode=0)) as tool_run:
+        ar.create(Path("out.a"), ["a.o"], thin=True)
+    tool_run.assert_called_with(['ar', 'crT', 'out.a', 'a.o'],
+                                capture_output=True, env=None, cwd=None,
+                                check=False)
+
+
+def test_ar_replace_delete():
+    '''Test updating the members of an archive.'''
+    ar = Ar()
+    with mock.patch('fab.tools.tool.subprocess.run',
+                    return_value=mock.Mock(returncode=0)) as tool_run:
+        ar.replace(Path("out.a"), [Path("/objs/a.o")])
+        ar.delete(Path("out.a"), ["b.o"])
+    assert tool_run.call_args_list == [
+        mock.call(['ar', 'r', 'out.a', '/objs/a.o'], capture_output=True,
+                  env=None, cwd=None, check=False),
+        mock.call(['ar', 'd', 'out.a', 'b.o'], capture_output=True,
+                  env=None, cwd=None, check=False),
+    ]
+
+
+def test_ar_response_file():
+    '''Test that ar passes very long command lines in a response file.'''
+    ar = Ar()
+    members = [f"/long/path/to/the/object/file_{i}.o" for i in range(10000)]
+    with mock.patch("fab.tools.tool.subprocess.run",
+                    return_value=mock.Mock(returncode=0)) as tool_run:
+        ar.create(Path("out.a"), members)
+    command = tool_run.call_args[0][0]
+    assert command[0] == "ar"
+    assert len(command) == 2 and command[1].startswith("@")
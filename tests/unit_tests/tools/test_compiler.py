@@ -144,6 +144,20 @@ def test_compiler_module_output():
                                                      'a.f90', '-o', 'a.o'])
 
 
+def test_compiler_module_folder():
+    '''Tests creating the module files in another folder, while still
+    reading the existing modules from the module output path.'''
+    fc = FortranCompiler("gfortran", "gfortran", suite="gnu",
+                         module_folder_flag="-J")
+    fc.set_module_output_path("/module_out")
+    fc.run = mock.MagicMock()
+    fc.compile_file(Path("a.f90"), "a.o", module_folder=Path("/tmp_mods"))
+    fc.run.assert_called_with(cwd=PosixPath('.'),
+                              additional_parameters=['-c', '-I', '/module_out',
+                                                     '-J', '/tmp_mods',
+                                                     'a.f90', '-o', 'a.o'])
+
+
 def test_compiler_with_add_args():
     '''Tests that additional arguments are handled as expected.'''
     fc = FortranCompiler("gfortran", "gfortran", "gnu",
@@ -161,6 +175,22 @@ def test_compiler_with_add_args():
                                                      'a.f90', '-o', 'a.o'])
 
 
+def test_compile_files():
+    '''Tests compiling several files in one invocation.'''
+    fc = FortranCompiler("gfortran", "gfortran", "gnu",
+                         module_folder_flag="-J",
+                         syntax_only_flag="-fsyntax-only")
+    fc.set_module_output_path("/module_out")
+    fc.run = mock.MagicMock()
+    fc.compile_files([Path("/src/a.f90"), Path("/src/b.f90")],
+                     add_flags=["-O3"], syntax_only=True)
+    # run in the source folder, as for a single file
+    fc.run.assert_called_with(cwd=Path('/src'),
+                              additional_parameters=['-c', "-O3", '-fsyntax-only',
+                                                     '-J', '/module_out',
+                                                     'a.f90', 'b.f90'])
+
+
 def test_get_version_string():
     '''Tests the get_version_string() method.
     '''
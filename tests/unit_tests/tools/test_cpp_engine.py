@@ -0,0 +1,148 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+'''Tests the in-process preprocessor. The conformance tests compare its
+output with cpp's, and are skipped if cpp is not installed.
+'''
+
+import shutil
+import subprocess
+
+import pytest
+
+from fab.tools import CppFortran
+from fab.tools.cpp_engine import CppEngine, UnsupportedPreprocessing
+
+FLAGS = ['-traditional-cpp', '-P']
+
+# Sources which the engine must preprocess exactly like cpp
+CONFORMANCE = {
+    'plain': 'program p\n  x = 1\nend program p\n',
+    'blank lines': '\n\nprogram p\n\n\nend\n\n',
+    'no final newline': 'program p\nend',
+    'define': '#define FOO 42\nx = FOO\n#undef FOO\nx = FOO\n',
+    'define spacing': '#  define FOO \t a  b \t\n#define EMPTY\nx = [FOO] EMPTY\n',
+    'rescan': '#define FOO 42\n#define BAR FOO + 1\nx = BAR\n',
+    'identifiers': '#define dp 8\nx = 1.0_dp + 2dp + real(dp) + dp_x + x_dp\n',
+    'strings': '#define FOO 42\ns = \'FOO\' // "FOO" // FOO\nt = \'it\'\'s FOO\'\nu = \'FOO\n',
+    'quoted value': "#define MSG 'abc FOO'\n#define FOO 1\ns = MSG\n",
+    'comments': '#define FOO 42\nx = 1 ! FOO\ny = 2 // FOO\n',
+    'ifdef': '#define A\n#ifdef A\na\n#else\nnot a\n#endif\n#ifndef B\nnot b\n#endif\n',
+    'nested': ('#ifdef A\n#ifdef B\nab\n#else\na\n#endif\n#elif defined C\nc\n'
+               '#else\n#if 1\nnone\n#endif\n#endif\n'),
+    'if': ('#define N 3\n#if N > 2 && (N * 2 == 6 || 0)\ncompare\n#endif\n'
+           '#if !defined(N) || UNDEFINED\nno\n#elif N << 2 == 12 ? 1 : 0\nternary\n#endif\n'),
+    'if numbers': '#if 0x1F == 31 && 017 == 15 && 10L == 10 && -7 / 2 == -3 && -7 % 2 == -1\nnumbers\n#endif\n',
+    'if overflow': ('#if 4294967296 * 4294967296 > 0\nyes\n#else\nno\n#endif\n'
+                    '#if 9223372036854775807 + 1 < 0 && -(-9223372036854775807 - 1) < 0\nwrapped\n#endif\n'
+                    '#if (-9223372036854775807 - 1) / -1 < 0 && (-9223372036854775807 - 1) % -1 == 0\ndivided\n#endif\n'
+                    '#if (1 << 63) < 0 && (1 << 64) == 0 && (-1 >> 64) == -1 && ~9223372036854775807 < 0\nshifted\n'
+                    '#endif\n'),
+    'skipped directives': '#if 0\n#error nope\n#foo\n#define X 1\n#endif\nx = X\n',
+    'null directive': '#\nx\n# \n',
+    'indented directive': '#define FOO 42\n  #ifdef FOO\n',
+    'predefined': '#ifdef __GNUC__\ngnu\n#endif\nx = linux unix\n',
+    'flags': '#if defined(D) && V == 2\nx = D V W\n#endif\n',
+    'include': '#define FOO 42\n#include "inc.h"\n#include <inc2.h>\ny = BAR\n',
+}
+
+FLAG_CASES = {'flags': ['-DD', '-D', 'V=2', '-DW=w', '-UW']}
+
+
+@pytest.fixture(scope='module')
+def engine():
+    cpp = CppFortran()
+    if not shutil.which(cpp.exec_name):
+        pytest.skip("cpp is not installed")
+    return CppEngine.from_preprocessor(cpp)
+
+
+@pytest.mark.parametrize('name', CONFORMANCE)
+def test_conformance(engine, tmp_path, name):
+    '''Test the engine's output is the same as cpp's.'''
+    (tmp_path / 'inc.h').write_text('#define BAR FOO + 1\nx = FOO\n')
+    (tmp_path / 'include').mkdir()
+    (tmp_path / 'include' / 'inc2.h').write_text('#ifdef BAR\nz = BAR\n#endif\n')
+    fpath = tmp_path / 'test.F90'
+    fpath.write_text(CONFORMANCE[name])
+    flags = FLAG_CASES.get(name, []) + [f'-I{tmp_path / "include"}']
+
+    expected = subprocess.run(['cpp'] + FLAGS + flags + [str(fpath)],
+                              capture_output=True, check=True).stdout.decode()
+    assert engine.process(fpath, FLAGS + flags) == expected
+
+
+def test_preprocess(engine, tmp_path):
+    '''Test the output file is written.'''
+    fpath = tmp_path / 'test.F90'
+    fpath.write_text('#define FOO 42\nx = FOO\n')
+    engine.preprocess(fpath, tmp_path / 'test.f90', ['-DBAR'])
+    assert (tmp_path / 'test.f90').read_text().lstrip('\n') == 'x = 42\n'
+
+
+def test_hash(engine):
+    '''Test the hash changes with the predefined macros.'''
+    other = CppEngine('', {'__GNUC__': '1'}, FLAGS)
+    assert engine.get_hash() == engine.get_hash()
+    assert engine.get_hash() != other.get_hash()
+
+
+@pytest.mark.parametrize('source', [
+    '#define F(x) x\n',
+    '#define A B\n#define B A\nx = A\n',
+    '/* comment */\n',
+    'x = 1 + \\\n  2\n',
+    'x = 1\r\n',
+    '#pragma omp\n',
+    '#error stop\n',
+    '#line 10\n',
+    '# 1 "foo.F90"\n',
+    'x = __LINE__\n',
+    '#include "missing.h"\n',
+    '#include FILE\n',
+    '#ifdef A\n',
+    '#endif\n',
+    '#else\n#else\n',
+    '#if 1 / 0\n#endif\n',
+    '#if 1 +\n#endif\n',
+    '#if 9223372036854775808\n#endif\n',
+    '#if 0x8000000000000000\n#endif\n',
+    "#define S 'abc\nx = S\n",
+    'x = FUNC\n',
+])
+def test_unsupported(tmp_path, source):
+    '''Test the engine refuses sources it doesn't support, and doesn't
+    write the output.'''
+    engine = CppEngine('', {'FUNC': None}, FLAGS)
+    fpath = tmp_path / 'test.F90'
+    fpath.write_text(source)
+    with pytest.raises(UnsupportedPreprocessing):
+        engine.preprocess(fpath, tmp_path / 'test.f90')
+    assert not (tmp_path / 'test.f90').exists()
+
+
+@pytest.mark.parametrize('flags', [
+    FLAGS + ['-E'],
+    FLAGS + ['-D'],
+    FLAGS + ['-DF(x)=x'],
+    ['-P'],
+])
+def test_unsupported_flags(tmp_path, flags):
+    '''Test the engine refuses flags it doesn't support, and needs the
+    flags which give cpp's traditional output.'''
+    engine = CppEngine('', {})
+    fpath = tmp_path / 'test.F90'
+    fpath.write_text('x = 1\n')
+    with pytest.raises(UnsupportedPreprocessing):
+        engine.process(fpath, flags)
+
+
+def test_tool_flags(tmp_path):
+    '''Test the preprocessor's own flags are used before the file's.'''
+    engine = CppEngine('\n', {}, FLAGS + ['-DA=1', '-DB=1'])
+    fpath = tmp_path / 'test.F90'
+    fpath.write_text('x = A B\n')
+    assert engine.process(fpath, ['-DB=2']) == '\nx = 1 2\n'
@@ -52,6 +52,14 @@ def test_remove_flags():
         assert flags == expected
 
 
+def test_remove_flags_long():
+    '''Removing flags from a long list keeps the order of the others.'''
+    flags = Flags(["-c", "a", "-J", "b", "-Jc", "d"] * 10000)
+    with pytest.warns(UserWarning, match="Removing managed flag"):
+        flags.remove_flag("-J", has_parameter=True)
+    assert flags == ["-c", "a", "d"] * 10000
+
+
 def test_flags_checksum():
     '''Tests computation of the checksum.'''
     # I think this is a poor testing pattern.
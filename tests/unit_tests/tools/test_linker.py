@@ -12,7 +12,7 @@ from unittest import mock
 
 import pytest
 
-from fab.tools import (Category, Linker)
+from fab.tools import (Category, Gcc, Linker)
 
 
 def test_linker(mock_c_compiler, mock_fortran_compiler):
@@ -125,3 +125,30 @@ def test_linker_add_compiler_flag(mock_c_compiler):
     tool_run.assert_called_with(
         ['no-compiler.exe', '-some-other-flag', 'a.o', '-o', 'a.out'],
         capture_output=True, env=None, cwd=None, check=False)
+
+
+def test_linker_response_file():
+    '''Test that the linker supports response files if its compiler does.'''
+    assert Linker(compiler=Gcc()).response_file_threshold is not None
+    assert Linker("ld", "ld", "gnu").response_file_threshold is None
+
+
+def test_linker_get_hash(mock_c_compiler):
+    '''Test that the linker hash changes with the compiler and the flags.'''
+    linker = Linker(compiler=mock_c_compiler)
+    first = linker.get_hash()
+    assert linker.get_hash() == first
+
+    mock_c_compiler.flags.append("-my-flag")
+    second = linker.get_hash()
+    assert second != first
+
+    linker.flags.append("-lfoo")
+    assert linker.get_hash() not in [first, second]
+
+    mock_c_compiler._version = (1, 2, 4)
+    assert Linker(compiler=mock_c_compiler).get_hash() != second
+
+    # a linker without a compiler uses its executable name
+    assert (Linker("ld", "ld", "gnu").get_hash() !=
+            Linker("ld", "ld.gold", "gnu").get_hash())
@@ -80,3 +80,26 @@ def test_preprocessor_cppfortran():
     mock_run.assert_called_with(
         ["cpp", "-traditional-cpp", "-P", "-DDO_SOMETHING", "a.in", "a.out"],
         capture_output=True, env=None, cwd=None, check=False)
+
+
+def test_preprocessor_get_hash():
+    '''Tests that the hash depends on the version and flags.'''
+    cppf = CppFortran()
+    with mock.patch.object(cppf, "run", return_value="cpp 12.2.0") as mock_run:
+        hash1 = cppf.get_hash()
+        assert cppf.get_hash() == hash1
+    mock_run.assert_called_once_with("--version")
+
+    cppf = CppFortran()
+    with mock.patch.object(cppf, "run", return_value="cpp 13.1.0"):
+        assert cppf.get_hash() != hash1
+
+    cppf = CppFortran()
+    cppf.flags.append("-DFOO")
+    with mock.patch.object(cppf, "run", return_value="cpp 12.2.0"):
+        assert cppf.get_hash() != hash1
+
+    # A preprocessor which can't be run still has a hash
+    cppf = CppFortran()
+    with mock.patch.object(cppf, "run", side_effect=RuntimeError("not found")):
+        assert cppf.get_hash() != hash1
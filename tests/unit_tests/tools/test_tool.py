@@ -131,6 +131,59 @@ class TestToolRun:
                     in str(err.value))
 
 
+class TestResponseFile:
+    '''Test passing long command lines in a response file.'''
+
+    def test_short(self):
+        '''Short commands are run as they are.'''
+        tool = Tool("gnu", "gfortran", Category.FORTRAN_COMPILER)
+        tool.set_response_file_threshold(100)
+        with mock.patch('fab.tools.tool.subprocess.run',
+                        return_value=mock.Mock(returncode=0)) as tool_run:
+            tool.run(["a", "b"])
+        tool_run.assert_called_once_with(
+            ["gfortran", "a", "b"], capture_output=True, env=None,
+            cwd=None, check=False)
+
+    def test_long(self):
+        '''Long commands get a response file, which is deleted after.'''
+        tool = Tool("gnu", "gfortran", Category.FORTRAN_COMPILER)
+        tool.set_response_file_threshold(10)
+        contents = []
+
+        def run(command, **kwargs):
+            assert len(command) == 2
+            contents.append(Path(command[1][1:]).read_text())
+            return mock.Mock(returncode=0)
+
+        with mock.patch('fab.tools.tool.subprocess.run',
+                        side_effect=run) as tool_run:
+            tool.run(["a.o", "my file.o", 'q"uote\\d'])
+
+        assert contents == ['a.o\nmy\\ file.o\nq\\"uote\\\\d\n']
+        response_file = Path(tool_run.call_args[0][0][1][1:])
+        assert not response_file.exists()
+
+    def test_error(self):
+        '''Errors show the full command, not the response file.'''
+        tool = Tool("gnu", "gfortran", Category.FORTRAN_COMPILER)
+        tool.set_response_file_threshold(10)
+        with mock.patch('fab.tools.tool.subprocess.run',
+                        return_value=mock.Mock(returncode=1)):
+            with pytest.raises(RuntimeError) as err:
+                tool.run(["a_long_argument"])
+        assert "['gfortran', 'a_long_argument']" in str(err.value)
+
+    def test_not_supported(self):
+        '''Tools don't use response files unless they support them.'''
+        tool = Tool("gnu", "gfortran", Category.FORTRAN_COMPILER)
+        assert tool.response_file_threshold is None
+        with mock.patch('fab.tools.tool.subprocess.run',
+                        return_value=mock.Mock(returncode=0)) as tool_run:
+            tool.run(["a"] * 100000)
+        assert len(tool_run.call_args[0][0]) == 100001
+
+
 def test_suite_tool():
     '''Test the constructor.'''
     tool = CompilerSuiteTool("gnu", "gfortran", "gnu",
@@ -70,3 +70,27 @@ def test_tool_box_add_tool_not_avail():
         with pytest.raises(RuntimeError) as err:
             tb.add_tool(gfortran)
         assert f"Tool '{gfortran}' is not available" in str(err.value)
+
+
+def test_tool_box_add_tools():
+    '''Tests adding several tools, which are checked in parallel.'''
+    tb = ToolBox()
+    gfortran = Gfortran()
+    gcc = CCompiler("gcc", "gcc", "gnu")
+    with mock.patch.object(Gfortran, "check_available",
+                           return_value=True) as mock_fc, \
+            mock.patch.object(CCompiler, "check_available",
+                              return_value=True) as mock_cc:
+        tb.add_tools([gfortran, gcc])
+    mock_fc.assert_called_once_with()
+    mock_cc.assert_called_once_with()
+    assert tb[Category.FORTRAN_COMPILER] is gfortran
+    assert tb[Category.C_COMPILER] is gcc
+
+    # An unavailable tool raises an error
+    gcc = CCompiler("gcc", "gcc", "gnu")
+    with mock.patch.object(CCompiler, "check_available",
+                           return_value=False):
+        with pytest.raises(RuntimeError) as err:
+            tb.add_tools([gcc])
+    assert "is not available" in str(err.value)
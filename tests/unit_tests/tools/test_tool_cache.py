@@ -0,0 +1,149 @@
+##############################################################################
+# (c) Crown copyright Met Office. All rights reserved.
+# For further details please refer to the file COPYRIGHT
+# which you should have received as part of this distribution
+##############################################################################
+
+'''Tests the persistent tool cache.
+'''
+
+import os
+from unittest import mock
+
+import pytest
+
+from fab.tools import Category, Tool
+from fab.tools.tool_cache import ToolCache, TOOL_CACHE_FILENAME, get_tool_cache
+
+
+@pytest.fixture(name="exec_path")
+def fixture_exec_path(tmp_path):
+    '''Provides an executable to key the cache on.'''
+    exec_path = tmp_path / "mytool"
+    exec_path.write_text("#!/bin/sh\necho 1.2.3\n")
+    exec_path.chmod(0o755)
+    return exec_path
+
+
+def test_key(exec_path):
+    '''Tests that the key changes when the executable changes.'''
+    key = ToolCache.key(str(exec_path), ["--version"])
+    assert key == ToolCache.key(str(exec_path), ["--version"])
+    assert key != ToolCache.key(str(exec_path), ["-V"])
+
+    stat = exec_path.stat()
+    os.utime(exec_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert key != ToolCache.key(str(exec_path), ["--version"])
+
+
+def test_key_environment(monkeypatch, exec_path):
+    '''Tests that the key changes with the tool's search paths.'''
+    key = ToolCache.key(str(exec_path), ["--version"])
+    monkeypatch.setenv("LD_LIBRARY_PATH", "/opt/compiler/lib")
+    assert key != ToolCache.key(str(exec_path), ["--version"])
+
+
+def test_key_missing_exec(tmp_path):
+    '''Tests that there's no key for a missing executable.'''
+    assert ToolCache.key(str(tmp_path / "missing"), ["--version"]) is None
+
+
+def test_get_set(tmp_path):
+    '''Tests that results are stored and saved to the cache file.'''
+    fpath = tmp_path / "cache.json"
+    cache = ToolCache(fpath)
+    assert cache.get("key") is None
+    cache.set("key", True, "1.2.3")
+    assert cache.get("key") == (True, "1.2.3")
+
+    # A new cache reads the file
+    cache = ToolCache(fpath)
+    assert cache.get("key") == (True, "1.2.3")
+
+
+def test_corrupt_file(tmp_path):
+    '''Tests that a broken cache file is ignored.'''
+    fpath = tmp_path / "cache.json"
+    fpath.write_text("not json")
+    cache = ToolCache(fpath)
+    assert cache.get("key") is None
+    cache.set("key", True, "1.2.3")
+    assert ToolCache(fpath).get("key") == (True, "1.2.3")
+
+
+def test_failure_not_saved(tmp_path):
+    '''Tests that a failure is only remembered by the cache which saw it.'''
+    fpath = tmp_path / "cache.json"
+    cache = ToolCache(fpath)
+    cache.set("key", False, "error")
+    assert cache.get("key") == (False, "error")
+    assert ToolCache(fpath).get("key") is None
+
+    # A later success replaces it
+    cache.set("key", True, "1.2.3")
+    assert cache.get("key") == (True, "1.2.3")
+    assert ToolCache(fpath).get("key") == (True, "1.2.3")
+
+
+def test_disabled(tmp_path):
+    '''Tests that a cache without a file stores nothing.'''
+    cache = ToolCache(None)
+    cache.set("key", True, "1.2.3")
+    assert cache.get("key") is None
+
+
+def test_get_tool_cache(monkeypatch, tmp_path):
+    '''Tests the cache location comes from the environment.'''
+    # Disabled by the test fixture
+    assert get_tool_cache().fpath is None
+
+    monkeypatch.setenv("FAB_TOOL_CACHE", str(tmp_path / "cache.json"))
+    assert get_tool_cache().fpath == tmp_path / "cache.json"
+    assert get_tool_cache() is get_tool_cache()
+
+    monkeypatch.delenv("FAB_TOOL_CACHE")
+    monkeypatch.setenv("FAB_WORKSPACE", str(tmp_path))
+    assert get_tool_cache().fpath == tmp_path / TOOL_CACHE_FILENAME
+
+
+def test_run_cached(monkeypatch, tmp_path, exec_path):
+    '''Tests that the second probe of a tool doesn't run it.'''
+    monkeypatch.setenv("FAB_TOOL_CACHE", str(tmp_path / "cache.json"))
+    tool = Tool("mytool", str(exec_path), Category.MISC)
+    with mock.patch.object(tool, "run", return_value="1.2.3") as mock_run:
+        assert tool.run_cached("--version") == "1.2.3"
+        assert tool.run_cached("--version") == "1.2.3"
+    mock_run.assert_called_once_with("--version")
+
+    # Failures are cached too, by this process
+    with mock.patch.object(tool, "run",
+                           side_effect=RuntimeError("bad")) as mock_run:
+        for _ in range(2):
+            with pytest.raises(RuntimeError) as err:
+                tool.run_cached("-V")
+            assert str(err.value) == "bad"
+    mock_run.assert_called_once_with("-V")
+
+
+def test_run_cached_disabled(exec_path):
+    '''Tests that the tool is run every time without a cache.'''
+    tool = Tool("mytool", str(exec_path), Category.MISC)
+    with mock.patch.object(tool, "run", return_value="1.2.3") as mock_run:
+        tool.run_cached("--version")
+        tool.run_cached("--version")
+    assert mock_run.call_count == 2
+
+
+def test_run_cached_failure_not_saved(monkeypatch, tmp_path, exec_path):
+    '''Tests that a failed probe is run again with a new cache, e.g. in
+    the next build.'''
+    monkeypatch.setenv("FAB_TOOL_CACHE", str(tmp_path / "cache.json"))
+    tool = Tool("mytool", str(exec_path), Category.MISC)
+    with mock.patch.object(tool, "run", side_effect=RuntimeError("bad")):
+        with pytest.raises(RuntimeError):
+            tool.run_cached("-V")
+
+    monkeypatch.setenv("FAB_WORKSPACE", str(tmp_path))
+    with mock.patch.object(tool, "run", return_value="1.2.3") as mock_run:
+        assert tool.run_cached("-V") == "1.2.3"
+    mock_run.assert_called_once_with("-V")
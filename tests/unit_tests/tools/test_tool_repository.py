@@ -7,10 +7,13 @@
 '''This module tests the ToolRepository.
 '''
 
+from unittest import mock
+
 import pytest
 
 
-from fab.tools import Category, Gcc, Gfortran, Ifort, Linker, ToolRepository
+from fab.tools import (Category, Gcc, Gfortran, Ifort, Linker, Tool,
+                       ToolRepository)
 
 
 def test_tool_repository_get_singleton_new():
@@ -94,3 +97,42 @@ def test_tool_repository_default_compiler_suite():
         tr.set_default_compiler_suite("does-not-exist")
     assert ("Cannot find 'FORTRAN_COMPILER' in the suite 'does-not-exist'"
             in str(err.value))
+
+
+def test_tool_repository_lazy():
+    '''Tests that tools are only created when their category is looked
+    up, and that a compiler and its linker share the same instance.'''
+    def created(category):
+        return [tool for tool in dict.__getitem__(tr, category)
+                if isinstance(tool, Tool)]
+
+    ToolRepository._singleton = None
+    with mock.patch("subprocess.run") as mock_run:
+        tr = ToolRepository()
+        for category in Category:
+            assert created(category) == []
+
+        gcc = tr.get_default(Category.C_COMPILER)
+        assert isinstance(gcc, Gcc)
+        assert created(Category.FORTRAN_COMPILER) == []
+
+        gfortran = tr.get_tool(Category.FORTRAN_COMPILER, "gfortran")
+        linker = tr.get_tool(Category.LINKER, "linker-gfortran")
+        assert linker._compiler is gfortran
+    mock_run.assert_not_called()
+    ToolRepository._singleton = None
+
+
+def test_tool_repository_add_tool_lazy():
+    '''Tests adding a tool which is created on first lookup.'''
+    ToolRepository._singleton = None
+    tr = ToolRepository()
+    mock_cls = mock.Mock(return_value=Gfortran(name="my-gfortran"))
+    tr.add_tool(mock_cls, Category.FORTRAN_COMPILER)
+    mock_cls.assert_not_called()
+
+    tool = tr.get_tool(Category.LINKER, "linker-my-gfortran")
+    assert tool.name == "linker-my-gfortran"
+    assert tr.get_tool(Category.FORTRAN_COMPILER, "my-gfortran")
+    mock_cls.assert_called_once_with()
+    ToolRepository._singleton = None